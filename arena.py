@@ -0,0 +1,581 @@
+import ctypes
+import random
+import time
+from collections import deque
+from pygame.locals import *
+from OpenGL.GL import *
+from OpenGL.GLU import *
+from config import *
+from utils import clamp, next_state_version
+from graphics import (
+    draw_arrays,
+    draw_background,
+    draw_planar_floor,
+    end_cube_material,
+    gl_resources,
+    gl_state,
+    rect_loop,
+    setup_lights,
+    setup_point_lights,
+    use_cube_material,
+    use_unlit,
+)
+from scene_cache import SceneCache
+from particles import particle_pool
+from shadows import shadow_maps
+from snake_mesh import SLOT_BYTES, SLOT_VERTICES, VERTEX_STRIDE, cube_vertex_data
+
+# Moves in counterclockwise order, so a left turn is the next one
+DIRECTIONS = ((1, 0), (0, 1), (-1, 0), (0, -1))
+START_LENGTH = 3
+# Chance per tick that a bot tries a random turn before going straight
+BOT_TURN_CHANCE = 0.1
+# Random cells tried when placing a snake or a food before giving up for this tick
+PLACE_ATTEMPTS = 20
+
+
+class ArenaSnake:
+    """One snake of the arena: its cells, head first, and where it is heading."""
+
+    __slots__ = ("id", "body", "direction", "alive", "score", "dead_since")
+
+    def __init__(self, snake_id):
+        """Starts dead; the arena places it on the board."""
+        self.id = snake_id
+        self.body = deque()
+        self.direction = 0
+        self.alive = False
+        self.score = 0
+        self.dead_since = 0
+
+
+class ArenaGame:
+    """Many-snake mode: the player against bots on one large planar board.
+
+    Every body cell is recorded in `cells`, a flat occupancy grid holding the number
+    of the snake on it (id + 1) or 0, and food cells are kept in a set. A tick works
+    out each snake's next head, then resolves every collision with one lookup per
+    head: into the grid for bodies, where the tail of a snake that is not growing
+    counts as free, and into a per-tick count of heads for head-on crashes. A tick
+    therefore costs O(snakes) whatever the total body length; only the cells of
+    snakes that died are visited besides.
+    """
+
+    def __init__(
+        self,
+        grid_size=ARENA_SIZE,
+        snake_count=ARENA_SNAKES,
+        food_count=ARENA_FOOD,
+        seed=None,
+    ):
+        """Initializes an arena of (width, height) cells; snake 0 is the player's."""
+        self.width, self.height = grid_size
+        self.snake_count = snake_count
+        self.food_count = food_count
+        self.random = random.Random(seed)
+        # Inclusive cell bounds in world units, centered like the planar board
+        self.GRID_X = (-(self.width // 2), self.width - 1 - self.width // 2)
+        self.GRID_Y = (-(self.height // 2), self.height - 1 - self.height // 2)
+
+        self.scene_cache = SceneCache()
+        self.mesh = ArenaMesh()
+
+        self.cam_keys = {
+            "up": False,
+            "down": False,
+            "left": False,
+            "right": False,
+            "zoom_in": False,
+            "zoom_out": False,
+        }
+        # Distance that fits the whole board on screen
+        aspect = DISPLAY_SIZE[0] / DISPLAY_SIZE[1]
+        self.view_distance = 1.3 * max(self.height, self.width / aspect)
+
+        self.reset()
+
+    def reset(self):
+        """Clears the board and places every snake and the food again."""
+        self.cells = [0] * (self.width * self.height)
+        self.food = set()
+        self.snakes = [ArenaSnake(i) for i in range(self.snake_count)]
+        self.player = self.snakes[0]
+        self.turns = deque()
+        # (input time, tick time) of the turn the next tick applies
+        self.pending_input = None
+        # (input time, tick time, state version) of the turns applied since last taken
+        self.applied_inputs = []
+        self.ticks = 0
+        self.deaths = 0
+        # Score of the last frame drawn, to burst particles when it goes up
+        self.shown_score = 0
+        # Seconds played, added by the frame loop
+        self.play_time = 0.0
+        self.cam_pitch = 0
+        self.cam_yaw = 0
+        self.cam_zoom = -self.view_distance
+
+        # The player starts in the middle heading right, like on the planar board
+        self.place(self.player, self.width // 2, self.height // 2, 0)
+        for snake in self.snakes[1:]:
+            self.spawn(snake)
+        self.refill_food()
+        self.version = next_state_version()
+        self.epoch = self.version
+
+        for k in self.cam_keys:
+            self.cam_keys[k] = False
+
+    @property
+    def score(self):
+        """The player's score."""
+        return self.player.score
+
+    def session_stats(self):
+        """Returns the player's score, length and ticks played, for session_store."""
+        # A dead player's body is cleared; it had grown a cell per point
+        return self.score, START_LENGTH + self.score, self.ticks
+
+    def alive_count(self):
+        """Returns the number of snakes on the board."""
+        return sum(1 for snake in self.snakes if snake.alive)
+
+    def place(self, snake, x, y, direction):
+        """Puts a dead snake's head on (x, y), or returns False if it does not fit.
+
+        The body trails behind the head, and the cells ahead must be on the board so
+        the snake is not born facing a wall.
+        """
+        w, h = self.width, self.height
+        dx, dy = DIRECTIONS[direction]
+        cells = [(x - dx * i, y - dy * i) for i in range(-START_LENGTH, START_LENGTH)]
+        if not all(0 <= cx < w and 0 <= cy < h for cx, cy in cells):
+            return False
+        body = [cy * w + cx for cx, cy in cells[START_LENGTH:]]
+        if any(self.cells[c] or c in self.food for c in body):
+            return False
+        for c in body:
+            self.cells[c] = snake.id + 1
+        snake.body = deque(body)
+        snake.direction = direction
+        snake.alive = True
+        return True
+
+    def spawn(self, snake):
+        """Places a dead snake on random free cells, returning False if none fit."""
+        for _ in range(PLACE_ATTEMPTS):
+            x = self.random.randrange(self.width)
+            y = self.random.randrange(self.height)
+            if self.place(snake, x, y, self.random.randrange(4)):
+                return True
+        return False
+
+    def refill_food(self):
+        """Adds food on random free cells until there are food_count of them."""
+        cells = self.cells
+        for _ in range(PLACE_ATTEMPTS):
+            if len(self.food) >= self.food_count:
+                return
+            c = self.random.randrange(len(cells))
+            if not cells[c]:
+                self.food.add(c)
+
+    def process_event(self, event):
+        """Handles the player's turns and the camera keys, like the planar mode."""
+        if event.type == KEYDOWN:
+            if event.key == K_LEFT:
+                self.queue_turn("LEFT")
+            elif event.key == K_RIGHT:
+                self.queue_turn("RIGHT")
+
+            if event.key == K_w:
+                self.cam_keys["up"] = True
+            elif event.key == K_s:
+                self.cam_keys["down"] = True
+            elif event.key == K_a:
+                self.cam_keys["left"] = True
+            elif event.key == K_d:
+                self.cam_keys["right"] = True
+            elif event.key == K_q:
+                self.cam_keys["zoom_in"] = True
+            elif event.key == K_e:
+                self.cam_keys["zoom_out"] = True
+
+        elif event.type == KEYUP:
+            if event.key == K_w:
+                self.cam_keys["up"] = False
+            elif event.key == K_s:
+                self.cam_keys["down"] = False
+            elif event.key == K_a:
+                self.cam_keys["left"] = False
+            elif event.key == K_d:
+                self.cam_keys["right"] = False
+            elif event.key == K_q:
+                self.cam_keys["zoom_in"] = False
+            elif event.key == K_e:
+                self.cam_keys["zoom_out"] = False
+
+    def queue_turn(self, turn, event_time=None):
+        """Queues a turn for the coming ticks, one per tick; extra presses are dropped."""
+        if len(self.turns) < TURN_QUEUE_SIZE:
+            self.turns.append((turn, event_time or time.perf_counter()))
+
+    def update_camera(self):
+        """Updates camera rotation based on current key flags."""
+        if self.cam_keys["up"]:
+            self.cam_pitch = clamp(self.cam_pitch + 1.5, -90, 90)
+        if self.cam_keys["down"]:
+            self.cam_pitch = clamp(self.cam_pitch - 1.5, -90, 90)
+        if self.cam_keys["left"]:
+            self.cam_yaw = clamp(self.cam_yaw - 1.5, -90, 90)
+        if self.cam_keys["right"]:
+            self.cam_yaw = clamp(self.cam_yaw + 1.5, -90, 90)
+
+        near, far = 0.3 * self.view_distance, 1.6 * self.view_distance
+        if self.cam_keys["zoom_in"]:
+            self.cam_zoom = clamp(self.cam_zoom + 0.5, -far, -near)
+        if self.cam_keys["zoom_out"]:
+            self.cam_zoom = clamp(self.cam_zoom - 0.5, -far, -near)
+
+    def steer_bot(self, snake):
+        """Points a bot at adjacent food, else straight on or a free side cell."""
+        w, h = self.width, self.height
+        head = snake.body[0]
+        x, y = head % w, head // w
+        d = snake.direction
+        left, right = (d + 1) % 4, (d + 3) % 4
+        if self.random.random() < BOT_TURN_CHANCE:
+            if self.random.random() < 0.5:
+                options = (left, d, right)
+            else:
+                options = (right, d, left)
+        else:
+            options = (d, left, right)
+
+        choice = None
+        for option in options:
+            dx, dy = DIRECTIONS[option]
+            nx, ny = x + dx, y + dy
+            if not (0 <= nx < w and 0 <= ny < h):
+                continue
+            c = ny * w + nx
+            if c in self.food:
+                choice = option
+                break
+            if choice is None and not self.cells[c]:
+                choice = option
+        if choice is not None:
+            snake.direction = choice
+
+    def plan_moves(self):
+        """Steers every snake and returns (snake, next head cell or None if off the board)."""
+        turn, event_time = self.turns.popleft() if self.turns else (None, None)
+        if turn == "LEFT":
+            self.player.direction = (self.player.direction + 1) % 4
+        elif turn == "RIGHT":
+            self.player.direction = (self.player.direction + 3) % 4
+        if turn:
+            self.pending_input = (event_time, time.perf_counter())
+
+        w, h = self.width, self.height
+        moves = []
+        for snake in self.snakes:
+            if not snake.alive:
+                continue
+            if snake is not self.player:
+                self.steer_bot(snake)
+            head = snake.body[0]
+            dx, dy = DIRECTIONS[snake.direction]
+            nx, ny = head % w + dx, head // w + dy
+            if 0 <= nx < w and 0 <= ny < h:
+                moves.append((snake, ny * w + nx))
+            else:
+                moves.append((snake, None))
+        return moves
+
+    def find_collisions(self, moves):
+        """Returns the snakes whose planned move kills them, in one pass over the heads.
+
+        A head dies off the board, on a body cell or on a cell another head also moves
+        to. Tails move away in the same tick, so the tail cell of a snake that is not
+        about to eat counts as free.
+        """
+        cells = self.cells
+        snakes = self.snakes
+        heads = {}
+        growing = set()
+        for snake, c in moves:
+            if c is not None:
+                heads[c] = heads.get(c, 0) + 1
+                if c in self.food:
+                    growing.add(snake.id)
+
+        dead = []
+        for snake, c in moves:
+            if c is None or heads[c] > 1:
+                dead.append(snake)
+                continue
+            owner = cells[c] - 1
+            if owner >= 0 and (c != snakes[owner].body[-1] or owner in growing):
+                dead.append(snake)
+        return dead
+
+    def update(self):
+        """Advances every snake one cell; returns False once the player has died."""
+        moves = self.plan_moves()
+        dead = self.find_collisions(moves)
+        dead_ids = {snake.id for snake in dead}
+
+        cells = self.cells
+        for snake in dead:
+            for c in snake.body:
+                if cells[c] == snake.id + 1:
+                    cells[c] = 0
+            snake.body.clear()
+            snake.alive = False
+            snake.dead_since = self.ticks
+        self.deaths += len(dead)
+
+        for snake, c in moves:
+            if snake.id in dead_ids:
+                continue
+            body = snake.body
+            if c in self.food:
+                self.food.discard(c)
+                snake.score += 1
+            else:
+                tail = body.pop()
+                # The snake's own head may have just claimed its tail cell
+                if cells[tail] == snake.id + 1:
+                    cells[tail] = 0
+            cells[c] = snake.id + 1
+            body.appendleft(c)
+
+        self.ticks += 1
+        for snake in self.snakes:
+            if (
+                not snake.alive
+                and snake is not self.player
+                and self.ticks - snake.dead_since >= ARENA_RESPAWN_TICKS
+            ):
+                self.spawn(snake)
+        self.refill_food()
+
+        self.version = next_state_version()
+        if self.pending_input:
+            self.applied_inputs.append((*self.pending_input, self.version))
+            self.pending_input = None
+        return self.player.alive
+
+    def cell_position(self, c):
+        """Returns the world (x, y) of a cell index."""
+        return (c % self.width + self.GRID_X[0], c // self.width + self.GRID_Y[0])
+
+    def point_lights(self):
+        """Returns the (position, color) point light following the player's head."""
+        if not self.player.alive:
+            return []
+        x, y = self.cell_position(self.player.body[0])
+        return [((x, y, 2.0, 1.0), (0.1, 0.6, 0.1, 1.0))]
+
+    def shadow_lights(self):
+        """Returns (position, direction) of the shadow-casting lights, matching point_lights."""
+        return [(pos[:3], (0, 0, -1)) for pos, _ in self.point_lights()]
+
+    def draw_shadow_casters(self):
+        """Draws the depth of every snake and food cube for a shadow pass."""
+        self.mesh.draw_depth()
+
+    def release_resources(self):
+        """Frees this game's GL objects; drawing it again recreates them."""
+        self.scene_cache.release()
+        self.mesh.release()
+
+    def render(
+        self,
+        snake_tex_id=None,
+        floor_tex_id=None,
+        apple_tex_id=None,
+        bg_tex_id=None,
+        shader_program=None,
+        time=0,
+    ):
+        """Renders the arena: floor, border, and every snake and food as batched cubes."""
+        self.mesh.sync(self)
+        shadow_maps.update(self)
+
+        draw_background(bg_tex_id)
+
+        glMatrixMode(GL_PROJECTION)
+        glLoadIdentity()
+        gluPerspective(
+            45, DISPLAY_SIZE[0] / DISPLAY_SIZE[1], 0.1, 2.0 * self.view_distance
+        )
+
+        glMatrixMode(GL_MODELVIEW)
+        glLoadIdentity()
+        glTranslatef(0.0, 0.0, self.cam_zoom)
+        glRotatef(self.cam_pitch, 1, 0, 0)
+        glRotatef(self.cam_yaw, 0, 1, 0)
+        shadow_maps.use_camera()
+
+        setup_lights((0, 0, 20, 1))
+        setup_point_lights(self.point_lights())
+
+        self.scene_cache.draw(
+            ("arena", floor_tex_id, self.GRID_X, self.GRID_Y),
+            lambda: self.draw_board(floor_tex_id),
+        )
+        self.mesh.draw(snake_tex_id, apple_tex_id)
+
+        # The player's head is on the cell of the food it just ate
+        if self.score > self.shown_score and self.player.alive:
+            x, y = self.cell_position(self.player.body[0])
+            particle_pool.food_burst((x, y, 0))
+        self.shown_score = self.score
+        particle_pool.draw()
+
+    def draw_board(self, floor_tex_id):
+        """Draws the floor and its border, which never change during a game."""
+        draw_planar_floor(self.GRID_X, self.GRID_Y, floor_tex_id)
+
+        use_unlit()
+        gl_state.set_line_width(3.0)
+        glColor3f(*COLOR_BORDER)
+        x0, x1 = self.GRID_X[0] - 0.5, self.GRID_X[1] + 0.5
+        y0, y1 = self.GRID_Y[0] - 0.5, self.GRID_Y[1] + 0.5
+        draw_arrays(GL_LINE_LOOP, rect_loop(x0, y0, x1, y1, 0))
+        gl_state.enable(GL_LIGHTING)
+
+
+class ArenaMesh:
+    """One vertex buffer holding every snake and food cube of the arena.
+
+    With many snakes moving at once the whole buffer is rewritten after each tick,
+    but a cube on a given cell always has the same vertices, so they are packed once
+    per cell and size and a rebuild only joins cached blocks. Only the blocks of the
+    last rebuild are kept, so the cache never outgrows what is on the board, and a
+    cube that stays where it was is not packed again. Cubes are grouped by
+    material and each group is drawn with one call. Outlines are left out, as with
+    hundreds of snakes they would hide the colors.
+    """
+
+    def __init__(self):
+        """Starts without a buffer; it is created on the first sync."""
+        self.vbo = None
+        self.capacity = 0
+        self.version = None
+        self.groups = []
+        # (cell, scale) -> packed vertices, of the cubes of the last rebuild
+        self.blocks = {}
+        self.used = {}
+
+    def release(self):
+        """Deletes the buffer and forgets the packed cubes."""
+        if self.vbo is not None:
+            gl_resources.release("buffer", self.vbo)
+        self.vbo = None
+        self.capacity = 0
+        self.version = None
+        self.groups = []
+        self.blocks = {}
+        self.used = {}
+
+    def _block(self, game, c, scale):
+        """Returns the packed vertices of a cube of `scale` on cell `c`."""
+        key = (c, scale)
+        block = self.blocks.get(key)
+        if block is None:
+            x, y = game.cell_position(c)
+            block = cube_vertex_data([(x, y, 0, scale)]).tobytes()
+        self.used[key] = block
+        return block
+
+    def sync(self, game):
+        """Rewrites the buffer if the game ticked since the last sync."""
+        if game.version == self.version and self.vbo is not None:
+            return
+        self.version = game.version
+
+        head_scale = 0.9 * CELL_SCALE_FACTOR
+        body_scale = 0.85 * CELL_SCALE_FACTOR
+        # (color, emission, is food) -> packed cubes
+        materials = {}
+        for snake in game.snakes:
+            if not snake.alive:
+                continue
+            if snake is game.player:
+                head = (COLOR_HEAD, 0.5, False)
+                body = (COLOR_BODY, 0.2, False)
+            else:
+                color = ARENA_COLORS[snake.id % len(ARENA_COLORS)]
+                head = (color, 0.4, False)
+                body = (color, 0.1, False)
+            cubes = iter(snake.body)
+            materials.setdefault(head, []).append(
+                self._block(game, next(cubes), head_scale)
+            )
+            blocks = materials.setdefault(body, [])
+            for c in cubes:
+                blocks.append(self._block(game, c, body_scale))
+        food = materials.setdefault((COLOR_FOOD, 0.5, True), [])
+        for c in game.food:
+            food.append(self._block(game, c, 0.6 * CELL_SCALE_FACTOR))
+        self.blocks, self.used = self.used, {}
+
+        self.groups = []
+        first = 0
+        for material, blocks in materials.items():
+            self.groups.append((material, first, len(blocks)))
+            first += len(blocks)
+        data = b"".join(block for blocks in materials.values() for block in blocks)
+
+        if self.vbo is None:
+            self.vbo = gl_resources.add("buffer", glGenBuffers(1), "arena mesh")
+        glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
+        if len(data) > self.capacity:
+            # Grow with headroom so a growing arena does not reallocate every tick
+            self.capacity = max(len(data) * 3 // 2, SLOT_BYTES)
+            glBufferData(GL_ARRAY_BUFFER, self.capacity, None, GL_DYNAMIC_DRAW)
+            gl_resources.resize("buffer", self.vbo, self.capacity)
+        if data:
+            glBufferSubData(GL_ARRAY_BUFFER, 0, len(data), data)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+    def draw(self, snake_tex_id=None, apple_tex_id=None):
+        """Draws every group with its material."""
+        if not self.groups:
+            return
+
+        gl_state.enable(GL_LIGHTING)
+        glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
+        glEnableClientState(GL_VERTEX_ARRAY)
+        glEnableClientState(GL_NORMAL_ARRAY)
+        glEnableClientState(GL_TEXTURE_COORD_ARRAY)
+        glVertexPointer(3, GL_FLOAT, VERTEX_STRIDE, ctypes.c_void_p(0))
+        glNormalPointer(GL_FLOAT, VERTEX_STRIDE, ctypes.c_void_p(12))
+        glTexCoordPointer(2, GL_FLOAT, VERTEX_STRIDE, ctypes.c_void_p(24))
+        for (color, emission, is_food), first, count in self.groups:
+            if not count:
+                continue
+            texture_id = apple_tex_id if is_food else snake_tex_id
+            use_cube_material(color, emission, texture_id)
+            glDrawArrays(GL_QUADS, first * SLOT_VERTICES, count * SLOT_VERTICES)
+        glDisableClientState(GL_TEXTURE_COORD_ARRAY)
+        glDisableClientState(GL_NORMAL_ARRAY)
+        glDisableClientState(GL_VERTEX_ARRAY)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+        end_cube_material()
+
+    def draw_depth(self):
+        """Draws only the cubes' positions, for depth passes."""
+        if not self.groups:
+            return
+
+        count = sum(count for _, _, count in self.groups)
+        glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
+        glEnableClientState(GL_VERTEX_ARRAY)
+        glVertexPointer(3, GL_FLOAT, VERTEX_STRIDE, ctypes.c_void_p(0))
+        glDrawArrays(GL_QUADS, 0, count * SLOT_VERTICES)
+        glDisableClientState(GL_VERTEX_ARRAY)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
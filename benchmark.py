@@ -0,0 +1,1395 @@
+import asyncio
+import datetime
+import json
+import math
+import os
+import platform as host_platform
+import random
+import resource
+import settings
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+if __name__ == "__main__":
+    # Before config is imported, which applies the settings flags
+    settings.use_command_line(sys.argv[1:])
+
+import pygame
+import OpenGL
+from pygame.locals import *
+from config import *  # before OpenGL.GL, which reads the GL_DEBUG flags on import
+from OpenGL.GL import *
+from OpenGL.GLU import *
+from graphics import (
+    LIGHTING_PATHS,
+    OUTLINE_MODES,
+    RENDER_SCALES,
+    draw_cube_outlines,
+    draw_cube_silhouettes,
+    draw_rect_2d,
+    draw_text_gl,
+    float_array,
+    gl_resources,
+    render_options,
+    shader_lighting,
+)
+from arena import ArenaGame
+from logic_2d import PlanarGame
+from logic_cube import CubeGame
+from fonts import font_cache
+from frame_scheduler import FrameScheduler
+from hud import hud_layer
+from particles import ParticlePool
+from protocol import (
+    CELLS,
+    DELTA_TURN,
+    MODE_PLANAR,
+    MSG_KEYFRAME,
+    GameStream,
+    encode_join,
+    encode_turn,
+    read_message,
+)
+from main import (
+    create_checkerboard_texture,
+    draw_menu_screen,
+    release_scene_resources,
+)
+from render_target import scene_target
+import savegame
+from server import GameServer
+import sessions
+from simulation import Simulation, jitter_stats
+from spectator import SpectatorWall
+from utils import load_shader_program, next_state_version
+
+
+class Results:
+    """Measurements recorded by the benchmarks, for the JSON report and baselines.
+
+    Each benchmark records named metrics with their unit and whether lower or
+    higher is better, next to the table it prints.
+    """
+
+    def __init__(self):
+        """Starts empty."""
+        self.benchmarks = {}
+        self.current = None
+        self.gl_info = None
+
+    def start(self, name):
+        """Makes `name` the benchmark that the next metrics belong to."""
+        self.current = self.benchmarks.setdefault(name, {})
+
+    def record(self, metric, value, unit="ms", better="lower"):
+        """Records one metric of the running benchmark."""
+        self.current[metric] = {"value": value, "unit": unit, "better": better}
+
+
+results = Results()
+
+
+def create_context(size=DISPLAY_SIZE):
+    """Opens a hidden OpenGL window so scenes can be rendered without showing anything."""
+    pygame.init()
+    pygame.display.set_mode(size, DOUBLEBUF | OPENGL | HIDDEN)
+    glEnable(GL_DEPTH_TEST)
+    if results.gl_info is None:
+        results.gl_info = {
+            "gl_vendor": glGetString(GL_VENDOR).decode(),
+            "gl_renderer": glGetString(GL_RENDERER).decode(),
+            "gl_version": glGetString(GL_VERSION).decode(),
+        }
+
+
+def serpentine_cells(grid_x, grid_y, length):
+    """Returns `length` adjacent cells filling the grid row by row, head first."""
+    cells = []
+    for row, y in enumerate(range(grid_y[0], grid_y[1] + 1)):
+        xs = range(grid_x[0], grid_x[1] + 1)
+        if row % 2:
+            xs = reversed(xs)
+        cells.extend((x, y) for x in xs)
+    if length > len(cells):
+        raise ValueError(f"A snake of {length} cells does not fit the grid")
+    return list(reversed(cells[:length]))
+
+
+def planar_game_with_cells(count):
+    """Creates a planar game with at least `count` cells, and a path through them."""
+    half = 10
+    while (2 * half + 1) ** 2 < count:
+        half *= 2
+    game = PlanarGame((2 * half + 1, 2 * half + 1))
+    cells = serpentine_cells(game.GRID_X, game.GRID_Y, count)
+    return game, list(reversed(cells))
+
+
+def place_snake(game, path, length):
+    """Puts a snake of `length` on the start of `path`, as if the game had been reset."""
+    game.snake = list(reversed(path[:length]))
+    game.head_seq = length - 1
+    game.version = next_state_version()
+    game.epoch = game.version
+
+
+def planar_game_with_length(length):
+    """Creates a planar game on a board just large enough for a snake of `length`."""
+    game, path = planar_game_with_cells(length + 1)
+    place_snake(game, path, length)
+    game.food = game.get_safe_food()
+    game.cam_zoom = -50
+    return game
+
+
+def time_frames(draw, frames):
+    """Renders `frames` frames with `draw` and returns the mean frame time in ms."""
+    draw()
+    glFinish()
+    start = time.perf_counter()
+    for _ in range(frames):
+        glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
+        draw()
+        glFinish()
+    return (time.perf_counter() - start) * 1000 / frames
+
+
+def bench_outline(lengths=(100, 1000, 10000), frames=10):
+    """Compares frame times of the outline techniques at growing snake lengths."""
+    create_context()
+    print(f"{'length':>8}" + "".join(f"{mode:>12}" for mode in OUTLINE_MODES))
+    for length in lengths:
+        game = planar_game_with_length(length)
+        row = f"{length:>8}"
+        for mode in OUTLINE_MODES:
+            render_options.outline_mode = mode
+            frame_ms = time_frames(game.render, frames)
+            results.record(f"length={length} {mode}", frame_ms)
+            row += f"{frame_ms:>10.2f}ms"
+        print(row)
+
+
+def ring_lights(count, radius=6.0):
+    """Returns `count` colored point lights spread on a circle over the planar board."""
+    lights = []
+    for i in range(count):
+        a = 2 * math.pi * i / count
+        color = (0.3 + 0.3 * math.cos(a), 0.3 + 0.3 * math.sin(a), 0.3, 1.0)
+        lights.append(((radius * math.cos(a), radius * math.sin(a), 2.0, 1.0), color))
+    return lights
+
+
+def bench_lighting(light_counts=(1, 2, 4, 7, 16), frames=20):
+    """Compares per-pixel shader lighting with fixed-function lighting per light count.
+
+    The fixed pipeline has 7 point lights, so its column is capped there.
+    """
+    create_context()
+    shader_lighting.set_program(load_shader_program("lit.vert", "lit.frag"))
+    game = PlanarGame()
+    print(f"{'lights':>8}" + "".join(f"{path:>12}" for path in LIGHTING_PATHS))
+    for count in light_counts:
+        game.point_lights = lambda: ring_lights(count)
+        row = f"{count:>8}"
+        for path in LIGHTING_PATHS:
+            render_options.lighting = path
+            frame_ms = time_frames(game.render, frames)
+            results.record(f"lights={count} {path}", frame_ms)
+            row += f"{frame_ms:>10.2f}ms"
+        print(row)
+
+
+def bench_scene_cache(lengths=(3, 100, 1000), ticks=4, frames_per_tick=8):
+    """Compares frame times with and without the tick-cached display list.
+
+    Every `frames_per_tick` frames the game state version is bumped, as update()
+    does, so one frame per tick records the list and the others replay it.
+    """
+    create_context()
+    shader_lighting.set_program(load_shader_program("lit.vert", "lit.frag"))
+    print(f"{'length':>8}{'uncached':>12}{'cached':>12}")
+    for length in lengths:
+        game = planar_game_with_length(length)
+        frame = [0]
+
+        def draw():
+            if frame[0] % frames_per_tick == 0:
+                game.version = next_state_version()
+            frame[0] += 1
+            game.render()
+
+        row = f"{length:>8}"
+        for cached in (False, True):
+            render_options.scene_cache = cached
+            frame_ms = time_frames(draw, ticks * frames_per_tick)
+            name = "cached" if cached else "uncached"
+            results.record(f"length={length} {name}", frame_ms)
+            row += f"{frame_ms:>10.2f}ms"
+        print(row)
+
+
+def bench_render_scale(frames=20):
+    """Compares frame times of both games rendered at each render scale."""
+    create_context()
+    shader_lighting.set_program(load_shader_program("lit.vert", "lit.frag"))
+    print(f"{'game':>8}" + "".join(f"{scale:>12}" for scale in RENDER_SCALES))
+    for name, game in (("planar", PlanarGame()), ("cube", CubeGame())):
+        row = f"{name:>8}"
+        for scale in RENDER_SCALES:
+
+            def draw():
+                scene_target.begin(scale)
+                game.render()
+                scene_target.finish()
+
+            frame_ms = time_frames(draw, frames)
+            results.record(f"{name} scale={scale}", frame_ms)
+            row += f"{frame_ms:>10.2f}ms"
+        print(row)
+
+
+def bench_hud(draws=500, frames=30, frames_per_point=20):
+    """Compares the HUD drawn from text each frame with the cached HUD layer.
+
+    The score goes up every `frames_per_point` HUD draws, so the cached layer is
+    rebuilt that often. The HUD alone is timed over `draws` draws in a row, since a
+    single one is lost in the noise of a frame, and then in planar frames.
+    """
+    create_context()
+    shader_lighting.set_program(load_shader_program("lit.vert", "lit.frag"))
+    font = font_cache.load("Arial", 25)
+    game = PlanarGame()
+    count = [0]
+
+    def score():
+        count[0] += 1
+        return count[0] // frames_per_point
+
+    def immediate_hud():
+        draw_rect_2d(10, DISPLAY_SIZE[1] - 80, 250, 70, (0.0, 0.0, 0.0, 0.6))
+        draw_text_gl(20, DISPLAY_SIZE[1] - 40, f"Score: {score()}", font, (255, 215, 0))
+        draw_text_gl(
+            20, DISPLAY_SIZE[1] - 70, "WASD: Cam | Arrows: Move", font, (200, 200, 200)
+        )
+
+    def cached_hud():
+        hud_layer.draw(
+            font,
+            [
+                (f"Score: {score()}", (255, 215, 0)),
+                ("WASD: Cam | Arrows: Move", (200, 200, 200)),
+            ],
+        )
+
+    print(f"{'hud':>10}{'per draw':>12}{'frame':>12}{'uploads':>9}")
+    for name, hud in (("immediate", immediate_hud), ("cached", cached_hud)):
+
+        def draw_frame():
+            game.render()
+            hud()
+
+        # The immediate HUD uploads a texture per text line on every draw
+        count[0] = 0
+        builds = hud_layer.builds
+        hud()
+        glFinish()
+        start = time.perf_counter()
+        for _ in range(draws):
+            hud()
+        glFinish()
+        hud_ms = (time.perf_counter() - start) * 1000 / draws
+        uploads = hud_layer.builds - builds if hud is cached_hud else 2 * draws + 2
+        frame_ms = time_frames(draw_frame, frames)
+        results.record(f"{name} per draw", hud_ms)
+        results.record(f"{name} frame", frame_ms)
+        results.record(f"{name} uploads", uploads, "uploads")
+        print(f"{name:>10}{hud_ms:>10.3f}ms{frame_ms:>10.2f}ms{uploads:>9}")
+
+
+def bench_gl_soak(cycles=40, frames=5, report_every=5):
+    """Plays both modes in turn, leaving to the menu after each, and tracks memory.
+
+    Every visit renders `frames` frames at a reduced render scale with the HUD, so
+    every kind of GL object is created, and leaving the mode releases them the way
+    main() does. Live objects, their estimated size and the peak process memory
+    should stay flat from the first cycles on.
+    """
+    create_context()
+    shader_lighting.set_program(load_shader_program("lit.vert", "lit.frag"))
+    font = font_cache.load("Arial", 25)
+    games = (PlanarGame(), CubeGame())
+    render_options.render_scale = 0.75
+
+    print(f"{'cycle':>6}{'in game':>9}{'menu':>6}{'GL MB':>8}{'peak RSS MB':>13}")
+    for cycle in range(1, cycles + 1):
+        in_game = 0
+        for game in games:
+            game.reset()
+            for _ in range(frames):
+                game.update()
+                scene_target.begin(render_options.render_scale)
+                game.render()
+                scene_target.finish()
+                hud_layer.draw(font, [(f"Score: {game.score}", (255, 215, 0))])
+            glFinish()
+            in_game = max(in_game, len(gl_resources.entries))
+            game.release_resources()
+            release_scene_resources()
+        if cycle % report_every == 0:
+            size = sum(size for _, size in gl_resources.totals().values())
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+            print(
+                f"{cycle:>6}{in_game:>9}{len(gl_resources.entries):>6}"
+                f"{size / 2**20:>8.2f}{peak:>13.1f}"
+            )
+    size = sum(size for _, size in gl_resources.totals().values())
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    results.record("objects in game", in_game, "objects")
+    results.record("objects in menu", len(gl_resources.entries), "objects")
+    results.record("GL memory in menu", size / 2**20, "MB")
+    results.record("peak RSS", peak, "MB")
+    render_options.render_scale = RENDER_SCALES[0]
+    shader_lighting.release()
+    print(gl_resources.report())
+
+
+# Run by bench_startup in a fresh interpreter: prints the time once the modules are
+# imported and again when the first frame is flipped, then exits
+STARTUP_PROBE = """
+import os, time
+import pygame
+
+def first_flip():
+    print(time.time(), flush=True)
+    os._exit(0)
+
+pygame.display.flip = first_flip
+import main
+
+print(time.time(), flush=True)
+main.main()
+"""
+
+
+def time_startup(cache_dir):
+    """Starts the game in a new process; returns ms to imports done and first frame."""
+    env = dict(os.environ, SNAKE3D_HEADLESS="1", XDG_CACHE_HOME=cache_dir)
+    env["PYGAME_HIDE_SUPPORT_PROMPT"] = "1"
+    start = time.time()
+    output = subprocess.run(
+        [sys.executable, "-c", STARTUP_PROBE],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env,
+        capture_output=True,
+        text=True,
+    ).stdout
+    stamps = [float(line) for line in output.split() if line[:1].isdigit()]
+    return (stamps[0] - start) * 1000, (stamps[-1] - start) * 1000
+
+
+def bench_startup(runs=5):
+    """Measures the time from launching the game to its first menu frame.
+
+    All runs share one XDG_CACHE_HOME, warmed by a first run so the GL driver's
+    shader cache is not part of the numbers. Cold runs delete the font cache first,
+    so the system fonts are scanned; warm runs reuse it. Medians over `runs`.
+    """
+    print(f"{'fonts':>6}{'imports':>12}{'first frame':>14}")
+    with tempfile.TemporaryDirectory() as cache_dir:
+        time_startup(cache_dir)
+        font_cache_file = os.path.join(cache_dir, "snake3d", "fonts.json")
+        for name in ("cold", "warm"):
+            times = []
+            for _ in range(runs):
+                if name == "cold" and os.path.exists(font_cache_file):
+                    os.remove(font_cache_file)
+                times.append(time_startup(cache_dir))
+            imports = statistics.median(t[0] for t in times)
+            first_frame = statistics.median(t[1] for t in times)
+            results.record(f"{name} fonts imports", imports)
+            results.record(f"{name} fonts first frame", first_frame)
+            print(f"{name:>6}{imports:>10.0f}ms{first_frame:>12.0f}ms")
+
+
+def bench_idle_cpu(seconds=3.0):
+    """Measures frame rate and CPU use of the menu screen with and without power saving.
+
+    The hidden window never has focus, so focus is passed to the scheduler directly.
+    CPU time includes the rasterizer threads of software GL drivers.
+    """
+    create_context()
+    texture_id = create_checkerboard_texture()
+    font_large = font_cache.load("Arial", 50, bold=True)
+    font_small = font_cache.load("Arial", 25)
+    print(f"{'power saving':>24}{'fps':>8}{'cpu':>8}")
+    for name, enabled, focused in (
+        ("off", False, True),
+        ("on, focused", True, True),
+        ("on, unfocused", True, False),
+    ):
+        scheduler = FrameScheduler()
+        scheduler.enabled = enabled
+        frames = 0
+        start, start_cpu = time.perf_counter(), time.process_time()
+        while time.perf_counter() - start < seconds:
+            scheduler.tick(True, focused)
+            scheduler.get_events()
+            glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
+            glLoadIdentity()
+            draw_menu_screen(texture_id, texture_id, font_large, font_small)
+            pygame.display.flip()
+            frames += 1
+        elapsed = time.perf_counter() - start
+        cpu = 100.0 * (time.process_time() - start_cpu) / elapsed
+        results.record(f"power saving {name} fps", frames / elapsed, "fps", "higher")
+        results.record(f"power saving {name} cpu", cpu, "%")
+        print(f"{name:>24}{frames / elapsed:>8.1f}{cpu:>7.0f}%")
+
+
+def cube_game_with_cells(count):
+    """Creates a cube game with at least `count` cells, and a path through them."""
+    n = 8
+    while 6 * n * n < count:
+        n *= 2
+    game = CubeGame(n)
+    cells = [(f, x, y) for f in range(6) for y in range(n) for x in range(n)]
+    return game, cells[:count]
+
+
+def bench_snake_mesh(lengths=(10, 100, 1000, 10000), ticks=50):
+    """Measures the snake mesh upload per tick, against rewriting the whole body.
+
+    Each tick the snake moves one cell along a precomputed path, as update() would
+    move it, and the mesh is synced with either partial updates or a full rebuild.
+    """
+    create_context()
+    print(
+        f"{'game':>8}{'length':>8}{'bytes/tick':>12}{'ms/tick':>10}"
+        f"{'rebuild bytes':>15}{'rebuild ms':>12}"
+    )
+    for name, make_game in (
+        ("planar", planar_game_with_cells),
+        ("cube", cube_game_with_cells),
+    ):
+        for length in lengths:
+            row = f"{name:>8}{length:>8}"
+            for full in (False, True):
+                game, path = make_game(length + ticks + 1)
+                place_snake(game, path, length)
+                mesh = game.snake_mesh
+                mesh.sync(game)
+                glFinish()
+
+                mesh.uploaded_bytes = 0
+                start = time.perf_counter()
+                for cell in path[length : length + ticks]:
+                    game.snake.insert(0, cell)
+                    game.snake.pop()
+                    game.head_seq += 1
+                    if full:
+                        mesh.rebuild(game)
+                    else:
+                        mesh.sync(game)
+                glFinish()
+                elapsed = (time.perf_counter() - start) * 1000 / ticks
+                method = "rebuild" if full else "sync"
+                metric = f"{name} length={length} {method}"
+                results.record(f"{metric} bytes", mesh.uploaded_bytes // ticks, "B")
+                results.record(f"{metric} time", elapsed)
+                row += f"{mesh.uploaded_bytes // ticks:>{15 if full else 12}}"
+                row += f"{elapsed:>{12 if full else 10}.3f}"
+                mesh.release()
+            print(row)
+
+
+def straight_run_game(ticks):
+    """Creates a planar game with room for the snake to go straight for `ticks` ticks."""
+    return PlanarGame((2 * ticks + 11, 11))
+
+
+def inline_tick_times(ticks, load):
+    """Ticks a game from the frame loop the way main() does, running `load` per frame."""
+    game = straight_run_game(ticks)
+    clock = pygame.time.Clock()
+    move_timer = 0
+    times = []
+    while len(times) < ticks:
+        move_timer += clock.tick(60)
+        if move_timer >= MOVE_DELAY:
+            move_timer = 0
+            game.update()
+            times.append(time.perf_counter())
+        load()
+    return times
+
+
+def threaded_tick_times(ticks, load):
+    """Ticks a game on a simulation thread while the main thread runs `load`."""
+    simulation = Simulation(straight_run_game(ticks), MOVE_DELAY / 1000.0)
+    simulation.start()
+    while len(simulation.tick_times) < ticks + 1:
+        load()
+    simulation.stop()
+    return list(simulation.tick_times)[1:]
+
+
+def bench_tick_jitter(ticks=30, load_length=300):
+    """Compares tick timing of the inline frame-loop tick and the simulation thread.
+
+    The render load draws a planar game with a snake of `load_length` cells every
+    frame, without the scene cache; the idle load just sleeps.
+    """
+    create_context()
+    shader_lighting.set_program(load_shader_program("lit.vert", "lit.frag"))
+    load_game = planar_game_with_length(load_length)
+
+    def render_load():
+        render_options.scene_cache = False
+        glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
+        load_game.render()
+        glFinish()
+
+    def idle_load():
+        time.sleep(0.001)
+
+    interval = MOVE_DELAY / 1000.0
+    print(
+        f"{'tick':>8}{'load':>8}{'interval':>12}{'mean jitter':>14}{'max jitter':>14}"
+    )
+    for tick_name, tick_times in (
+        ("inline", inline_tick_times),
+        ("thread", threaded_tick_times),
+    ):
+        for load_name, load in (("idle", idle_load), ("render", render_load)):
+            mean, jitter, worst = jitter_stats(tick_times(ticks, load), interval)
+            results.record(f"{tick_name} {load_name} mean jitter", jitter)
+            results.record(f"{tick_name} {load_name} max jitter", worst)
+            print(
+                f"{tick_name:>8}{load_name:>8}{mean:>10.2f}ms"
+                f"{jitter:>12.2f}ms{worst:>12.2f}ms"
+            )
+
+
+def naive_collisions(game, moves):
+    """Finds the same collisions as ArenaGame.find_collisions by scanning every body."""
+    # Tails move away unless the snake eats, as in the arena
+    bodies = [
+        list(snake.body) if c is not None and c in game.food else list(snake.body)[:-1]
+        for snake, c in moves
+    ]
+    dead = []
+    for snake, c in moves:
+        if c is None:
+            dead.append(snake)
+            continue
+        for (other, other_c), body in zip(moves, bodies):
+            if c in body or (other is not snake and other_c == c):
+                dead.append(snake)
+                break
+    return dead
+
+
+def bench_arena(counts=(10, 100, 1000), warmup=50, ticks=200, samples=5):
+    """Measures arena ticks at growing snake counts, and its collision pass against a scan.
+
+    The board grows with the snake count so each snake has about 400 cells. The scan
+    checks every head against every body cell, as a game keeping no occupancy grid
+    would.
+    """
+    print(
+        f"{'snakes':>8}{'cells':>8}{'tick':>10}{'p95':>10}"
+        f"{'collide':>12}{'scan':>12}{'speedup':>9}"
+    )
+    for count in counts:
+        side = int(math.sqrt(400 * count))
+        game = ArenaGame((side, side), count, count, seed=count)
+        for _ in range(warmup):
+            game.update()
+
+        times = []
+        for _ in range(ticks):
+            start = time.perf_counter()
+            game.update()
+            times.append((time.perf_counter() - start) * 1000)
+        times.sort()
+
+        collide = scan = 0.0
+        for _ in range(samples):
+            moves = game.plan_moves()
+            start = time.perf_counter()
+            dead = game.find_collisions(moves)
+            collide += time.perf_counter() - start
+            start = time.perf_counter()
+            scanned = naive_collisions(game, moves)
+            scan += time.perf_counter() - start
+            if {s.id for s in dead} != {s.id for s in scanned}:
+                raise AssertionError("Grid and scan disagree on the collisions")
+            game.update()
+
+        cells = sum(len(snake.body) for snake in game.snakes)
+        collide, scan = collide / samples * 1000, scan / samples * 1000
+        results.record(f"snakes={count} tick", statistics.mean(times))
+        results.record(f"snakes={count} tick p95", times[int(len(times) * 0.95)])
+        results.record(f"snakes={count} collision pass", collide)
+        results.record(f"snakes={count} body scan", scan)
+        print(
+            f"{count:>8}{cells:>8}{statistics.mean(times):>8.3f}ms"
+            f"{times[int(len(times) * 0.95)]:>8.3f}ms"
+            f"{collide:>10.3f}ms{scan:>10.1f}ms{scan / collide:>8.0f}x"
+        )
+
+
+def greedy_turn(snake, food):
+    """Returns the turn toward the food for a planar snake, or None to go straight."""
+    (hx, hy), (nx, ny) = snake[0], snake[1]
+    dx, dy = hx - nx, hy - ny
+    fx, fy = food[0] - hx, food[1] - hy
+    side = dx * fy - dy * fx
+    if side > 0:
+        return "LEFT"
+    if side < 0:
+        return "RIGHT"
+    # Straight ahead, or right behind
+    return None if dx * fx + dy * fy > 0 else "LEFT"
+
+
+async def simulated_client(port, room, board, counts, steer):
+    """Joins a planar room on the local server and follows it.
+
+    A steering client heads for the food, one turn at a time, so its snake grows
+    like a player's. Adds the bytes received per message type to `counts` and
+    returns the stream once the connection ends or the task is cancelled.
+    """
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(encode_join(MODE_PLANAR, board, room))
+    stream = GameStream(MODE_PLANAR)
+    turning = False
+    try:
+        while True:
+            payload = await read_message(reader)
+            kind, flags = stream.apply(payload)
+            counts[payload[0]] = counts.get(payload[0], 0) + len(payload) + 2
+            if kind == MSG_KEYFRAME or flags & DELTA_TURN:
+                turning = False
+            if steer and not turning and stream.alive and len(stream.snake) > 1:
+                turn = greedy_turn(stream.snake, stream.food)
+                if turn:
+                    writer.write(encode_turn(turn))
+                    turning = True
+    except (asyncio.IncompleteReadError, asyncio.CancelledError, ConnectionError):
+        return stream
+    finally:
+        writer.close()
+
+
+async def run_net_load(rooms, clients, ticks, interval):
+    """Runs `rooms` rooms of `clients` simulated clients on a loopback server.
+
+    Returns the rooms, the received bytes per message type, and the number of
+    clients whose rebuilt game does not match their room's.
+    """
+    server = GameServer(interval, KEYFRAME_INTERVAL)
+    server.log = False
+    listener = await server.listen("127.0.0.1", 0)
+    port = listener.sockets[0].getsockname()[1]
+
+    counts = {}
+    tasks = {}
+    for r in range(rooms):
+        # The first client to join steers, the others watch
+        for c in range(clients):
+            task = asyncio.create_task(
+                simulated_client(port, f"room {r}", GRID_SIZE, counts, c == 0)
+            )
+            tasks[task] = f"room {r}"
+            await asyncio.sleep(0)
+    await asyncio.sleep(ticks * interval)
+
+    # Stop ticking, let the last messages arrive, then compare the rebuilt games
+    opened = list(server.rooms.values())
+    for room in opened:
+        room.stop()
+    await asyncio.sleep(0.2)
+    by_name = {room.name: room for room in opened}
+    for task in tasks:
+        task.cancel()
+    mismatches = 0
+    for task, name in tasks.items():
+        stream = await task
+        game = by_name[name].game
+        if stream.tick == by_name[name].tick and (
+            stream.snake != list(game.snake) or stream.food != game.food
+        ):
+            mismatches += 1
+
+    # Let the server see the clients leave and close their rooms
+    await asyncio.sleep(0.2)
+    listener.close()
+    await listener.wait_closed()
+    return opened, counts, mismatches
+
+
+def bench_net(room_counts=(1, 10, 100), clients=4, ticks=200, interval=0.05):
+    """Load-tests the game server over loopback with simulated clients.
+
+    Reports the bytes each client receives per tick, split into the per-tick deltas
+    and the periodic keyframes, against sending a full keyframe every tick, and the
+    server CPU time spent per room and tick. Clients and server share the process,
+    so the CPU time is measured inside the rooms' ticks only.
+    """
+    full = CELLS[MODE_PLANAR].size
+    print(
+        f"{'rooms':>6}{'clients':>8}{'B/tick':>9}{'keyframe':>10}"
+        f"{'full/tick':>11}{'cpu/tick':>11}{'of tick':>9}"
+    )
+    for rooms in room_counts:
+        opened, counts, mismatches = asyncio.run(
+            run_net_load(rooms, clients, ticks, interval)
+        )
+        if mismatches:
+            raise AssertionError(f"{mismatches} clients rebuilt a different game")
+
+        room_ticks = sum(room.ticks for room in opened)
+        cpu = sum(room.cpu_time for room in opened) / room_ticks * 1000
+        received = room_ticks * clients
+        per_tick = sum(counts.values()) / received
+        keyframes = counts.get(MSG_KEYFRAME, 0) / received
+        # What a keyframe of the final snakes costs, sent every tick instead
+        lengths = [len(room.game.snake) for room in opened]
+        full_tick = 16 + full * statistics.mean(lengths)
+        results.record(f"rooms={rooms} bytes per tick", per_tick, "B")
+        results.record(f"rooms={rooms} cpu per room tick", cpu)
+        print(
+            f"{rooms:>6}{clients:>8}{per_tick:>8.1f}B{keyframes:>9.1f}B"
+            f"{full_tick:>10.1f}B{cpu:>9.3f}ms{cpu / (interval * 10):>8.2f}%"
+        )
+
+
+def board_path(width, height, count):
+    """Returns `count` adjacent cells filling a board from (0, 0) row by row."""
+    cells = []
+    for y in range(height):
+        xs = range(width) if y % 2 == 0 else reversed(range(width))
+        cells.extend((x, y) for x in xs)
+    return cells[:count]
+
+
+def logic_cases(lengths):
+    """Yields (game name, board, length, game) with a snake ready to move one cell.
+
+    The snake lies on a row-by-row path over the board, or the first cube face,
+    heading for the free cell that continues it; the food is out of the way.
+    """
+    for width, height in ((21, 17), (101, 101), (201, 201)):
+        game = PlanarGame((width, height))
+        x0, y0 = game.GRID_X[0], game.GRID_Y[0]
+        cells = [(x0 + x, y0 + y) for x, y in board_path(width, height, width * height)]
+        for length in lengths:
+            if length + 1 < len(cells):
+                game.snake = list(reversed(cells[:length]))
+                game.direction = (
+                    cells[length][0] - cells[length - 1][0],
+                    cells[length][1] - cells[length - 1][1],
+                )
+                game.food = cells[-1]
+                yield "planar", f"{width}x{height}", length, game
+
+    # Cube moves by direction index: up, right, down, left on the face
+    moves = {(0, -1): 0, (1, 0): 1, (0, 1): 2, (-1, 0): 3}
+    for n in (8, 32, 64):
+        game = CubeGame(n)
+        cells = [(0, x, y) for x, y in board_path(n, n, n * n)]
+        for length in lengths:
+            if length + 1 < len(cells):
+                game.snake = list(reversed(cells[:length]))
+                step = (
+                    cells[length][1] - cells[length - 1][1],
+                    cells[length][2] - cells[length - 1][2],
+                )
+                game.dir_idx = moves[step]
+                game.food = (5, 0, 0)
+                yield "cube", str(n), length, game
+
+
+def time_call(call, seconds=0.2, setup=None):
+    """Calls `call` repeatedly for about `seconds` and returns its median time in us.
+
+    `setup` runs untimed before every call. The median keeps the odd call that was
+    interrupted by the system from moving the result between runs.
+    """
+    times = []
+    total = 0.0
+    while total < seconds or len(times) < 5:
+        if setup:
+            setup()
+        start = time.perf_counter()
+        call()
+        elapsed = time.perf_counter() - start
+        times.append(elapsed)
+        total += elapsed
+    return statistics.median(times) * 1e6
+
+
+def bench_logic(lengths=(3, 100, 1000)):
+    """Times one update() of each game across snake lengths and board sizes.
+
+    Every update moves the snake one cell from the same starting position, so each
+    measures the collision check and the body shift at that length.
+    """
+    print(f"{'game':>8}{'board':>10}{'length':>8}{'update':>12}")
+    for name, board, length, game in logic_cases(lengths):
+        snake = list(game.snake)
+
+        def setup():
+            game.snake = list(snake)
+
+        update_us = time_call(game.update, setup=setup)
+        results.record(f"{name} board={board} length={length}", update_us, "us")
+        print(f"{name:>8}{board:>10}{length:>8}{update_us:>10.2f}us")
+
+
+def bench_food(fills=(0.5, 0.9, 0.99)):
+    """Times spawning food as the snake fills more of the board.
+
+    Food is placed by picking random cells until one is free, so the number of
+    tries grows as 1 / (1 - fill), each checking the whole snake.
+    """
+    print(f"{'game':>8}{'board':>10}{'fill':>7}{'spawn':>12}")
+    for width, height in ((21, 17), (101, 101)):
+        game = PlanarGame((width, height), seed=0)
+        cells = [
+            (x, y)
+            for x in range(game.GRID_X[0], game.GRID_X[1] + 1)
+            for y in range(game.GRID_Y[0], game.GRID_Y[1] + 1)
+        ]
+        random.shuffle(cells)
+        for fill in fills:
+            game.snake = cells[: int(fill * len(cells))]
+            spawn_us = time_call(game.get_safe_food)
+            board = f"{width}x{height}"
+            results.record(f"planar board={board} fill={fill}", spawn_us, "us")
+            print(f"{'planar':>8}{board:>10}{fill:>7}{spawn_us:>10.1f}us")
+
+    for n in (8, 32):
+        game = CubeGame(n, seed=0)
+        cells = [(f, x, y) for f in range(6) for x in range(n) for y in range(n)]
+        random.shuffle(cells)
+        for fill in fills:
+            game.snake = cells[: int(fill * len(cells))]
+            spawn_us = time_call(game.get_food)
+            results.record(f"cube board={n} fill={fill}", spawn_us, "us")
+            print(f"{'cube':>8}{n:>10}{fill:>7}{spawn_us:>10.1f}us")
+
+
+def bench_local_to_world(n=CUBE_N, rounds=20):
+    """Measures the throughput of CubeGame.local_to_world over every cell of the cube."""
+    game = CubeGame(n)
+    cells = [(f, x, y) for f in range(6) for x in range(n) for y in range(n)]
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for f, x, y in cells:
+            game.local_to_world(f, x, y)
+    elapsed = time.perf_counter() - start
+    calls = rounds * len(cells)
+    results.record("calls per second", calls / elapsed, "calls/s", "higher")
+    results.record("per call", elapsed / calls * 1e6, "us")
+    print(f"{calls / elapsed:>12.0f} calls/s{elapsed / calls * 1e6:>10.2f}us/call")
+
+
+def bench_frame(lengths=(3, 100), frames=40, frames_per_tick=8):
+    """Times whole frames of both modes as main() draws them, with the HUD.
+
+    The game state changes every `frames_per_tick` frames, about the ratio of the
+    tick interval to the frame interval.
+    """
+    create_context()
+    shader_lighting.set_program(load_shader_program("lit.vert", "lit.frag"))
+    font = font_cache.load("Arial", 25)
+    print(f"{'game':>8}{'length':>8}{'frame':>12}{'fps':>8}")
+    for name, make_game in (
+        ("planar", planar_game_with_cells),
+        ("cube", cube_game_with_cells),
+    ):
+        for length in lengths:
+            game, path = make_game(length)
+            place_snake(game, path, length)
+            frame = [0]
+
+            def draw():
+                if frame[0] % frames_per_tick == 0:
+                    game.version = next_state_version()
+                frame[0] += 1
+                scene_target.begin(render_options.render_scale)
+                game.render()
+                scene_target.finish()
+                hud_layer.draw(font, [(f"Score: {frame[0]}", (255, 215, 0))])
+
+            frame_ms = time_frames(draw, frames)
+            results.record(f"{name} length={length} frame", frame_ms)
+            print(f"{name:>8}{length:>8}{frame_ms:>10.2f}ms{1000 / frame_ms:>8.1f}")
+            game.release_resources()
+    release_scene_resources()
+    shader_lighting.release()
+
+
+def step_particle_objects(particles, dt, drag=2.0):
+    """Moves particles kept as one Python list each, for comparison with the pool."""
+    alive = []
+    for p in particles:
+        p[0] += p[3] * dt
+        p[1] += p[4] * dt
+        p[2] += p[5] * dt
+        damping = max(0.0, 1.0 - drag * dt)
+        p[3] *= damping
+        p[4] *= damping
+        p[5] *= damping
+        p[6] -= dt
+        if p[6] > 0:
+            alive.append(p)
+    return alive
+
+
+def bench_particles(count=100000, frames=30, dt=1 / 60):
+    """Steps and draws `count` live particles, compared with one Python object each.
+
+    Bursts are refilled as particles expire, as during play, so each frame also
+    returns slots to the free list and takes them again.
+    """
+    create_context()
+    pool = ParticlePool(count, seed=0)
+    pool.set_program(load_shader_program("particle.vert", "particle.frag"))
+
+    def refill():
+        while pool.free_count >= 1000:
+            origin = [random.uniform(-8, 8), random.uniform(-8, 8), 0]
+            pool.emit(origin, 1000, (1.0, 0.5, 0.2), 4.0, 0.3, 10.0)
+
+    refill()
+    steps = []
+    for _ in range(frames):
+        start = time.perf_counter()
+        pool.step(dt)
+        steps.append(time.perf_counter() - start)
+        refill()
+    step_ms = statistics.median(steps) * 1000
+
+    glMatrixMode(GL_PROJECTION)
+    glLoadIdentity()
+    gluPerspective(45, DISPLAY_SIZE[0] / DISPLAY_SIZE[1], 0.1, 100.0)
+    glMatrixMode(GL_MODELVIEW)
+    glLoadIdentity()
+    glTranslatef(0, 0, -30)
+    draw_ms = time_frames(pool.draw, frames)
+    pack_ms = time_call(pool.pack) / 1000
+
+    objects = [
+        [0.0, 0.0, 0.0, random.random(), random.random(), random.random(), 10.0]
+        for _ in range(count)
+    ]
+    start = time.perf_counter()
+    for _ in range(3):
+        objects = step_particle_objects(objects, dt)
+    objects_ms = (time.perf_counter() - start) * 1000 / 3
+
+    results.record("pool step", step_ms)
+    results.record("pool pack", pack_ms)
+    results.record("pool draw", draw_ms)
+    results.record("python objects step", objects_ms)
+    # The draw includes packing; the rest is uploading and rasterizing the sprites
+    print(f"{'live':>8}{'step':>12}{'pack':>12}{'draw':>12}{'objects step':>16}")
+    print(
+        f"{pool.live_count():>8}{step_ms:>10.2f}ms{pack_ms:>10.2f}ms"
+        f"{draw_ms:>10.2f}ms{objects_ms:>14.2f}ms"
+    )
+    pool.release()
+    glDeleteProgram(pool.program)
+
+
+def bench_spectator(counts=(1, 4, 16, 64), frames=120, naive_frames=10, warmup=60):
+    """Times spectator wall frames at growing game counts, against drawing every tile.
+
+    The games tick at their staggered times as frames go by at FRAME_RATE, so the
+    wall redraws only the tiles that ticked, while the naive wall renders each game
+    into its tile with its own renderer every frame.
+    """
+    create_context()
+    frame_interval = 1000.0 / FRAME_RATE
+    print(f"{'games':>8}{'wall':>12}{'redrawn':>10}{'naive':>12}")
+    for count in counts:
+        wall = SpectatorWall(count)
+        # Longer snakes than right after a reset
+        for _ in range(warmup):
+            wall.update(MOVE_DELAY)
+        redrawn = []
+
+        def draw():
+            wall.update(frame_interval)
+            wall.render()
+            redrawn.append(wall.redrawn)
+
+        wall_ms = time_frames(draw, frames)
+        tiles = statistics.mean(redrawn[1:])
+
+        def draw_naive():
+            wall.update(frame_interval)
+            for tile in wall.tiles:
+                glViewport(*tile.rect)
+                tile.game.render()
+            glViewport(0, 0, *DISPLAY_SIZE)
+
+        naive_ms = time_frames(draw_naive, naive_frames)
+        results.record(f"games={count} wall frame", wall_ms)
+        results.record(f"games={count} tiles redrawn", tiles, unit="tiles")
+        results.record(f"games={count} naive frame", naive_ms)
+        print(f"{count:>8}{wall_ms:>10.2f}ms{tiles:>10.1f}{naive_ms:>10.2f}ms")
+        for tile in wall.tiles:
+            tile.game.release_resources()
+        wall.release()
+    release_scene_resources()
+
+
+def draw_cubes_immediate(cubes):
+    """Draws cubes and their edges a vertex call at a time, as the game used to."""
+    glBegin(GL_QUADS)
+    for x, y, z, scale in cubes:
+        for face in FACES_QUADS:
+            for vertex in face:
+                v = VERTICES[vertex]
+                glVertex3f(x + v[0] * scale, y + v[1] * scale, z + v[2] * scale)
+    glEnd()
+    glBegin(GL_LINES)
+    for x, y, z, scale in cubes:
+        for a, b in EDGES:
+            va, vb = VERTICES[a], VERTICES[b]
+            glVertex3f(x + va[0] * scale, y + va[1] * scale, z + va[2] * scale)
+            glVertex3f(x + vb[0] * scale, y + vb[1] * scale, z + vb[2] * scale)
+    glEnd()
+
+
+def draw_cubes_arrays(cubes):
+    """Draws cubes and their edges from NumPy vertex arrays."""
+    draw_cube_silhouettes(cubes)
+    draw_cube_outlines(cubes)
+
+
+def time_frames_with_gl_debug(debug):
+    """Runs the frame benchmark in a new process with GL_DEBUG set; returns its metrics."""
+    with tempfile.TemporaryDirectory() as output_dir:
+        output = os.path.join(output_dir, "frame.json")
+        env = dict(os.environ, SNAKE3D_GL_DEBUG=str(int(debug)))
+        env["SNAKE3D_BENCHMARK_OUTPUT"] = output
+        env.pop("SNAKE3D_BENCHMARK_BASELINE", None)
+        subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "frame"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            env=env,
+            capture_output=True,
+        )
+        with open(output, "r") as f:
+            return json.load(f)["benchmarks"]["frame"]
+
+
+def bench_gl_submission(counts=(100, 1000, 5000), frames=10):
+    """Compares ways of handing geometry and parameters to PyOpenGL.
+
+    Cubes drawn a vertex call at a time against the same cubes from vertex arrays,
+    glMaterialfv given a tuple against a float32 array, and whole frames with and
+    without GL_DEBUG, each run by the frame benchmark in a process of its own.
+    """
+    create_context()
+    glMatrixMode(GL_PROJECTION)
+    glLoadIdentity()
+    gluPerspective(45, DISPLAY_SIZE[0] / DISPLAY_SIZE[1], 0.1, 200.0)
+    glMatrixMode(GL_MODELVIEW)
+    glLoadIdentity()
+    glTranslatef(0, 0, -120)
+    print(f"{'cubes':>8}{'immediate':>12}{'arrays':>12}")
+    for count in counts:
+        side = math.ceil(math.sqrt(count))
+        cubes = [
+            (i % side - side / 2, i // side - side / 2, 0.0, 0.85)
+            for i in range(count)
+        ]
+        immediate_ms = time_frames(lambda: draw_cubes_immediate(cubes), frames)
+        arrays_ms = time_frames(lambda: draw_cubes_arrays(cubes), frames)
+        results.record(f"cubes={count} immediate", immediate_ms)
+        results.record(f"cubes={count} arrays", arrays_ms)
+        print(f"{count:>8}{immediate_ms:>10.2f}ms{arrays_ms:>10.2f}ms")
+
+    emission = (0.1, 0.2, 0.3, 1.0)
+    tuple_us = time_call(lambda: glMaterialfv(GL_FRONT, GL_EMISSION, emission))
+    array = float_array(emission)
+    array_us = time_call(lambda: glMaterialfv(GL_FRONT, GL_EMISSION, array))
+    results.record("glMaterialfv tuple", tuple_us, "us")
+    results.record("glMaterialfv array", array_us, "us")
+    print(f"glMaterialfv: tuple {tuple_us:.2f}us, array {array_us:.2f}us")
+
+    print(f"{'frame':<24}{'GL_DEBUG off':>14}{'on':>12}")
+    fast, debug = time_frames_with_gl_debug(False), time_frames_with_gl_debug(True)
+    for metric in fast:
+        results.record(f"{metric} gl_debug=0", fast[metric]["value"])
+        results.record(f"{metric} gl_debug=1", debug[metric]["value"])
+        print(
+            f"{metric:<24}{fast[metric]['value']:>12.2f}ms"
+            f"{debug[metric]['value']:>10.2f}ms"
+        )
+
+
+def bench_savegame(lengths=(3, 100, 1000, 10000)):
+    """Times saving and loading planar games across snake lengths.
+
+    A save after the first only packs the cells the snake gained since, so saves are
+    timed both as the first of a game and as a repeated one. Round trips are
+    checked by tests/test_savegame.py.
+    """
+    print(f"{'length':>8}{'bytes':>8}{'first save':>14}{'save':>12}{'load':>12}")
+    for length in lengths:
+        game = planar_game_with_length(length)
+        data = savegame.save_game(game)
+        copy = savegame.load_game(data)
+
+        def forget():
+            savegame._snake_cells.pop(game, None)
+
+        first_us = time_call(lambda: savegame.save_game(game), setup=forget)
+        save_us = time_call(lambda: savegame.save_game(game))
+        load_us = time_call(lambda: savegame.load_game(data, copy))
+        results.record(f"length={length} bytes", len(data), "B")
+        results.record(f"length={length} first save", first_us, "us")
+        results.record(f"length={length} save", save_us, "us")
+        results.record(f"length={length} load", load_us, "us")
+        print(
+            f"{length:>8}{len(data):>8}{first_us:>12.1f}us"
+            f"{save_us:>10.1f}us{load_us:>10.1f}us"
+        )
+
+
+class FinishedGame:
+    """Stands in for a game that just ended, as the session store reads it."""
+
+    def __init__(self, score, length, ticks, play_time):
+        """Holds what session_stats() and `play_time` give."""
+        self.stats = (score, length, ticks)
+        self.play_time = play_time
+
+    def session_stats(self):
+        """Returns the score, length and ticks given."""
+        return self.stats
+
+
+def random_finished_game():
+    """Returns a FinishedGame with a random score, as scores are spread in play."""
+    score = int(random.expovariate(1 / 20))
+    ticks = score * 15 + random.randint(5, 200)
+    return FinishedGame(score, score + 3, ticks, ticks * MOVE_DELAY / 1000)
+
+
+def bench_sessions(rows=100000, writes=10000):
+    """Times recording finished games and the leaderboard and percentile queries.
+
+    record() is timed on the calling thread, which only queues the session, then
+    the writer thread is timed writing `writes` sessions. The queries run on a
+    database of `rows` sessions, from the score index and with it bypassed.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "sessions.db")
+        store = sessions.SessionStore(path)
+        # Whether or not SESSIONS is on for the game
+        store.enabled = True
+        store.start()
+        store.flush()
+
+        game = random_finished_game()
+        record_us = time_call(lambda: store.record("planar", game))
+        store.flush()
+        games = [random_finished_game() for _ in range(writes)]
+        start = time.perf_counter()
+        for game in games:
+            store.record(random.choice(sessions.MODES), game)
+        queued = time.perf_counter() - start
+        store.flush()
+        elapsed = time.perf_counter() - start
+        store.close()
+        results.record("record", record_us, "us")
+        results.record("write per session", elapsed / writes * 1e6, "us")
+        print(f"record() {record_us:.2f}us on the calling thread")
+        print(
+            f"{writes} sessions queued in {queued * 1000:.1f}ms, written in "
+            f"{elapsed * 1000:.1f}ms by {store.batches} transactions"
+        )
+
+        db = sessions.open_db(path)
+        filler = []
+        for _ in range(rows):
+            game = random_finished_game()
+            score, length, ticks = game.session_stats()
+            mode = random.choice(sessions.MODES)
+            filler.append((mode, score, length, game.play_time, ticks, 0.0))
+        with db:
+            db.executemany(sessions.INSERT_SQL, filler)
+        queries = (
+            ("leaderboard", sessions.LEADERBOARD_SQL, ("planar", 3)),
+            ("count below", sessions.COUNT_BELOW_SQL, ("planar", 20)),
+            ("score at 90%", sessions.SCORE_AT_SQL, ("planar", rows * 3 // 10)),
+        )
+        print(f"{'query':<16}{'index':>12}{'no index':>12}")
+        for name, sql, args in queries:
+            plan = db.execute("EXPLAIN QUERY PLAN " + sql, args).fetchall()
+            plan = " ".join(row[-1] for row in plan)
+            if "sessions_by_score" not in plan:
+                raise AssertionError(f"The {name} query does not use the index: {plan}")
+            scan = sql.replace("FROM sessions", "FROM sessions NOT INDEXED")
+            indexed_us = time_call(lambda: db.execute(sql, args).fetchall())
+            scan_us = time_call(lambda: db.execute(scan, args).fetchall())
+            results.record(f"rows={rows} {name}", indexed_us, "us")
+            results.record(f"rows={rows} {name} no index", scan_us, "us")
+            print(f"{name:<16}{indexed_us:>10.1f}us{scan_us:>10.1f}us")
+        db.close()
+
+BENCHMARKS = {
+    "logic": bench_logic,
+    "food": bench_food,
+    "local_to_world": bench_local_to_world,
+    "frame": bench_frame,
+    "outline": bench_outline,
+    "lighting": bench_lighting,
+    "scene_cache": bench_scene_cache,
+    "snake_mesh": bench_snake_mesh,
+    "render_scale": bench_render_scale,
+    "hud": bench_hud,
+    "gl_soak": bench_gl_soak,
+    "startup": bench_startup,
+    "arena": bench_arena,
+    "particles": bench_particles,
+    "spectator": bench_spectator,
+    "gl_submission": bench_gl_submission,
+    "savegame": bench_savegame,
+    "sessions": bench_sessions,
+    "net": bench_net,
+    "tick_jitter": bench_tick_jitter,
+    "idle_cpu": bench_idle_cpu,
+}
+
+
+def git_revision():
+    """Returns the checked out commit, with "+" if there are local changes, or None."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=here, capture_output=True, text=True
+        )
+        status = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"],
+            cwd=here,
+            capture_output=True,
+            text=True,
+        )
+    except OSError:
+        return None
+    if commit.returncode:
+        return None
+    return commit.stdout.strip() + ("+" if status.stdout.strip() else "")
+
+
+def environment():
+    """Returns what the results depend on besides the benchmarks themselves."""
+    info = {
+        "time": datetime.datetime.now().astimezone().isoformat(timespec="seconds"),
+        "revision": git_revision(),
+        "python": host_platform.python_version(),
+        "platform": host_platform.platform(),
+        "machine": host_platform.machine(),
+        "cpus": os.cpu_count(),
+        "pygame": pygame.version.ver,
+        "pyopengl": OpenGL.__version__,
+    }
+    info.update(results.gl_info or {})
+    info["settings"] = {}
+    for name in settings.SETTINGS:
+        if not name.startswith("benchmark_"):
+            value = globals()[name.upper()]
+            info["settings"][name] = list(value) if isinstance(value, tuple) else value
+    return info
+
+
+# Environment entries that make results from different runs hard to compare
+COMPARED_ENVIRONMENT = ("python", "machine", "cpus", "gl_renderer", "settings")
+
+
+def compare(report, baseline, tolerance):
+    """Prints every metric against the baseline and returns the regressions.
+
+    A metric regresses when it is worse than the baseline by more than `tolerance`,
+    a fraction of the baseline value.
+    """
+    for key in COMPARED_ENVIRONMENT:
+        was = baseline["environment"].get(key)
+        now = report["environment"].get(key)
+        if was is not None and now is not None and was != now:
+            print(f"Warning: The baseline was recorded with a different {key}")
+
+    regressions = []
+    print(f"{'benchmark':>14}  {'metric':<36}{'baseline':>12}{'now':>12}{'change':>9}")
+    for name, metrics in report["benchmarks"].items():
+        for metric, result in metrics.items():
+            was = baseline["benchmarks"].get(name, {}).get(metric)
+            if was is None or not was["value"]:
+                continue
+            change = result["value"] / was["value"] - 1
+            worse = change if result["better"] == "lower" else -change
+            flag = ""
+            if worse > tolerance:
+                flag = "  REGRESSION"
+                regressions.append((name, metric, change))
+            print(
+                f"{name:>14}  {metric:<36}{was['value']:>12.4g}"
+                f"{result['value']:>12.4g}{change:>+8.0%}{flag}"
+            )
+    return regressions
+
+
+def main(argv):
+    """Runs the benchmarks named on the command line, or all of them.
+
+    With BENCHMARK_OUTPUT the results are written there as JSON, along with the
+    environment they were measured in. With BENCHMARK_BASELINE they are compared
+    with such a file, and the exit status is 1 if any metric regressed.
+    """
+    names = argv or list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            print(f"Unknown benchmark {name}, available: {', '.join(BENCHMARKS)}")
+            return 1
+
+    for name in names:
+        print(f"== {name}")
+        # Every scenario sees the same random numbers from run to run
+        random.seed(0)
+        results.start(name)
+        BENCHMARKS[name]()
+
+    report = {"environment": environment(), "benchmarks": results.benchmarks}
+    if BENCHMARK_OUTPUT:
+        with open(BENCHMARK_OUTPUT, "w") as f:
+            json.dump(report, f, indent=1)
+        print(f"Results written to {BENCHMARK_OUTPUT}")
+
+    if BENCHMARK_BASELINE:
+        with open(BENCHMARK_BASELINE, "r") as f:
+            baseline = json.load(f)
+        print(f"== compared with {BENCHMARK_BASELINE}")
+        regressions = compare(report, baseline, BENCHMARK_TOLERANCE)
+        if regressions:
+            print(
+                f"{len(regressions)} metrics regressed by more than "
+                f"{BENCHMARK_TOLERANCE:.0%}"
+            )
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(settings.remaining_args))
@@ -1,5 +1,29 @@
 DISPLAY_SIZE = (1024, 768)
 MOVE_DELAY = 140
+FRAME_RATE = 60
+VSYNC = False
+MSAA_SAMPLES = 4
+HEADLESS = False
+
+# Planar board in cells (width x height) and cells along a cube face edge
+GRID_SIZE = (21, 17)
+CUBE_N = 8
+
+# Arena board in cells, snakes on it counting the player, food kept on the board
+# and ticks before a dead bot rejoins
+ARENA_SIZE = (64, 48)
+ARENA_SNAKES = 24
+ARENA_FOOD = 24
+ARENA_RESPAWN_TICKS = 10
+
+# Bot-played games shown at once on the spectator wall, planar and cube in turn
+SPECTATOR_GAMES = 16
+
+# Game server to play on as host:port, or empty to play locally; the room to join,
+# and the ticks between the full snapshots it sends besides the per-tick changes
+SERVER = ""
+ROOM = "lobby"
+KEYFRAME_INTERVAL = 50
 
 COLOR_BG = (0.05, 0.05, 0.1, 1)
 COLOR_GRID = (0.3, 0.3, 0.3)
@@ -7,9 +31,84 @@ COLOR_BORDER = (0.0, 0.3, 0.6)
 COLOR_FOOD = (1.0, 0.2, 0.2)
 COLOR_HEAD = (0.2, 1.0, 0.2)
 COLOR_BODY = (0.0, 0.7, 0.0)
+# Body colors of the arena's bots, picked by snake number
+ARENA_COLORS = (
+    (0.8, 0.5, 0.1),
+    (0.2, 0.5, 0.9),
+    (0.7, 0.2, 0.8),
+    (0.9, 0.8, 0.2),
+    (0.2, 0.8, 0.8),
+    (0.9, 0.4, 0.6),
+)
 
 CELL_SCALE_FACTOR = 0.9
 
+# benchmark.py: JSON file to write the results to, results to compare them with,
+# and the fraction by which a metric may be worse before it counts as a regression
+BENCHMARK_OUTPUT = ""
+BENCHMARK_BASELINE = ""
+BENCHMARK_TOLERANCE = 0.15
+
+# Reload shaders and textures whose files change while the game runs, checking
+# every HOT_RELOAD_INTERVAL seconds
+HOT_RELOAD = True
+HOT_RELOAD_INTERVAL = 0.5
+
+# Particle bursts when food is eaten and on game over, from a pool of this many
+PARTICLES = True
+PARTICLE_CAPACITY = 8192
+
+# Tick telemetry: the last TELEMETRY_TICKS ticks of each game are kept in memory and
+# the last TELEMETRY_DUMP_TICKS are saved when the snake dies, to TELEMETRY_DIR
+# (~/.cache/snake3d/telemetry when empty). TELEMETRY_STREAM names a file that gets
+# every tick: JSON lines if it ends in .jsonl, binary otherwise.
+TELEMETRY = True
+TELEMETRY_TICKS = 1024
+TELEMETRY_DUMP_TICKS = 256
+TELEMETRY_DUMPS_KEPT = 20
+TELEMETRY_DIR = ""
+TELEMETRY_STREAM = ""
+
+# Finished games are kept in SESSIONS_DB (~/.cache/snake3d/sessions.db when empty),
+# and the menu shows the best MENU_TOP_SCORES scores of each mode
+SESSIONS = True
+SESSIONS_DB = ""
+MENU_TOP_SCORES = 3
+
+GL_STATE_CACHE = True
+GL_STATE_DEBUG = False
+# Off, PyOpenGL skips its per-call error and array checks; on, they are back and
+# draw calls log their GL errors. See gl_debug.py
+GL_DEBUG = False
+SHOW_STATS = False
+OUTLINE_MODE = "batched"
+LIGHTING = "shader"
+MAX_LIGHTS = 16
+SHADOW_QUALITY = "medium"
+SCENE_CACHE = True
+RENDER_SCALE = 1.0
+SIMULATION_THREAD = False
+TURN_QUEUE_SIZE = 3
+ADAPTIVE_QUALITY = True
+POWER_SAVING = True
+IDLE_FRAME_RATE = 15
+BACKGROUND_FRAME_RATE = 5
+INPUT_BOOST_MS = 1000
+
+# The preset, snake3d.json, SNAKE3D_* environment variables and command line flags
+# override the values above; see settings.py
+import settings as _settings
+
+globals().update(_settings.load_settings(globals()))
+
+FRAME_BUDGET_MS = 1000.0 / FRAME_RATE
+
+# PyOpenGL reads its checking flags when OpenGL.GL is first imported, so the entry
+# points import config before it
+import gl_debug as _gl_debug
+
+_gl_debug.configure(GL_DEBUG)
+
 VERTICES = (
     (0.5, -0.5, -0.5),
     (0.5, 0.5, -0.5),
@@ -30,6 +129,21 @@ FACES_QUADS = (
     (4, 0, 3, 6),
 )
 
+EDGES = (
+    (0, 1),
+    (1, 2),
+    (2, 3),
+    (3, 0),
+    (4, 5),
+    (5, 7),
+    (7, 6),
+    (6, 4),
+    (0, 4),
+    (1, 5),
+    (2, 7),
+    (3, 6),
+)
+
 NORMALS = (
     (0, 0, -1),
     (-1, 0, 0),
@@ -0,0 +1,72 @@
+import json
+import os
+import pygame
+
+# Fonts shipped with the game, looked up as FONT_DIR/<name>.ttf (<name>-bold.ttf)
+FONT_DIR = "fonts"
+# Where the system font found for each name is remembered between runs
+FONT_CACHE = os.path.join(
+    os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache")),
+    "snake3d",
+    "fonts.json",
+)
+
+
+class FontCache:
+    """Finds font files without scanning the system fonts on every start.
+
+    pygame.font.SysFont lists every installed font (through fc-list on Linux) before
+    it can pick one, which is one of the slowest steps of startup. Fonts in FONT_DIR
+    are used directly; otherwise the scan runs once and the path it finds is written
+    to FONT_CACHE for the next start.
+    """
+
+    def __init__(self, path=FONT_CACHE):
+        """Reads the cached lookups, if there are any."""
+        self.path = path
+        self.scans = 0
+        try:
+            with open(path, "r") as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def _save(self):
+        """Writes the lookups back; failing to do so only costs a scan next time."""
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, "w") as f:
+                json.dump(self.entries, f, indent=1)
+        except OSError as e:
+            print(f"Warning: Could not save font cache {self.path}: {e}")
+
+    def find(self, name, bold=False):
+        """Returns (path or None, fake_bold) for a font; None means pygame's default."""
+        suffix = "-bold" if bold else ""
+        bundled = os.path.join(FONT_DIR, f"{name.lower()}{suffix}.ttf")
+        if os.path.exists(bundled):
+            return bundled, False
+
+        key = f"{name.lower()}{suffix}"
+        entry = self.entries.get(key)
+        if entry is not None and (entry[0] is None or os.path.exists(entry[0])):
+            return entry[0], entry[1]
+
+        self.scans += 1
+        path = pygame.font.match_font(name, bold=bold)
+        # Like SysFont, embolden the regular face when there is no bold one
+        fake_bold = bold and path == pygame.font.match_font(name)
+        self.entries[key] = [path, fake_bold]
+        self._save()
+        return path, fake_bold
+
+    def load(self, name, size, bold=False):
+        """Returns a pygame Font like pygame.font.SysFont(name, size, bold)."""
+        path, fake_bold = self.find(name, bold)
+        font = pygame.font.Font(path, size)
+        if fake_bold:
+            font.set_bold(True)
+        return font
+
+
+font_cache = FontCache()
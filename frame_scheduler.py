@@ -0,0 +1,74 @@
+import time
+import pygame
+from pygame.locals import *
+from config import *
+
+INPUT_EVENTS = (KEYDOWN, KEYUP, MOUSEBUTTONDOWN, MOUSEBUTTONUP, MOUSEMOTION)
+
+
+class FrameScheduler:
+    """Paces the main loop, lowering the frame rate when nothing needs it.
+
+    Gameplay runs at FRAME_RATE, static screens such as the menu at IDLE_FRAME_RATE
+    and an unfocused or minimized window at BACKGROUND_FRAME_RATE. A throttled frame
+    waits on the event queue instead of sleeping, so input starts the next frame at
+    once, and the loop then stays at full rate for INPUT_BOOST_MS.
+    """
+
+    def __init__(self):
+        """Creates the scheduler, enabled according to POWER_SAVING."""
+        self.enabled = POWER_SAVING
+        self.clock = pygame.time.Clock()
+        self.pending = []
+        self.last_input = -INPUT_BOOST_MS
+        # None until the first frame, which is never held back
+        self.frame_start = None
+
+    def frame_rate(self, idle, focused):
+        """Returns the frame rate for a static (`idle`) or animated screen."""
+        if not self.enabled:
+            return FRAME_RATE
+        if not focused:
+            return BACKGROUND_FRAME_RATE
+        if idle and pygame.time.get_ticks() - self.last_input > INPUT_BOOST_MS:
+            return IDLE_FRAME_RATE
+        return FRAME_RATE
+
+    def tick(self, idle, focused=None):
+        """Waits until the next frame is due and returns the ms since the previous one.
+
+        `focused` defaults to whether the window is shown and has keyboard focus.
+        """
+        now = time.perf_counter()
+        first = self.frame_start is None
+        if focused is None:
+            focused = pygame.display.get_active() and pygame.key.get_focused()
+
+        rate = self.frame_rate(idle, focused)
+        if rate < FRAME_RATE and not first:
+            remaining = int(self.frame_start * 1000 + 1000 / rate - now * 1000)
+            if remaining > 0:
+                event = pygame.event.wait(remaining)
+                if event.type != NOEVENT:
+                    self.pending.append(event)
+
+        dt = self.clock.tick(FRAME_RATE)
+        self.frame_start = time.perf_counter()
+        return dt
+
+    def end_work(self):
+        """Returns the ms spent on this frame so far; call it just before the flip.
+
+        The flip is left out, as with vsync it blocks until the display refreshes.
+        """
+        if self.frame_start is None:
+            return 0.0
+        return (time.perf_counter() - self.frame_start) * 1000
+
+    def get_events(self):
+        """Returns this frame's events, including any that ended a throttled wait."""
+        events = self.pending + pygame.event.get()
+        self.pending = []
+        if any(event.type in INPUT_EVENTS for event in events):
+            self.last_input = pygame.time.get_ticks()
+        return events
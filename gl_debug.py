@@ -0,0 +1,76 @@
+import sys
+import OpenGL
+
+# Calls that submit geometry, whose failures are logged in debug mode. Errors made
+# between glBegin and glEnd are only reported by glEnd.
+DRAW_CALLS = (
+    "glDrawArrays",
+    "glDrawElements",
+    "glMultiDrawArrays",
+    "glCallList",
+    "glEnd",
+)
+ERROR_NAMES = {
+    0x0500: "GL_INVALID_ENUM",
+    0x0501: "GL_INVALID_VALUE",
+    0x0502: "GL_INVALID_OPERATION",
+    0x0503: "GL_STACK_OVERFLOW",
+    0x0504: "GL_STACK_UNDERFLOW",
+    0x0505: "GL_OUT_OF_MEMORY",
+    0x0506: "GL_INVALID_FRAMEBUFFER_OPERATION",
+}
+# Failures logged per call site before the rest are only counted
+MAX_LOGGED = 10
+
+# (call name, file, line) -> number of failures
+failures = {}
+
+
+def configure(debug):
+    """Sets PyOpenGL's flags, which it reads when OpenGL.GL is first imported.
+
+    By default every GL call skips PyOpenGL's glGetError check and array size
+    checks. In debug mode both are on, so a failing call raises GLError, and the
+    draw calls log their failures with the line that made them and carry on.
+    """
+    if "OpenGL.GL" in sys.modules:
+        print("Warning: OpenGL.GL was imported before config; GL_DEBUG has no effect.")
+        return
+    OpenGL.ERROR_CHECKING = debug
+    OpenGL.ARRAY_SIZE_CHECKING = debug
+    if debug:
+        from OpenGL import GL
+
+        for name in DRAW_CALLS:
+            setattr(GL, name, _logged(name, getattr(GL, name)))
+
+
+def _logged(name, function):
+    """Wraps a draw call so that a GLError it raises is logged instead of propagating."""
+    from OpenGL.error import GLError
+
+    def call(*args):
+        try:
+            return function(*args)
+        except GLError as e:
+            caller = sys._getframe(1)
+            site = (name, caller.f_code.co_filename, caller.f_lineno)
+            count = failures.get(site, 0) + 1
+            failures[site] = count
+            if count <= MAX_LOGGED:
+                error = ERROR_NAMES.get(e.err, f"GL error {e.err:#06x}")
+                print(f"Warning: {error} in {name} at {site[1]}:{site[2]}")
+            if count == MAX_LOGGED:
+                print(f"Warning: Further {name} errors at that line are only counted.")
+
+    return call
+
+
+def report():
+    """Returns a summary of the draw call failures, or None if there were none."""
+    if not failures:
+        return None
+    lines = [f"GL draw call failures: {sum(failures.values())}"]
+    for (name, path, line), count in sorted(failures.items(), key=lambda i: -i[1]):
+        lines.append(f"  {count:>6}  {name} at {path}:{line}")
+    return "\n".join(lines)
@@ -1,7 +1,497 @@
+import functools
+import numpy as np
 import pygame
 from OpenGL.GL import *
 from OpenGL.GLU import *
 from config import *
+from utils import gl_mat_transform
+
+
+class GLStateCache:
+    """Remembers the GL state set through it and skips calls that would not change anything."""
+
+    def __init__(self):
+        """Starts with an unknown state; `enabled` False turns the cache into a pass-through."""
+        self.enabled = GL_STATE_CACHE
+        self.debug = GL_STATE_DEBUG
+        self.recording = False
+        self.issued = 0
+        self.skipped = 0
+        self.invalidate()
+
+    def invalidate(self):
+        """Forgets everything, so the next change of every kind is issued to GL."""
+        self.caps = {}
+        self.active_unit = None
+        self.textures = {}
+        self.program = None
+        self.polygon_mode = None
+        self.polygon_offset = None
+        self.blend_func = None
+        self.line_width = None
+        self.materials = {}
+
+    def _changed(self, current, wanted):
+        """Counts a requested state change and tells whether it must reach GL.
+
+        While `recording` a display list every change is issued, so the list sets all
+        the state it relies on whatever the state is when it is replayed.
+        """
+        if self.enabled and not self.recording and current == wanted:
+            self.skipped += 1
+            return False
+        self.issued += 1
+        return True
+
+    def enable(self, cap):
+        """glEnable that is skipped when the capability is already enabled."""
+        if self._changed(self.caps.get(cap), True):
+            glEnable(cap)
+            self.caps[cap] = True
+
+    def disable(self, cap):
+        """glDisable that is skipped when the capability is already disabled."""
+        if self._changed(self.caps.get(cap), False):
+            glDisable(cap)
+            self.caps[cap] = False
+
+    def set_active_texture(self, unit):
+        """Selects the texture unit that binds and GL_TEXTURE_2D enables apply to."""
+        if self._changed(self.active_unit, unit):
+            glActiveTexture(GL_TEXTURE0 + unit)
+            self.active_unit = unit
+
+    def bind_texture(self, texture_id, unit=0):
+        """Binds a 2D texture on the given texture unit."""
+        self.set_active_texture(unit)
+        if self._changed(self.textures.get(unit), texture_id):
+            glBindTexture(GL_TEXTURE_2D, texture_id)
+            self.textures[unit] = texture_id
+
+    def delete_textures(self, texture_ids):
+        """Deletes textures, dropping them from the cached bindings like GL does."""
+        glDeleteTextures(texture_ids)
+        self.issued += 1
+        for unit, bound in self.textures.items():
+            if bound in texture_ids:
+                self.textures[unit] = 0
+
+    def use_program(self, program):
+        """glUseProgram that is skipped when the program is already current."""
+        if self._changed(self.program, program):
+            glUseProgram(program)
+            self.program = program
+
+    def set_polygon_mode(self, mode):
+        """Sets the polygon rasterization mode for both faces."""
+        if self._changed(self.polygon_mode, mode):
+            glPolygonMode(GL_FRONT_AND_BACK, mode)
+            self.polygon_mode = mode
+
+    def set_polygon_offset(self, factor, units):
+        """Sets the depth offset applied while GL_POLYGON_OFFSET_FILL is enabled."""
+        if self._changed(self.polygon_offset, (factor, units)):
+            glPolygonOffset(factor, units)
+            self.polygon_offset = (factor, units)
+
+    def set_blend_func(self, src, dst):
+        """Sets the blending equation factors."""
+        if self._changed(self.blend_func, (src, dst)):
+            glBlendFunc(src, dst)
+            self.blend_func = (src, dst)
+
+    def set_line_width(self, width):
+        """Sets the rasterized line width."""
+        if self._changed(self.line_width, width):
+            glLineWidth(width)
+            self.line_width = width
+
+    def set_material(self, face, pname, value):
+        """Sets a material parameter; value is a float or an RGBA tuple."""
+        key = (face, pname)
+        if self._changed(self.materials.get(key), value):
+            if isinstance(value, tuple):
+                glMaterialfv(face, pname, float_array(value))
+            else:
+                glMaterialf(face, pname, value)
+            self.materials[key] = value
+
+    def take_counts(self):
+        """Returns (issued, skipped) call counts since the last call and resets them."""
+        counts = (self.issued, self.skipped)
+        self.issued = 0
+        self.skipped = 0
+        return counts
+
+    def verify(self):
+        """Compares the cached state with glGet queries, reports and resyncs mismatches."""
+        mismatches = []
+        for cap, on in self.caps.items():
+            if bool(glIsEnabled(cap)) != on:
+                mismatches.append(f"cap {cap}: cached {on}")
+        if self.active_unit is not None:
+            actual = glGetIntegerv(GL_ACTIVE_TEXTURE) - GL_TEXTURE0
+            if actual != self.active_unit:
+                mismatches.append(f"active texture unit: cached {self.active_unit}, actual {actual}")
+        restore_unit = glGetIntegerv(GL_ACTIVE_TEXTURE)
+        for unit, texture_id in self.textures.items():
+            glActiveTexture(GL_TEXTURE0 + unit)
+            actual = glGetIntegerv(GL_TEXTURE_BINDING_2D)
+            if actual != texture_id:
+                mismatches.append(f"texture unit {unit}: cached {texture_id}, actual {actual}")
+        glActiveTexture(restore_unit)
+        if self.program is not None:
+            actual = glGetIntegerv(GL_CURRENT_PROGRAM)
+            if actual != self.program:
+                mismatches.append(f"program: cached {self.program}, actual {actual}")
+        if self.polygon_mode is not None:
+            actual = glGetIntegerv(GL_POLYGON_MODE)[0]
+            if actual != self.polygon_mode:
+                mismatches.append(f"polygon mode: cached {self.polygon_mode}, actual {actual}")
+        if self.polygon_offset is not None:
+            actual = (glGetFloatv(GL_POLYGON_OFFSET_FACTOR), glGetFloatv(GL_POLYGON_OFFSET_UNITS))
+            if tuple(float(a) for a in actual) != self.polygon_offset:
+                mismatches.append(f"polygon offset: cached {self.polygon_offset}, actual {actual}")
+        if self.blend_func is not None:
+            actual = (glGetIntegerv(GL_BLEND_SRC), glGetIntegerv(GL_BLEND_DST))
+            if actual != self.blend_func:
+                mismatches.append(f"blend func: cached {self.blend_func}, actual {actual}")
+        if self.line_width is not None:
+            actual = float(glGetFloatv(GL_LINE_WIDTH))
+            if abs(actual - self.line_width) > 1e-6:
+                mismatches.append(f"line width: cached {self.line_width}, actual {actual}")
+        for (face, pname), value in self.materials.items():
+            actual = glGetMaterialfv(face, pname)
+            if hasattr(actual, "__len__"):
+                actual = tuple(float(a) for a in actual)
+            else:
+                actual = (float(actual),)
+            expected = value if isinstance(value, tuple) else (value,)
+            if any(abs(a - e) > 1e-6 for a, e in zip(actual, expected)):
+                mismatches.append(f"material {pname}: cached {value}, actual {actual}")
+
+        for message in mismatches:
+            print(f"Warning: GL state cache mismatch, {message}")
+        if mismatches:
+            self.invalidate()
+        return not mismatches
+
+
+gl_state = GLStateCache()
+
+# C float arrays of the tuples passed to glMaterialfv and glLightfv, which PyOpenGL
+# takes as they are instead of converting the tuple on every call
+FLOAT_ARRAYS = {}
+MAX_FLOAT_ARRAYS = 256
+
+
+def float_array(values):
+    """Returns a C float array holding a tuple of numbers, made once per tuple."""
+    array = FLOAT_ARRAYS.get(values)
+    if array is None:
+        if len(FLOAT_ARRAYS) >= MAX_FLOAT_ARRAYS:
+            FLOAT_ARRAYS.clear()
+        array = FLOAT_ARRAYS[values] = (GLfloat * len(values))(*values)
+    return array
+
+
+def _delete_program(program):
+    """Deletes a shader program, unbinding it first if it is current."""
+    if gl_state.program == program:
+        gl_state.use_program(0)
+    glDeleteProgram(program)
+
+
+# How each kind of object tracked by GLResources is deleted
+GL_DELETERS = {
+    "texture": lambda gl_id: gl_state.delete_textures([gl_id]),
+    "buffer": lambda gl_id: glDeleteBuffers(1, [gl_id]),
+    "framebuffer": lambda gl_id: glDeleteFramebuffers(1, [gl_id]),
+    "renderbuffer": lambda gl_id: glDeleteRenderbuffers(1, [gl_id]),
+    "display_list": lambda gl_id: glDeleteLists(gl_id, 1),
+    "program": _delete_program,
+}
+
+
+class GLResources:
+    """Registry of the GL objects the game owns, with reference counts and sizes.
+
+    Whoever creates a texture, buffer, framebuffer, display list or shader program
+    adds it here and later releases it instead of deleting it; the last release
+    deletes it. Every entry has a label and an estimate of its GPU memory, so the
+    live objects can be reported by kind, and teardown() at shutdown frees whatever
+    was never released and reports it as leaked.
+    """
+
+    def __init__(self):
+        """Starts with nothing registered."""
+        self.entries = {}
+        self.created = 0
+        self.deleted = 0
+
+    def add(self, kind, gl_id, label, size=0):
+        """Registers a new object with one reference and returns its id."""
+        self.entries[(kind, gl_id)] = [label, size, 1]
+        self.created += 1
+        return gl_id
+
+    def find(self, kind, label):
+        """Returns a live object with the given label, adding a reference, or None."""
+        for (entry_kind, gl_id), entry in self.entries.items():
+            if entry_kind == kind and entry[0] == label:
+                entry[2] += 1
+                return gl_id
+        return None
+
+    def resize(self, kind, gl_id, size):
+        """Updates the memory estimate of an object whose storage was reallocated."""
+        self.entries[(kind, gl_id)][1] = size
+
+    def release(self, kind, gl_id):
+        """Drops a reference to an object and deletes it once none are left."""
+        entry = self.entries.get((kind, gl_id))
+        if entry is None:
+            print(f"Warning: Releasing unknown GL {kind} {gl_id}.")
+            return
+        entry[2] -= 1
+        if entry[2] > 0:
+            return
+        del self.entries[(kind, gl_id)]
+        GL_DELETERS[kind](gl_id)
+        self.deleted += 1
+
+    def totals(self):
+        """Returns {kind: (count, estimated bytes)} of the live objects."""
+        totals = {}
+        for (kind, _), (_, size, _) in self.entries.items():
+            count, total = totals.get(kind, (0, 0))
+            totals[kind] = (count + 1, total + size)
+        return totals
+
+    def report(self):
+        """Returns a text listing of the live objects and their memory by kind."""
+        totals = self.totals()
+        lines = [
+            f"GL resources: {len(self.entries)} live, "
+            f"{sum(size for _, size in totals.values()) / 2**20:.1f} MB, "
+            f"{self.created} created, {self.deleted} deleted"
+        ]
+        for kind, (count, size) in sorted(totals.items()):
+            labels = sorted(
+                {label for (k, _), (label, _, _) in self.entries.items() if k == kind}
+            )
+            lines.append(
+                f"  {kind:<13}{count:>4}{size / 2**20:>8.1f} MB  {', '.join(labels)}"
+            )
+        return "\n".join(lines)
+
+    def teardown(self):
+        """Deletes everything still registered as leaked and returns how many there were."""
+        leaked = list(self.entries.items())
+        for (kind, gl_id), (label, _, refs) in leaked:
+            print(f"Warning: GL {kind} {gl_id} ({label}) leaked, {refs} references.")
+            del self.entries[(kind, gl_id)]
+            GL_DELETERS[kind](gl_id)
+            self.deleted += 1
+        return len(leaked)
+
+
+gl_resources = GLResources()
+
+
+OUTLINE_MODES = ("batched", "per_cube", "off")
+LIGHTING_PATHS = ("shader", "fixed")
+RENDER_SCALES = (1.0, 0.75, 0.5)
+SHADOW_RESOLUTIONS = {"off": 0, "low": 512, "medium": 1024, "high": 2048}
+
+# Size of the light uniform arrays in lit.frag
+MAX_SHADER_LIGHTS = 16
+
+
+class RenderOptions:
+    """Rendering techniques that can be switched at runtime, initialized from config."""
+
+    def __init__(self):
+        """Copies the configured defaults."""
+        self.outline_mode = OUTLINE_MODE
+        self.lighting = LIGHTING
+        self.max_lights = MAX_LIGHTS
+        self.shadow_quality = SHADOW_QUALITY
+        self.scene_cache = SCENE_CACHE
+        self.multisample = MSAA_SAMPLES > 0
+        self.render_scale = RENDER_SCALE
+        # Board cells per floor tile edge on the fixed lighting path
+        self.tessellation = 1
+
+    def cycle_outline_mode(self):
+        """Switches to the next outline technique and returns its name."""
+        i = OUTLINE_MODES.index(self.outline_mode)
+        self.outline_mode = OUTLINE_MODES[(i + 1) % len(OUTLINE_MODES)]
+        return self.outline_mode
+
+    def cycle_lighting(self):
+        """Switches between per-pixel shader and fixed-function lighting."""
+        i = LIGHTING_PATHS.index(self.lighting)
+        self.lighting = LIGHTING_PATHS[(i + 1) % len(LIGHTING_PATHS)]
+        return self.lighting
+
+    def cycle_render_scale(self):
+        """Switches to the next 3D scene resolution scale and returns it."""
+        if self.render_scale in RENDER_SCALES:
+            i = RENDER_SCALES.index(self.render_scale)
+            self.render_scale = RENDER_SCALES[(i + 1) % len(RENDER_SCALES)]
+        else:
+            self.render_scale = RENDER_SCALES[0]
+        return self.render_scale
+
+    def cycle_shadow_quality(self):
+        """Switches to the next shadow map resolution and returns its name."""
+        names = list(SHADOW_RESOLUTIONS)
+        i = names.index(self.shadow_quality)
+        self.shadow_quality = names[(i + 1) % len(names)]
+        return self.shadow_quality
+
+
+render_options = RenderOptions()
+
+
+class ShaderLighting:
+    """Per-pixel lighting program and the point lights it is fed with each frame."""
+
+    def __init__(self):
+        """Starts without a program, which keeps rendering on the fixed pipeline."""
+        self.program = None
+        self.lights = []
+        self.shadows = []
+        self.shadow_texel = 0.0
+        self.dirty = False
+        self.white_texture = None
+
+    def set_program(self, program):
+        """Installs the compiled lit.vert/lit.frag program, or None to disable the path.
+
+        The program is registered with gl_resources, and the previous one released.
+        """
+        if self.program:
+            gl_resources.release("program", self.program)
+        self.program = program
+        if not program:
+            return
+        gl_resources.add("program", program, "lit.vert/lit.frag")
+        self.num_lights_loc = glGetUniformLocation(program, "numLights")
+        self.light_pos_loc = glGetUniformLocation(program, "lightPos")
+        self.light_color_loc = glGetUniformLocation(program, "lightColor")
+        self.num_shadows_loc = glGetUniformLocation(program, "numShadows")
+        self.shadow_matrix_locs = [
+            glGetUniformLocation(program, "shadowMatrix0"),
+            glGetUniformLocation(program, "shadowMatrix1"),
+        ]
+        self.shadow_texel_loc = glGetUniformLocation(program, "shadowTexel")
+        gl_state.use_program(program)
+        glUniform1i(glGetUniformLocation(program, "texture1"), 0)
+        glUniform1i(glGetUniformLocation(program, "shadowMap0"), 1)
+        glUniform1i(glGetUniformLocation(program, "shadowMap1"), 2)
+        gl_state.use_program(0)
+        self.dirty = True
+
+    def active(self):
+        """Tells whether lit surfaces are drawn by the shader this frame."""
+        return bool(self.program) and render_options.lighting == "shader"
+
+    def get_white_texture(self):
+        """Returns a 1x1 white texture bound in place of 'no texture' in the shader."""
+        if self.white_texture is None:
+            self.white_texture = glGenTextures(1)
+            gl_state.bind_texture(self.white_texture)
+            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
+            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
+            glTexImage2D(
+                GL_TEXTURE_2D, 0, GL_RGBA, 1, 1, 0, GL_RGBA, GL_UNSIGNED_BYTE,
+                bytes([255, 255, 255, 255]),
+            )
+            gl_resources.add("texture", self.white_texture, "white", 4)
+        return self.white_texture
+
+    def release(self):
+        """Releases the program and the white texture."""
+        self.set_program(None)
+        if self.white_texture is not None:
+            gl_resources.release("texture", self.white_texture)
+        self.white_texture = None
+
+    def upload(self):
+        """Sends the lights of the current frame to the bound program if they changed."""
+        if not self.dirty:
+            return
+        positions = []
+        colors = []
+        for pos, color in self.lights:
+            positions.extend(pos[:3])
+            colors.extend(color[:3])
+        glUniform1i(self.num_lights_loc, len(self.lights))
+        if self.lights:
+            glUniform3fv(self.light_pos_loc, len(self.lights), positions)
+            glUniform3fv(self.light_color_loc, len(self.lights), colors)
+
+        # Shadow maps live on texture units 1 and 2; the caller rebinds unit 0 next
+        glUniform1i(self.num_shadows_loc, len(self.shadows))
+        glUniform1f(self.shadow_texel_loc, self.shadow_texel)
+        for i, (texture_id, matrix) in enumerate(self.shadows):
+            glUniformMatrix4fv(self.shadow_matrix_locs[i], 1, GL_FALSE, matrix)
+            gl_state.bind_texture(texture_id, unit=1 + i)
+        self.dirty = False
+
+
+shader_lighting = ShaderLighting()
+
+
+def prepare_lit_program():
+    """Uploads the frame's lights and shadows to the lighting program up front.
+
+    Done before replaying or recording a display list, so no per-frame uniform ends
+    up compiled into the list.
+    """
+    if shader_lighting.active():
+        shader_lighting.get_white_texture()
+        gl_state.use_program(shader_lighting.program)
+        shader_lighting.upload()
+        gl_state.set_active_texture(0)
+
+
+def use_lit_surface(texture_id):
+    """Sets up texturing for a surface lit by the point lights, on either lighting path."""
+    if shader_lighting.active() and gl_state.caps.get(GL_LIGHTING):
+        gl_state.disable(GL_TEXTURE_2D)
+        gl_state.use_program(shader_lighting.program)
+        shader_lighting.upload()
+        gl_state.bind_texture(texture_id or shader_lighting.get_white_texture())
+        return
+
+    gl_state.use_program(0)
+    if texture_id:
+        gl_state.enable(GL_TEXTURE_2D)
+        gl_state.bind_texture(texture_id)
+    else:
+        gl_state.disable(GL_TEXTURE_2D)
+
+
+def use_unlit():
+    """Sets up flat-colored drawing without lighting, texturing or shaders."""
+    gl_state.use_program(0)
+    gl_state.disable(GL_LIGHTING)
+    gl_state.disable(GL_TEXTURE_2D)
+
+
+def upload_texture_image(texture_id, data, width, height):
+    """Fills a texture with RGBA image data, filtered linearly and repeating."""
+    gl_state.bind_texture(texture_id)
+    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR)
+    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
+    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_REPEAT)
+    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_REPEAT)
+    glTexImage2D(
+        GL_TEXTURE_2D, 0, GL_RGBA, width, height, 0, GL_RGBA, GL_UNSIGNED_BYTE, data
+    )
 
 
 def draw_background(texture_id):
@@ -9,10 +499,11 @@ def draw_background(texture_id):
     if not texture_id:
         return
 
-    glDisable(GL_DEPTH_TEST)
-    glDisable(GL_LIGHTING)
-    glEnable(GL_TEXTURE_2D)
-    glBindTexture(GL_TEXTURE_2D, texture_id)
+    gl_state.use_program(0)
+    gl_state.disable(GL_DEPTH_TEST)
+    gl_state.disable(GL_LIGHTING)
+    gl_state.enable(GL_TEXTURE_2D)
+    gl_state.bind_texture(texture_id)
     glColor3f(1.0, 1.0, 1.0)
 
     glMatrixMode(GL_PROJECTION)
@@ -40,17 +531,18 @@ def draw_background(texture_id):
     glPopMatrix()
     glMatrixMode(GL_MODELVIEW)
 
-    glDisable(GL_TEXTURE_2D)
-    glEnable(GL_DEPTH_TEST)
+    gl_state.disable(GL_TEXTURE_2D)
+    gl_state.enable(GL_DEPTH_TEST)
 
 
 def draw_rect_2d(x, y, width, height, color):
     """Draws a 2D colored rectangle (e.g. for UI backgrounds) over the scene."""
-    glDisable(GL_DEPTH_TEST)
-    glDisable(GL_LIGHTING)
-    glDisable(GL_TEXTURE_2D)
-    glEnable(GL_BLEND)
-    glBlendFunc(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA)
+    gl_state.use_program(0)
+    gl_state.disable(GL_DEPTH_TEST)
+    gl_state.disable(GL_LIGHTING)
+    gl_state.disable(GL_TEXTURE_2D)
+    gl_state.enable(GL_BLEND)
+    gl_state.set_blend_func(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA)
 
     glMatrixMode(GL_PROJECTION)
     glPushMatrix()
@@ -74,220 +566,328 @@ def draw_rect_2d(x, y, width, height, color):
     glPopMatrix()
     glMatrixMode(GL_MODELVIEW)
 
-    glEnable(GL_DEPTH_TEST)
-    glDisable(GL_BLEND)
-
+    gl_state.enable(GL_DEPTH_TEST)
+    gl_state.disable(GL_BLEND)
+
+
+# Corner offsets of a grid cell, in the order its quad is drawn
+QUAD_CORNERS = np.array(((0, 0), (1, 0), (1, 1), (0, 1)))
+# The unit cube as vertex arrays: a quad per face with its normal and texture
+# coordinates, and a line per edge
+CUBE_POSITIONS = np.array(
+    [VERTICES[vertex] for face in FACES_QUADS for vertex in face], np.float32
+)
+CUBE_NORMALS = np.repeat(np.array(NORMALS, np.float32), 4, axis=0)
+CUBE_TEX_COORDS = np.tile(QUAD_CORNERS.astype(np.float32), (6, 1))
+CUBE_EDGE_POSITIONS = np.array(
+    [VERTICES[vertex] for edge in EDGES for vertex in edge], np.float32
+)
+
+
+def draw_arrays(mode, positions, normals=None, tex_coords=None):
+    """Draws contiguous float32 vertex data from client memory with one glDrawArrays.
+
+    Takes one row per vertex in each array. Compiling it into a display list copies
+    the data, so the arrays may change or go away afterwards.
+    """
+    glEnableClientState(GL_VERTEX_ARRAY)
+    glVertexPointer(3, GL_FLOAT, 0, positions)
+    if normals is not None:
+        glEnableClientState(GL_NORMAL_ARRAY)
+        glNormalPointer(GL_FLOAT, 0, normals)
+    if tex_coords is not None:
+        glEnableClientState(GL_TEXTURE_COORD_ARRAY)
+        glTexCoordPointer(2, GL_FLOAT, 0, tex_coords)
+    glDrawArrays(mode, 0, len(positions))
+    if tex_coords is not None:
+        glDisableClientState(GL_TEXTURE_COORD_ARRAY)
+    if normals is not None:
+        glDisableClientState(GL_NORMAL_ARRAY)
+    glDisableClientState(GL_VERTEX_ARRAY)
+
+
+def place_cubes(cubes, vertices):
+    """Returns `vertices` of the unit cube moved to each (x, y, z, scale) of `cubes`."""
+    cubes = np.asarray(cubes, np.float32)
+    placed = cubes[:, None, :3] + vertices * cubes[:, None, 3:]
+    return placed.reshape(-1, 3)
+
+
+def grid_quads(xs, ys, us, vs, z):
+    """Returns the positions and texture coordinates of the quads of a grid.
+
+    `xs` and `ys` are the cell edges along each axis and `us` and `vs` the texture
+    coordinates at those edges; the quads lie at height `z`.
+    """
+    a = np.arange(len(xs) - 1)[:, None, None] + QUAD_CORNERS[:, 0]
+    b = np.arange(len(ys) - 1)[None, :, None] + QUAD_CORNERS[:, 1]
+    a, b = np.broadcast_arrays(a, b)
+    positions = np.empty(a.shape + (3,), np.float32)
+    positions[..., 0] = np.asarray(xs)[a]
+    positions[..., 1] = np.asarray(ys)[b]
+    positions[..., 2] = z
+    tex_coords = np.empty(a.shape + (2,), np.float32)
+    tex_coords[..., 0] = np.asarray(us)[a]
+    tex_coords[..., 1] = np.asarray(vs)[b]
+    return positions.reshape(-1, 3), tex_coords.reshape(-1, 2)
+
+
+def grid_lines(xs, ys, x_span, y_span, z):
+    """Returns GL_LINES vertices of lines at `xs` across `y_span` and at `ys` across `x_span`."""
+    lines = np.empty((len(xs) + len(ys), 2, 3), np.float32)
+    lines[: len(xs), :, 0] = np.asarray(xs)[:, None]
+    lines[: len(xs), :, 1] = y_span
+    lines[len(xs) :, :, 0] = x_span
+    lines[len(xs) :, :, 1] = np.asarray(ys)[:, None]
+    lines[..., 2] = z
+    return lines.reshape(-1, 3)
+
+
+def rect_loop(x0, y0, x1, y1, z):
+    """Returns GL_LINE_LOOP vertices of the outline of a rectangle at height `z`."""
+    return np.array(((x0, y0, z), (x1, y0, z), (x1, y1, z), (x0, y1, z)), np.float32)
+
+
+NO_EMISSION = (0.0, 0.0, 0.0, 1.0)
+NO_SPECULAR = (0.0, 0.0, 0.0, 1.0)
+
+
+@functools.lru_cache(maxsize=64)
+def emission_of(color, emission_level):
+    """Returns the RGBA emission of a material glowing in `color` at `emission_level`."""
+    return (
+        color[0] * emission_level,
+        color[1] * emission_level,
+        color[2] * emission_level,
+        1.0,
+    )
 
-def draw_cube_common(color, scale=0.85, emission_level=0.0, texture_id=None):
-    """Draws a textured or colored cube with optional emission material settings."""
-    glPushMatrix()
-    glScalef(scale, scale, scale)
 
+def use_cube_material(color, emission_level=0.0, texture_id=None):
+    """Sets the material, texture and color shared by the snake and food cubes."""
     if emission_level > 0:
-        emission = [c * emission_level for c in color] + [1.0]
-        glMaterialfv(GL_FRONT, GL_EMISSION, emission)
+        gl_state.set_material(GL_FRONT, GL_EMISSION, emission_of(color, emission_level))
     else:
-        glMaterialfv(GL_FRONT, GL_EMISSION, [0.0, 0.0, 0.0, 1.0])
+        gl_state.set_material(GL_FRONT, GL_EMISSION, NO_EMISSION)
 
-    glMaterialfv(GL_FRONT, GL_SPECULAR, [0.0, 0.0, 0.0, 1.0])
-    glMaterialf(GL_FRONT, GL_SHININESS, 0.0)
+    gl_state.set_material(GL_FRONT, GL_SPECULAR, NO_SPECULAR)
+    gl_state.set_material(GL_FRONT, GL_SHININESS, 0.0)
 
+    use_lit_surface(texture_id)
     if texture_id:
-        glEnable(GL_TEXTURE_2D)
-        glBindTexture(GL_TEXTURE_2D, texture_id)
         glColor3f(1.0, 1.0, 1.0)
     else:
-        glDisable(GL_TEXTURE_2D)
-        glColor3fv(color)
+        glColor3f(*color)
 
-    glEnable(GL_POLYGON_OFFSET_FILL)
-    glPolygonOffset(1.0, 1.0)
+    gl_state.enable(GL_POLYGON_OFFSET_FILL)
+    gl_state.set_polygon_offset(1.0, 1.0)
 
-    glBegin(GL_QUADS)
-    for i, face in enumerate(FACES_QUADS):
-        glNormal3fv(NORMALS[i])
-
-        glTexCoord2f(0.0, 0.0)
-        glVertex3fv(VERTICES[face[0]])
-        glTexCoord2f(1.0, 0.0)
-        glVertex3fv(VERTICES[face[1]])
-        glTexCoord2f(1.0, 1.0)
-        glVertex3fv(VERTICES[face[2]])
-        glTexCoord2f(0.0, 1.0)
-        glVertex3fv(VERTICES[face[3]])
-    glEnd()
 
-    glDisable(GL_POLYGON_OFFSET_FILL)
-    glDisable(GL_TEXTURE_2D)
+def end_cube_material():
+    """Undoes the polygon offset, texturing and emission set by use_cube_material."""
+    gl_state.disable(GL_POLYGON_OFFSET_FILL)
+    gl_state.disable(GL_TEXTURE_2D)
+    gl_state.set_material(GL_FRONT, GL_EMISSION, NO_EMISSION)
 
-    glDisable(GL_LIGHTING)
-    glColor3f(0.0, 0.0, 0.0)
-    glLineWidth(1.5)
-    glPolygonMode(GL_FRONT_AND_BACK, GL_LINE)
-    glBegin(GL_QUADS)
-    for face in FACES_QUADS:
-        for vertex in face:
-            glVertex3fv(VERTICES[vertex])
-    glEnd()
-    glPolygonMode(GL_FRONT_AND_BACK, GL_FILL)
-    glEnable(GL_LIGHTING)
 
-    glMaterialfv(GL_FRONT, GL_EMISSION, [0.0, 0.0, 0.0, 1.0])
+def draw_cube_common(
+    color, scale=0.85, emission_level=0.0, texture_id=None, outline=True
+):
+    """Draws a textured or colored cube with optional emission material settings.
+
+    With outline False the black wireframe is left out, so it can be drawn for many
+    cubes at once with draw_cube_outlines.
+    """
+    glPushMatrix()
+    glScalef(scale, scale, scale)
+
+    use_cube_material(color, emission_level, texture_id)
+    draw_arrays(GL_QUADS, CUBE_POSITIONS, CUBE_NORMALS, CUBE_TEX_COORDS)
+    end_cube_material()
+
+    if outline:
+        use_unlit()
+        glColor3f(0.0, 0.0, 0.0)
+        gl_state.set_line_width(1.5)
+        gl_state.set_polygon_mode(GL_LINE)
+        draw_arrays(GL_QUADS, CUBE_POSITIONS)
+        gl_state.set_polygon_mode(GL_FILL)
+        gl_state.enable(GL_LIGHTING)
+
     glPopMatrix()
 
 
+def draw_cube_outlines(cubes):
+    """Draws the black edges of many axis-aligned cubes in a single line batch.
+
+    `cubes` holds (x, y, z, scale) tuples in the current modelview space.
+    """
+    if not cubes:
+        return
+
+    use_unlit()
+    glColor3f(0.0, 0.0, 0.0)
+    gl_state.set_line_width(1.5)
+    draw_arrays(GL_LINES, place_cubes(cubes, CUBE_EDGE_POSITIONS))
+    gl_state.enable(GL_LIGHTING)
+
+
+def draw_cube_silhouettes(cubes):
+    """Draws many untextured, unlit axis-aligned cubes in one batch, for depth-only passes.
+
+    `cubes` holds (x, y, z, scale) tuples in the current modelview space.
+    """
+    if not cubes:
+        return
+    draw_arrays(GL_QUADS, place_cubes(cubes, CUBE_POSITIONS))
+
+
 def draw_pulsating_apple(scale, texture_id, shader_program, time):
     """Draws the apple object using a custom vertex shader for animation."""
-    glUseProgram(shader_program)
+    gl_state.use_program(shader_program)
 
     time_loc = glGetUniformLocation(shader_program, "time")
     tex_loc = glGetUniformLocation(shader_program, "texture1")
     glUniform1f(time_loc, time)
     glUniform1i(tex_loc, 0)
 
-    glEnable(GL_TEXTURE_2D)
-    glActiveTexture(GL_TEXTURE0)
-    glBindTexture(GL_TEXTURE_2D, texture_id)
+    gl_state.enable(GL_TEXTURE_2D)
+    gl_state.bind_texture(texture_id)
 
     glPushMatrix()
     glScalef(scale, scale, scale)
-
-    glBegin(GL_QUADS)
-    for i, face in enumerate(FACES_QUADS):
-        glNormal3fv(NORMALS[i])
-        glTexCoord2f(0.0, 0.0)
-        glVertex3fv(VERTICES[face[0]])
-        glTexCoord2f(1.0, 0.0)
-        glVertex3fv(VERTICES[face[1]])
-        glTexCoord2f(1.0, 1.0)
-        glVertex3fv(VERTICES[face[2]])
-        glTexCoord2f(0.0, 1.0)
-        glVertex3fv(VERTICES[face[3]])
-    glEnd()
-
+    draw_arrays(GL_QUADS, CUBE_POSITIONS, CUBE_NORMALS, CUBE_TEX_COORDS)
     glPopMatrix()
 
-    glUseProgram(0)
-    glDisable(GL_TEXTURE_2D)
+    gl_state.use_program(0)
+    gl_state.disable(GL_TEXTURE_2D)
 
 
 def draw_planar_floor(grid_x, grid_y, texture_id):
-    """Renders the tiled floor for the planar game mode."""
+    """Renders the tiled floor for the planar game mode.
+
+    The fixed pipeline lights per vertex, so there the floor is tessellated into
+    tiles of render_options.tessellation cells; with per-pixel shader lighting a
+    single quad looks the same.
+    """
+    use_lit_surface(texture_id)
     if texture_id:
-        glEnable(GL_TEXTURE_2D)
-        glBindTexture(GL_TEXTURE_2D, texture_id)
         glColor3f(1.0, 1.0, 1.0)
     else:
-        glDisable(GL_TEXTURE_2D)
         glColor3f(0.2, 0.2, 0.2)
 
-    glMaterialfv(GL_FRONT, GL_SPECULAR, [0.0, 0.0, 0.0, 1.0])
-    glMaterialf(GL_FRONT, GL_SHININESS, 0.0)
+    gl_state.set_material(GL_FRONT, GL_SPECULAR, NO_SPECULAR)
+    gl_state.set_material(GL_FRONT, GL_SHININESS, 0.0)
 
-    glEnable(GL_POLYGON_OFFSET_FILL)
-    glPolygonOffset(2.0, 2.0)
+    gl_state.enable(GL_POLYGON_OFFSET_FILL)
+    gl_state.set_polygon_offset(2.0, 2.0)
 
-    z = -0.55
+    # Tile edges in cells, the last one closing the board
+    if shader_lighting.active():
+        step = max(grid_x[1] - grid_x[0], grid_y[1] - grid_y[0]) + 1
+    else:
+        step = render_options.tessellation
+    edges_x = np.append(np.arange(grid_x[0], grid_x[1] + 1, step), grid_x[1] + 1)
+    edges_y = np.append(np.arange(grid_y[0], grid_y[1] + 1, step), grid_y[1] + 1)
 
-    glBegin(GL_QUADS)
+    positions, tex_coords = grid_quads(
+        edges_x - 0.5, edges_y - 0.5, edges_x / 2.0, edges_y / 2.0, -0.55
+    )
     glNormal3f(0, 0, 1)
+    draw_arrays(GL_QUADS, positions, tex_coords=tex_coords)
 
-    for x in range(grid_x[0], grid_x[1] + 1):
-        for y in range(grid_y[0], grid_y[1] + 1):
-            x0, y0 = x - 0.5, y - 0.5
-            x1, y1 = x + 0.5, y + 0.5
-
-            u0, v0 = x / 2.0, y / 2.0
-            u1, v1 = (x + 1) / 2.0, (y + 1) / 2.0
-
-            glTexCoord2f(u0, v0)
-            glVertex3f(x0, y0, z)
-            glTexCoord2f(u1, v0)
-            glVertex3f(x1, y0, z)
-            glTexCoord2f(u1, v1)
-            glVertex3f(x1, y1, z)
-            glTexCoord2f(u0, v1)
-            glVertex3f(x0, y1, z)
-
-    glEnd()
-
-    glDisable(GL_POLYGON_OFFSET_FILL)
-    glDisable(GL_TEXTURE_2D)
+    gl_state.disable(GL_POLYGON_OFFSET_FILL)
+    gl_state.disable(GL_TEXTURE_2D)
 
 
 def draw_cube_face_background(texture_id, n):
-    """Renders the background face for a side of the cube in cube mode."""
+    """Renders the background face for a side of the cube in cube mode.
+
+    Tessellated into tiles of render_options.tessellation cells of the n x n board
+    for the fixed pipeline only, like draw_planar_floor.
+    """
+    use_lit_surface(texture_id)
     if texture_id:
-        glEnable(GL_TEXTURE_2D)
-        glBindTexture(GL_TEXTURE_2D, texture_id)
         glColor3f(1.0, 1.0, 1.0)
     else:
-        glDisable(GL_TEXTURE_2D)
         glColor3f(0.1, 0.1, 0.1)
 
-    glMaterialfv(GL_FRONT, GL_SPECULAR, [0.0, 0.0, 0.0, 1.0])
-    glMaterialf(GL_FRONT, GL_SHININESS, 0.0)
+    gl_state.set_material(GL_FRONT, GL_SPECULAR, NO_SPECULAR)
+    gl_state.set_material(GL_FRONT, GL_SHININESS, 0.0)
 
-    glEnable(GL_POLYGON_OFFSET_FILL)
-    glPolygonOffset(2.0, 2.0)
+    gl_state.enable(GL_POLYGON_OFFSET_FILL)
+    gl_state.set_polygon_offset(2.0, 2.0)
 
-    step = 2.0 / n
+    if shader_lighting.active():
+        n = 1
+    else:
+        n = max(1, -(-n // render_options.tessellation))
+    edges = np.linspace(0.0, 1.0, n + 1)
 
-    glBegin(GL_QUADS)
+    positions, tex_coords = grid_quads(
+        edges * 2.0 - 1.0, edges * 2.0 - 1.0, edges, edges, 0.0
+    )
     glNormal3f(0, 0, 1)
+    draw_arrays(GL_QUADS, positions, tex_coords=tex_coords)
 
-    for i in range(n):
-        for j in range(n):
-            x0 = -1.0 + i * step
-            y0 = -1.0 + j * step
-            x1 = x0 + step
-            y1 = y0 + step
-
-            u0, v0 = i / float(n), j / float(n)
-            u1, v1 = (i + 1) / float(n), (j + 1) / float(n)
-
-            glTexCoord2f(u0, v0)
-            glVertex3f(x0, y0, 0.0)
-            glTexCoord2f(u1, v0)
-            glVertex3f(x1, y0, 0.0)
-            glTexCoord2f(u1, v1)
-            glVertex3f(x1, y1, 0.0)
-            glTexCoord2f(u0, v1)
-            glVertex3f(x0, y1, 0.0)
+    gl_state.disable(GL_POLYGON_OFFSET_FILL)
+    gl_state.disable(GL_TEXTURE_2D)
 
-    glEnd()
 
-    glDisable(GL_POLYGON_OFFSET_FILL)
-    glDisable(GL_TEXTURE_2D)
+AMBIENT_LIGHT = float_array((0.3, 0.3, 0.3, 1.0))
+NO_LIGHT = float_array((0.0, 0.0, 0.0, 1.0))
 
 
 def setup_lights(pos):
     """Configures global ambient lighting and disables the default directional light."""
-    glEnable(GL_LIGHTING)
-    glEnable(GL_LIGHT0)
-    glEnable(GL_COLOR_MATERIAL)
+    gl_state.enable(GL_LIGHTING)
+    gl_state.enable(GL_LIGHT0)
+    gl_state.enable(GL_COLOR_MATERIAL)
+
+    glLightModelfv(GL_LIGHT_MODEL_AMBIENT, AMBIENT_LIGHT)
+
+    glLightfv(GL_LIGHT0, GL_POSITION, float_array(pos))
+    glLightfv(GL_LIGHT0, GL_DIFFUSE, NO_LIGHT)
+    glLightfv(GL_LIGHT0, GL_SPECULAR, NO_LIGHT)
 
-    glLightModelfv(GL_LIGHT_MODEL_AMBIENT, (0.3, 0.3, 0.3, 1))
 
-    glLightfv(GL_LIGHT0, GL_POSITION, pos)
-    glLightfv(GL_LIGHT0, GL_DIFFUSE, (0.0, 0.0, 0.0, 1))
-    glLightfv(GL_LIGHT0, GL_SPECULAR, (0.0, 0.0, 0.0, 1))
+def setup_point_light(index, pos, color, modelview):
+    """Configures a specific point light source with color and attenuation.
 
+    `modelview` is the current modelview matrix, which takes the light to eye space.
+    """
+    if index < MAX_SHADER_LIGHTS:
+        eye_pos = gl_mat_transform(modelview, pos)
+        del shader_lighting.lights[index:]
+        shader_lighting.lights.append((eye_pos, color))
+        shader_lighting.dirty = True
 
-def setup_point_light(index, pos, color):
-    """Configures a specific point light source with color and attenuation."""
     light_id = GL_LIGHT1 + index
     if light_id > GL_LIGHT7:
         return
-    glEnable(light_id)
-    glLightfv(light_id, GL_POSITION, pos)
+    gl_state.enable(light_id)
+    glLightfv(light_id, GL_POSITION, float_array(pos))
+
+    glLightfv(light_id, GL_DIFFUSE, float_array(color))
+    glLightfv(light_id, GL_SPECULAR, NO_LIGHT)
+
+    glLightf(light_id, GL_CONSTANT_ATTENUATION, 0.5)
+    glLightf(light_id, GL_LINEAR_ATTENUATION, 0.2)
+    glLightf(light_id, GL_QUADRATIC_ATTENUATION, 0.05)
+
 
-    glLightfv(light_id, GL_DIFFUSE, color)
-    glLightfv(light_id, GL_SPECULAR, (0.0, 0.0, 0.0, 1))
+def setup_point_lights(lights):
+    """Configures the (position, color) point lights of a frame and switches off the rest."""
+    lights = lights[: render_options.max_lights]
+    # Read back once per frame rather than once per light
+    modelview = glGetFloatv(GL_MODELVIEW_MATRIX) if lights else None
+    for i, (pos, color) in enumerate(lights):
+        setup_point_light(i, pos, color, modelview)
 
-    glLightfv(light_id, GL_CONSTANT_ATTENUATION, 0.5)
-    glLightfv(light_id, GL_LINEAR_ATTENUATION, 0.2)
-    glLightfv(light_id, GL_QUADRATIC_ATTENUATION, 0.05)
+    del shader_lighting.lights[len(lights):]
+    shader_lighting.dirty = True
+    for light_id in range(GL_LIGHT1 + len(lights), GL_LIGHT7 + 1):
+        gl_state.disable(light_id)
 
 
 def draw_text_gl(x, y, text, font, color=(255, 255, 255)):
@@ -304,14 +904,15 @@ def draw_text_gl(x, y, text, font, color=(255, 255, 255)):
     glPushMatrix()
     glLoadIdentity()
 
-    glDisable(GL_DEPTH_TEST)
-    glDisable(GL_LIGHTING)
-    glEnable(GL_BLEND)
-    glBlendFunc(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA)
-    glEnable(GL_TEXTURE_2D)
+    gl_state.use_program(0)
+    gl_state.disable(GL_DEPTH_TEST)
+    gl_state.disable(GL_LIGHTING)
+    gl_state.enable(GL_BLEND)
+    gl_state.set_blend_func(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA)
+    gl_state.enable(GL_TEXTURE_2D)
 
     tex_id = glGenTextures(1)
-    glBindTexture(GL_TEXTURE_2D, tex_id)
+    gl_state.bind_texture(tex_id)
     glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR)
     glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
     glTexImage2D(
@@ -330,11 +931,11 @@ def draw_text_gl(x, y, text, font, color=(255, 255, 255)):
     glVertex2f(x, y + h)
     glEnd()
 
-    glDeleteTextures([tex_id])
-    glDisable(GL_TEXTURE_2D)
-    glDisable(GL_BLEND)
-    glEnable(GL_DEPTH_TEST)
-    glEnable(GL_LIGHTING)
+    gl_state.delete_textures([tex_id])
+    gl_state.disable(GL_TEXTURE_2D)
+    gl_state.disable(GL_BLEND)
+    gl_state.enable(GL_DEPTH_TEST)
+    gl_state.enable(GL_LIGHTING)
 
     glMatrixMode(GL_PROJECTION)
     glPopMatrix()
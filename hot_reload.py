@@ -0,0 +1,171 @@
+import os
+import queue
+import threading
+import time
+import pygame
+from config import *
+from graphics import gl_resources, upload_texture_image
+from profiler import frame_profiler
+from utils import compile_shader_program, read_shader_sources
+
+TEXTURE_DIR = "textures"
+
+
+def decode_image(path):
+    """Returns the RGBA bytes, width and height of an image file, flipped for GL."""
+    surface = pygame.image.load(path)
+    data = pygame.image.tostring(surface, "RGBA", True)
+    return data, surface.get_width(), surface.get_height()
+
+
+class AssetWatcher:
+    """Reloads shaders and textures whose files change while the game runs.
+
+    A background thread checks the files' modification times every `interval`
+    seconds, reads changed shader sources and decodes changed images, and queues
+    the results. apply(), called by the main loop between frames, does only the
+    GL part: compiling the program, or uploading the image into the texture that
+    was loaded from the file so everything holding its id shows the new image.
+    A shader that fails to compile leaves the last working program in place.
+    """
+
+    def __init__(self, interval=HOT_RELOAD_INTERVAL, texture_dir=TEXTURE_DIR):
+        """Prepares to watch nothing; shaders are added with watch_shader()."""
+        self.interval = interval
+        self.texture_dir = texture_dir
+        # (vertex path, fragment path) -> function installing a new program
+        self.shaders = {}
+        self.mtimes = {}
+        self.lock = threading.Lock()
+        self.ready = queue.SimpleQueue()
+        self.stopping = threading.Event()
+        self.thread = None
+        self.swaps = 0
+
+    def watch_shader(self, vertex_path, fragment_path, install):
+        """Calls `install` with a new program whenever either source file changes.
+
+        `install` takes over the program and must release the one it replaces.
+        """
+        with self.lock:
+            self.shaders[(vertex_path, fragment_path)] = install
+            for path in (vertex_path, fragment_path):
+                self.mtimes[path] = self._mtime(path)
+
+    def start(self):
+        """Starts the watching thread, taking the textures as they are now as loaded."""
+        if self.thread is not None:
+            return
+        for path in self._texture_paths():
+            self.mtimes[path] = self._mtime(path)
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stops the watching thread; changes not applied yet are dropped."""
+        if self.thread is None:
+            return
+        self.stopping.set()
+        self.thread.join()
+        self.thread = None
+
+    def _mtime(self, path):
+        """Returns the modification time of a file, or None if it does not exist."""
+        try:
+            return os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+
+    def _changed(self, path):
+        """Tells whether a file was written since the last check, and remembers its time."""
+        mtime = self._mtime(path)
+        if mtime == self.mtimes.get(path):
+            return False
+        self.mtimes[path] = mtime
+        return mtime is not None
+
+    def _texture_paths(self):
+        """Returns the files in the texture directory, named as the game loads them."""
+        try:
+            names = sorted(os.listdir(self.texture_dir))
+        except OSError:
+            return []
+        return [f"{self.texture_dir}/{name}" for name in names]
+
+    def _run(self):
+        """Checks for changes every interval until stop()."""
+        while not self.stopping.wait(self.interval):
+            self.poll()
+
+    def poll(self):
+        """Reads and decodes every changed file and queues it for apply()."""
+        with self.lock:
+            changed = []
+            for paths, install in self.shaders.items():
+                # Both are checked, so that saving both reloads once
+                if any([self._changed(path) for path in paths]):
+                    changed.append((paths, install))
+        for paths, install in changed:
+            try:
+                sources = read_shader_sources(*paths)
+            except OSError as e:
+                print(f"Warning: Could not read {'/'.join(paths)}: {e}")
+                continue
+            self.ready.put(("shader", paths, (sources, install)))
+
+        for path in self._texture_paths():
+            if self._changed(path):
+                try:
+                    image = decode_image(path)
+                except (OSError, pygame.error) as e:
+                    print(f"Warning: Could not load texture {path}: {e}")
+                    continue
+                self.ready.put(("texture", path, image))
+
+    def apply(self):
+        """Swaps in the GL objects of the changes queued since the last frame.
+
+        The time each swap takes is the stall it adds to the frame, reported to
+        the frame profiler as hot_reload_stall.
+        """
+        while not self.ready.empty():
+            kind, name, payload = self.ready.get()
+            start = time.perf_counter()
+            if kind == "shader":
+                label = "/".join(name)
+                swapped = self._swap_shader(label, *payload)
+            else:
+                label = name
+                swapped = self._swap_texture(name, *payload)
+            if not swapped:
+                continue
+            stall = (time.perf_counter() - start) * 1000
+            frame_profiler.observe("hot_reload_stall", stall)
+            self.swaps += 1
+            print(f"Reloaded {label} ({stall:.1f} ms stall)")
+
+    def _swap_shader(self, label, sources, install):
+        """Compiles a changed shader and installs it; returns False if it failed."""
+        try:
+            program = compile_shader_program(*sources)
+        except Exception as e:
+            print(f"Warning: Could not reload {label}, keeping the last program: {e}")
+            return False
+        install(program)
+        return True
+
+    def _swap_texture(self, path, data, width, height):
+        """Replaces the image of the texture loaded from `path`; False if none was."""
+        texture_id = gl_resources.find("texture", path)
+        if texture_id is None:
+            # Not loaded yet; it will be read from the new file when it is
+            return False
+        upload_texture_image(texture_id, data, width, height)
+        gl_resources.resize("texture", texture_id, width * height * 4)
+        # Drop the reference find() added
+        gl_resources.release("texture", texture_id)
+        return True
+
+
+asset_watcher = AssetWatcher()
@@ -0,0 +1,129 @@
+import pygame
+from OpenGL.GL import *
+from OpenGL.GLU import *
+from config import *
+from graphics import gl_resources, gl_state
+
+# Panel margin from the top-left corner and size, and its background color, which
+# is black so it is the same with premultiplied alpha
+HUD_PANEL = (10, 10, 250, 70)
+HUD_BACKGROUND = (0, 0, 0, 153)
+# Distance from the panel's top to the bottom of each text line, in pixels
+HUD_LINE_OFFSETS = (30, 60)
+
+
+class HudLayer:
+    """The in-game HUD panel, composited once into a texture and drawn as one quad.
+
+    The panel and its text lines are blended together with pygame and uploaded only
+    when the text, font or window size change, which for the score panel means once
+    per point. Every other frame costs a single textured quad instead of a rectangle
+    plus a text render and texture upload per line.
+    """
+
+    def __init__(self):
+        """Starts without a texture; it is created on the first draw."""
+        self.texture_id = None
+        self.key = None
+        self.size = (0, 0)
+        self.builds = 0
+
+    def release(self):
+        """Deletes the texture."""
+        if self.texture_id is not None:
+            gl_resources.release("texture", self.texture_id)
+        self.texture_id = None
+        self.key = None
+        self.size = (0, 0)
+
+    def _compose(self, font, lines):
+        """Returns the panel with its text lines on it, with premultiplied alpha."""
+        surface = pygame.Surface(HUD_PANEL[2:], pygame.SRCALPHA)
+        surface.fill(HUD_BACKGROUND)
+        for (text, color), offset in zip(lines, HUD_LINE_OFFSETS):
+            # convert_alpha() also packs the rows, which premul_alpha() relies on
+            text_surface = font.render(text, True, color).convert_alpha()
+            text_surface = text_surface.premul_alpha()
+            surface.blit(
+                text_surface,
+                (10, offset - text_surface.get_height()),
+                special_flags=pygame.BLEND_PREMULTIPLIED,
+            )
+        return surface
+
+    def _upload(self, surface):
+        """Copies the composed surface into the texture, allocating it if needed."""
+        data = pygame.image.tostring(surface, "RGBA", True)
+        w, h = surface.get_size()
+        if self.texture_id is None:
+            self.texture_id = gl_resources.add("texture", glGenTextures(1), "hud")
+            gl_state.bind_texture(self.texture_id)
+            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
+            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
+        else:
+            gl_state.bind_texture(self.texture_id)
+
+        if (w, h) == self.size:
+            glTexSubImage2D(
+                GL_TEXTURE_2D, 0, 0, 0, w, h, GL_RGBA, GL_UNSIGNED_BYTE, data
+            )
+        else:
+            glTexImage2D(
+                GL_TEXTURE_2D, 0, GL_RGBA, w, h, 0, GL_RGBA, GL_UNSIGNED_BYTE, data
+            )
+            gl_resources.resize("texture", self.texture_id, w * h * 4)
+            self.size = (w, h)
+        self.builds += 1
+
+    def draw(self, font, lines):
+        """Draws the panel with `lines`, (text, color) pairs, in the top-left corner."""
+        key = (tuple(lines), id(font), DISPLAY_SIZE)
+        if key != self.key:
+            self._upload(self._compose(font, lines))
+            self.key = key
+
+        x = HUD_PANEL[0]
+        y = DISPLAY_SIZE[1] - HUD_PANEL[1] - HUD_PANEL[3]
+        w, h = self.size
+
+        glMatrixMode(GL_PROJECTION)
+        glPushMatrix()
+        glLoadIdentity()
+        gluOrtho2D(0, DISPLAY_SIZE[0], 0, DISPLAY_SIZE[1])
+        glMatrixMode(GL_MODELVIEW)
+        glPushMatrix()
+        glLoadIdentity()
+
+        gl_state.use_program(0)
+        gl_state.disable(GL_DEPTH_TEST)
+        gl_state.disable(GL_LIGHTING)
+        gl_state.enable(GL_BLEND)
+        # Premultiplied blending composes exactly like the panel and text drawn apart
+        gl_state.set_blend_func(GL_ONE, GL_ONE_MINUS_SRC_ALPHA)
+        gl_state.enable(GL_TEXTURE_2D)
+        gl_state.bind_texture(self.texture_id)
+
+        glColor4f(1, 1, 1, 1)
+        glBegin(GL_QUADS)
+        glTexCoord2f(0, 0)
+        glVertex2f(x, y)
+        glTexCoord2f(1, 0)
+        glVertex2f(x + w, y)
+        glTexCoord2f(1, 1)
+        glVertex2f(x + w, y + h)
+        glTexCoord2f(0, 1)
+        glVertex2f(x, y + h)
+        glEnd()
+
+        gl_state.disable(GL_TEXTURE_2D)
+        gl_state.disable(GL_BLEND)
+        gl_state.enable(GL_DEPTH_TEST)
+        gl_state.enable(GL_LIGHTING)
+
+        glMatrixMode(GL_PROJECTION)
+        glPopMatrix()
+        glMatrixMode(GL_MODELVIEW)
+        glPopMatrix()
+
+
+hud_layer = HudLayer()
@@ -0,0 +1,74 @@
+#version 120
+
+// Must match MAX_SHADER_LIGHTS in graphics.py
+#define MAX_LIGHTS 16
+
+uniform sampler2D texture1;
+uniform int numLights;
+uniform vec3 lightPos[MAX_LIGHTS];
+uniform vec3 lightColor[MAX_LIGHTS];
+
+// The first numShadows lights cast shadows (see shadows.py)
+uniform int numShadows;
+uniform sampler2D shadowMap0;
+uniform sampler2D shadowMap1;
+uniform mat4 shadowMatrix0;
+uniform mat4 shadowMatrix1;
+uniform float shadowTexel;
+
+varying vec2 vTexCoord;
+varying vec3 vNormal;
+varying vec3 vPos;
+varying vec4 vColor;
+
+float shadowFactor(sampler2D map, mat4 shadowMatrix) {
+    vec4 coord = shadowMatrix * vec4(vPos, 1.0);
+    if (coord.w <= 0.0) {
+        return 1.0;
+    }
+    vec3 p = coord.xyz / coord.w;
+    if (p.x < 0.0 || p.x > 1.0 || p.y < 0.0 || p.y > 1.0 || p.z > 1.0) {
+        return 1.0;
+    }
+
+    // 2x2 percentage-closer filtering
+    float lit = 0.0;
+    for (int x = 0; x < 2; x++) {
+        for (int y = 0; y < 2; y++) {
+            vec2 offset = (vec2(x, y) - 0.5) * shadowTexel;
+            lit += p.z - 0.002 > texture2D(map, p.xy + offset).r ? 0.0 : 1.0;
+        }
+    }
+    return lit / 4.0;
+}
+
+void main() {
+    vec3 normal = normalize(vNormal);
+
+    float shadow0 = numShadows > 0 ? shadowFactor(shadowMap0, shadowMatrix0) : 1.0;
+    float shadow1 = numShadows > 1 ? shadowFactor(shadowMap1, shadowMatrix1) : 1.0;
+
+    // Same terms as the fixed pipeline with GL_COLOR_MATERIAL: global ambient,
+    // material emission and attenuated diffuse point lights.
+    vec3 light = gl_LightModel.ambient.rgb * vColor.rgb + gl_FrontMaterial.emission.rgb;
+
+    for (int i = 0; i < MAX_LIGHTS; i++) {
+        if (i >= numLights) {
+            break;
+        }
+        vec3 toLight = lightPos[i] - vPos;
+        float dist = length(toLight);
+        float attenuation = 1.0 / (0.5 + 0.2 * dist + 0.05 * dist * dist);
+        float diff = max(dot(normal, toLight / dist), 0.0);
+        if (i == 0) {
+            diff *= shadow0;
+        } else if (i == 1) {
+            diff *= shadow1;
+        }
+        light += diff * attenuation * lightColor[i] * vColor.rgb;
+    }
+
+    vec4 texColor = texture2D(texture1, vTexCoord);
+
+    gl_FragColor = vec4(light * texColor.rgb, vColor.a * texColor.a);
+}
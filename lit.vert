@@ -0,0 +1,15 @@
+#version 120
+
+varying vec2 vTexCoord;
+varying vec3 vNormal;
+varying vec3 vPos;
+varying vec4 vColor;
+
+void main() {
+    vTexCoord = gl_MultiTexCoord0.xy;
+    vNormal = gl_NormalMatrix * gl_Normal;
+    vPos = vec3(gl_ModelViewMatrix * gl_Vertex);
+    vColor = gl_Color;
+
+    gl_Position = gl_ModelViewProjectionMatrix * gl_Vertex;
+}
@@ -1,25 +1,49 @@
 import random
+import time
+import numpy as np
 import pygame
+from collections import deque
 from pygame.locals import *
 from OpenGL.GL import *
 from OpenGL.GLU import *
 from config import *
-from utils import clamp
+from utils import clamp, next_state_version
 from graphics import (
+    draw_arrays,
     draw_cube_common,
+    grid_lines,
+    rect_loop,
     setup_lights,
-    setup_point_light,
+    setup_point_lights,
     draw_planar_floor,
     draw_pulsating_apple,
     draw_background,
+    draw_cube_outlines,
+    draw_cube_silhouettes,
+    gl_state,
+    render_options,
+    use_unlit,
 )
+from scene_cache import SceneCache
+from snake_mesh import SnakeMesh
+from particles import particle_pool
+from shadows import shadow_maps
+from telemetry import TICK_ATE, TICK_DIED, TURN_FLAGS, TickLog
 
 
 class PlanarGame:
-    def __init__(self):
-        """Initializes the planar game mode state."""
-        self.GRID_X = (-10, 10)
-        self.GRID_Y = (-8, 8)
+    def __init__(self, grid_size=GRID_SIZE, seed=None):
+        """Initializes the planar game mode state on a board of (width, height) cells."""
+        width, height = grid_size
+        # Inclusive cell bounds, centered on the snake's starting cell
+        self.GRID_X = (-(width // 2), width - 1 - width // 2)
+        self.GRID_Y = (-(height // 2), height - 1 - height // 2)
+        # Food is placed by the game's own generator, which saves keep and restore
+        self.random = random.Random(seed)
+
+        self.scene_cache = SceneCache()
+        self.snake_mesh = SnakeMesh(COLOR_BODY, 0.2)
+        self.telemetry = TickLog("planar", 2)
 
         # Define camera keys BEFORE reset to avoid AttributeError
         self.cam_keys = {
@@ -37,12 +61,23 @@ class PlanarGame:
         """Resets the snake, food, and camera to default starting values."""
         self.snake = [(0, 0), (-1, 0), (-2, 0)]
         self.direction = (1, 0)
-        self.next_turn = None
+        self.turns = deque()
+        # (input time, tick time, state version) of the turns applied since last taken
+        self.applied_inputs = []
         self.food = self.get_safe_food()
         self.cam_pitch = 0
         self.cam_yaw = 0
         self.cam_zoom = -30
         self.score = 0
+        # Score of the last frame drawn, to burst particles when it goes up
+        self.shown_score = 0
+        # Seconds played, added by the frame loop
+        self.play_time = 0.0
+        # Segments are numbered as they are created; the head has the newest number
+        self.head_seq = len(self.snake) - 1
+        self.version = next_state_version()
+        self.epoch = self.version
+        self.telemetry.reset()
 
         for k in self.cam_keys:
             self.cam_keys[k] = False
@@ -50,8 +85,8 @@ class PlanarGame:
     def get_safe_food(self):
         """Finds a random grid position for food that is not occupied by the snake."""
         while True:
-            x = random.randint(self.GRID_X[0], self.GRID_X[1])
-            y = random.randint(self.GRID_Y[0], self.GRID_Y[1])
+            x = self.random.randint(self.GRID_X[0], self.GRID_X[1])
+            y = self.random.randint(self.GRID_Y[0], self.GRID_Y[1])
             if (x, y) not in self.snake:
                 return (x, y)
 
@@ -60,9 +95,9 @@ class PlanarGame:
         if event.type == KEYDOWN:
             # Snake movement
             if event.key == K_LEFT:
-                self.next_turn = "LEFT"
+                self.queue_turn("LEFT")
             elif event.key == K_RIGHT:
-                self.next_turn = "RIGHT"
+                self.queue_turn("RIGHT")
 
             # Camera movement start
             if event.key == K_w:
@@ -93,6 +128,11 @@ class PlanarGame:
             elif event.key == K_e:
                 self.cam_keys["zoom_out"] = False
 
+    def queue_turn(self, turn, event_time=None):
+        """Queues a turn for the coming ticks, one per tick; extra presses are dropped."""
+        if len(self.turns) < TURN_QUEUE_SIZE:
+            self.turns.append((turn, event_time or time.perf_counter()))
+
     def update_camera(self):
         """Updates camera rotation based on current key flags."""
         if self.cam_keys["up"]:
@@ -109,36 +149,108 @@ class PlanarGame:
         if self.cam_keys["zoom_out"]:
             self.cam_zoom = clamp(self.cam_zoom - 0.5, -50, -10)
 
+    def next_move(self, turn=None):
+        """Returns the cell the head would move to after `turn`, and the new direction.
+
+        The cell may be off the board; is_free() tells whether the snake survives it.
+        """
+        dx, dy = self.direction
+        if turn == "LEFT":
+            dx, dy = -dy, dx
+        elif turn == "RIGHT":
+            dx, dy = dy, -dx
+        return (self.snake[0][0] + dx, self.snake[0][1] + dy), (dx, dy)
+
+    def is_free(self, cell):
+        """Returns whether the head can move into a cell: on the board, off the snake."""
+        x, y = cell
+        return (
+            self.GRID_X[0] <= x <= self.GRID_X[1]
+            and self.GRID_Y[0] <= y <= self.GRID_Y[1]
+            and cell not in self.snake
+        )
+
     def update(self):
         """Updates game logic for one tick: moves snake, checks collisions."""
-        if self.next_turn == "LEFT":
-            self.direction = (-self.direction[1], self.direction[0])
-        elif self.next_turn == "RIGHT":
-            self.direction = (self.direction[1], -self.direction[0])
-        self.next_turn = None
-
-        nx = self.snake[0][0] + self.direction[0]
-        ny = self.snake[0][1] + self.direction[1]
-        new_head = (nx, ny)
-
-        if (
-            nx < self.GRID_X[0]
-            or nx > self.GRID_X[1]
-            or ny < self.GRID_Y[0]
-            or ny > self.GRID_Y[1]
-            or new_head in self.snake
-        ):
+        turn, event_time = self.turns.popleft() if self.turns else (None, None)
+        tick_time = time.perf_counter()
+        new_head, self.direction = self.next_move(turn)
+
+        if not self.is_free(new_head):
+            flags = TURN_FLAGS.get(turn, 0) | TICK_DIED
+            self.record_tick(new_head, flags, 0.0, tick_time)
             return False
 
         self.snake.insert(0, new_head)
+        self.head_seq += 1
+        flags = TURN_FLAGS.get(turn, 0)
+        food_time = 0.0
         if new_head == self.food:
             self.score += 1
+            flags |= TICK_ATE
+            food_start = time.perf_counter()
             self.food = self.get_safe_food()
+            food_time = time.perf_counter() - food_start
         else:
             self.snake.pop()
 
+        self.version = next_state_version()
+        if turn:
+            self.applied_inputs.append((event_time, tick_time, self.version))
+        self.record_tick(new_head, flags, food_time, tick_time)
         return True
 
+    def record_tick(self, head, flags, food_time, tick_time):
+        """Adds the tick that started at `tick_time` to the telemetry."""
+        duration = time.perf_counter() - tick_time
+        self.telemetry.add(head, len(self.snake), self.score, flags, food_time, duration)
+
+    def session_stats(self):
+        """Returns the score, snake length and ticks played, for session_store."""
+        # Reset numbers the 3 starting segments 0 to 2 and every tick that moved
+        # numbered a new head; the tick the snake died in did not
+        return self.score, len(self.snake), self.head_seq - 1
+
+    def cell_count(self):
+        """Returns the number of cells on the board, the most the snake can occupy."""
+        width = self.GRID_X[1] - self.GRID_X[0] + 1
+        height = self.GRID_Y[1] - self.GRID_Y[0] + 1
+        return width * height
+
+    def segment_cube(self, i):
+        """Returns the (x, y, z, scale) cube of the i-th snake segment, 0 being the head."""
+        sx, sy = self.snake[i]
+        scale = 0.9 if i == 0 else 0.85
+        return (sx, sy, 0, scale * CELL_SCALE_FACTOR)
+
+    def point_lights(self):
+        """Returns the (position, color) point lights following the head and the food."""
+        return [
+            ((self.snake[0][0], self.snake[0][1], 2.0, 1.0), (0.1, 0.6, 0.1, 1.0)),
+            ((self.food[0], self.food[1], 2.0, 1.0), (0.6, 0.1, 0.1, 1.0)),
+        ]
+
+    def shadow_lights(self):
+        """Returns (position, direction) of the shadow-casting lights, matching point_lights."""
+        return [(pos[:3], (0, 0, -1)) for pos, _ in self.point_lights()]
+
+    def shadow_casters(self):
+        """Returns the (x, y, z, scale) cubes that cast shadows besides the body mesh."""
+        return [
+            (self.food[0], self.food[1], 0, 0.6 * CELL_SCALE_FACTOR),
+            self.segment_cube(0),
+        ]
+
+    def draw_shadow_casters(self):
+        """Draws the depth of the food, the head and the body for a shadow pass."""
+        draw_cube_silhouettes(self.shadow_casters())
+        self.snake_mesh.draw_depth()
+
+    def release_resources(self):
+        """Frees this game's GL objects; drawing it again recreates them."""
+        self.scene_cache.release()
+        self.snake_mesh.release()
+
     def render(
         self,
         snake_tex_id=None,
@@ -150,6 +262,9 @@ class PlanarGame:
     ):
         """Renders the entire planar game scene including lights, floor, and objects."""
 
+        self.snake_mesh.sync(self)
+        shadow_maps.update(self)
+
         # Draw background first (behind everything)
         draw_background(bg_tex_id)
 
@@ -162,58 +277,78 @@ class PlanarGame:
         glTranslatef(0.0, 0.0, self.cam_zoom)
         glRotatef(self.cam_pitch, 1, 0, 0)
         glRotatef(self.cam_yaw, 0, 1, 0)
+        shadow_maps.use_camera()
 
         setup_lights((0, 0, 20, 1))
+        setup_point_lights(self.point_lights())
 
-        setup_point_light(
-            0, (self.snake[0][0], self.snake[0][1], 2.0, 1.0), (0.1, 0.6, 0.1, 1.0)
+        apple_shader = bool(shader_program and apple_tex_id)
+        self.scene_cache.draw(
+            (self.version, snake_tex_id, floor_tex_id, apple_tex_id, apple_shader),
+            lambda: self.draw_world(
+                snake_tex_id, floor_tex_id, apple_tex_id, apple_shader
+            ),
         )
-        setup_point_light(
-            1, (self.food[0], self.food[1], 2.0, 1.0), (0.6, 0.1, 0.1, 1.0)
-        )
-
-        draw_planar_floor(self.GRID_X, self.GRID_Y, floor_tex_id)
-
-        glDisable(GL_LIGHTING)
-        glColor3fv(COLOR_GRID)
-        glLineWidth(1.0)
-        glBegin(GL_LINES)
-        z = -0.54
-        for x in range(self.GRID_X[0] - 1, self.GRID_X[1] + 2):
-            glVertex3f(x - 0.5, self.GRID_Y[0] - 0.5, z)
-            glVertex3f(x - 0.5, self.GRID_Y[1] + 0.5, z)
-        for y in range(self.GRID_Y[0] - 1, self.GRID_Y[1] + 2):
-            glVertex3f(self.GRID_X[0] - 0.5, y - 0.5, z)
-            glVertex3f(self.GRID_X[1] + 0.5, y - 0.5, z)
-        glEnd()
-
-        glLineWidth(3.0)
-        glColor3fv(COLOR_BORDER)
-        glBegin(GL_LINE_LOOP)
-        glVertex3f(self.GRID_X[0] - 0.5, self.GRID_Y[0] - 0.5, 0)
-        glVertex3f(self.GRID_X[1] + 0.5, self.GRID_Y[0] - 0.5, 0)
-        glVertex3f(self.GRID_X[1] + 0.5, self.GRID_Y[1] + 0.5, 0)
-        glVertex3f(self.GRID_X[0] - 0.5, self.GRID_Y[1] + 0.5, 0)
-        glEnd()
-        glEnable(GL_LIGHTING)
+        self.snake_mesh.draw(snake_tex_id)
 
-        glPushMatrix()
-        glTranslatef(self.food[0], self.food[1], 0)
-        if shader_program and apple_tex_id:
+        if apple_shader:
+            glPushMatrix()
+            glTranslatef(self.food[0], self.food[1], 0)
             draw_pulsating_apple(
                 0.6 * CELL_SCALE_FACTOR, apple_tex_id, shader_program, time
             )
-        else:
-            draw_cube_common(COLOR_FOOD, 0.6 * CELL_SCALE_FACTOR, 0.5, apple_tex_id)
-        glPopMatrix()
+            glPopMatrix()
+
+        # The head is on the cell of the food it just ate
+        if self.score > self.shown_score:
+            particle_pool.food_burst(self.segment_cube(0)[:3])
+        self.shown_score = self.score
+        particle_pool.draw()
 
-        for i, (sx, sy) in enumerate(self.snake):
+    def draw_world(self, snake_tex_id, floor_tex_id, apple_tex_id, apple_shader):
+        """Draws everything that only changes on a tick: floor, grid, head and food.
+
+        The snake body is drawn from the snake mesh, and the animated apple is left to
+        the caller when apple_shader is set.
+        """
+        draw_planar_floor(self.GRID_X, self.GRID_Y, floor_tex_id)
+
+        use_unlit()
+        glColor3f(*COLOR_GRID)
+        gl_state.set_line_width(1.0)
+        x0, x1 = self.GRID_X[0] - 0.5, self.GRID_X[1] + 0.5
+        y0, y1 = self.GRID_Y[0] - 0.5, self.GRID_Y[1] + 0.5
+        xs = np.arange(self.GRID_X[0] - 1, self.GRID_X[1] + 2) - 0.5
+        ys = np.arange(self.GRID_Y[0] - 1, self.GRID_Y[1] + 2) - 0.5
+        draw_arrays(GL_LINES, grid_lines(xs, ys, (x0, x1), (y0, y1), -0.54))
+
+        gl_state.set_line_width(3.0)
+        glColor3f(*COLOR_BORDER)
+        draw_arrays(GL_LINE_LOOP, rect_loop(x0, y0, x1, y1, 0))
+        gl_state.enable(GL_LIGHTING)
+
+        per_cube_outline = render_options.outline_mode == "per_cube"
+        outlines = []
+
+        if not apple_shader:
             glPushMatrix()
-            glTranslatef(sx, sy, 0)
-            if i == 0:
-                draw_cube_common(COLOR_HEAD, 0.9 * CELL_SCALE_FACTOR, 0.5, snake_tex_id)
-            else:
-                draw_cube_common(
-                    COLOR_BODY, 0.85 * CELL_SCALE_FACTOR, 0.2, snake_tex_id
-                )
+            glTranslatef(self.food[0], self.food[1], 0)
+            draw_cube_common(
+                COLOR_FOOD,
+                0.6 * CELL_SCALE_FACTOR,
+                0.5,
+                apple_tex_id,
+                per_cube_outline,
+            )
             glPopMatrix()
+            outlines.append((self.food[0], self.food[1], 0, 0.6 * CELL_SCALE_FACTOR))
+
+        head = self.segment_cube(0)
+        glPushMatrix()
+        glTranslatef(*head[:3])
+        draw_cube_common(COLOR_HEAD, head[3], 0.5, snake_tex_id, per_cube_outline)
+        glPopMatrix()
+        outlines.append(head)
+
+        if render_options.outline_mode == "batched":
+            draw_cube_outlines(outlines)
@@ -1,27 +1,86 @@
 import random
 import math
+import time
+import numpy as np
 import pygame
+from collections import deque
 from pygame.locals import *
 from OpenGL.GL import *
 from OpenGL.GLU import *
 from config import *
-from utils import rot_x, rot_y, mat_mul, clamp
+from utils import rot_x, rot_y, mat_mul, clamp, next_state_version
 from graphics import (
+    CUBE_EDGE_POSITIONS,
+    draw_arrays,
     draw_cube_common,
+    grid_lines,
     setup_lights,
-    setup_point_light,
+    setup_point_lights,
     draw_cube_face_background,
     draw_pulsating_apple,
     draw_background,
+    draw_cube_outlines,
+    draw_cube_silhouettes,
+    gl_state,
+    render_options,
+    use_unlit,
 )
+from scene_cache import SceneCache
+from snake_mesh import SnakeMesh
+from particles import particle_pool
+from shadows import shadow_maps
+from telemetry import TICK_ATE, TICK_DIED, TURN_FLAGS, TickLog
+
+
+def cube_step(n, cell, dir_idx):
+    """Returns the cell next to a cube cell toward `dir_idx`, and the new direction.
+
+    The cube has n x n cells per face. Crossing an edge of a face leads onto the
+    next face, with the direction turned to match it.
+    """
+    f, x, y = cell
+    dx, dy = 0, 0
+    if dir_idx == 0:
+        dy = -1
+    elif dir_idx == 1:
+        dx = 1
+    elif dir_idx == 2:
+        dy = 1
+    elif dir_idx == 3:
+        dx = -1
+
+    nx, ny = x + dx, y + dy
+    nf, nd = f, dir_idx
+
+    if not (0 <= nx < n and 0 <= ny < n):
+        nf, nd, inv = CUBE_TRANSITIONS[f][dir_idx]
+        p = x if dir_idx in (0, 2) else y
+        if inv:
+            p = n - 1 - p
+        if nd == 0:
+            nx, ny = p, n - 1
+        elif nd == 1:
+            nx, ny = 0, p
+        elif nd == 2:
+            nx, ny = p, 0
+        else:
+            nx, ny = n - 1, p
+
+    return (nf, nx, ny), nd
 
 
 class CubeGame:
-    def __init__(self):
-        """Initializes the cube game mode state."""
-        self.N = 8
+    def __init__(self, n=CUBE_N, seed=None):
+        """Initializes the cube game mode state with `n` cells along each face edge."""
+        self.N = n
         self.CELL_SPAN = 2.0 / self.N
         self.SCALE = self.CELL_SPAN * 0.85
+        # Food is placed by the game's own generator, which saves keep and restore
+        self.random = random.Random(seed)
+
+        self.scene_cache = SceneCache()
+        self.snake_mesh = SnakeMesh(COLOR_BODY, 0.2)
+        self.telemetry = TickLog("cube", 3)
 
         # Define camera keys BEFORE reset
         self.cam_keys = {
@@ -40,12 +99,23 @@ class CubeGame:
         c = self.N // 2
         self.snake = [(0, c, c), (0, c - 1, c), (0, c - 2, c)]
         self.dir_idx = 1
-        self.next_turn = None
+        self.turns = deque()
+        # (input time, tick time, state version) of the turns applied since last taken
+        self.applied_inputs = []
         self.food = self.get_food()
         self.cam_pitch = 25.0
         self.cam_yaw = 30.0
         self.cam_zoom = -5.5
         self.score = 0
+        # Score of the last frame drawn, to burst particles when it goes up
+        self.shown_score = 0
+        # Seconds played, added by the frame loop
+        self.play_time = 0.0
+        # Segments are numbered as they are created; the head has the newest number
+        self.head_seq = len(self.snake) - 1
+        self.version = next_state_version()
+        self.epoch = self.version
+        self.telemetry.reset()
 
         for k in self.cam_keys:
             self.cam_keys[k] = False
@@ -54,9 +124,9 @@ class CubeGame:
         """Finds a random face and grid position for food, avoiding the snake."""
         while True:
             pos = (
-                random.randint(0, 5),
-                random.randint(0, self.N - 1),
-                random.randint(0, self.N - 1),
+                self.random.randint(0, 5),
+                self.random.randint(0, self.N - 1),
+                self.random.randint(0, self.N - 1),
             )
             if pos not in self.snake:
                 return pos
@@ -66,9 +136,9 @@ class CubeGame:
         if event.type == KEYDOWN:
             # Snake
             if event.key == K_LEFT:
-                self.next_turn = "LEFT"
+                self.queue_turn("LEFT")
             elif event.key == K_RIGHT:
-                self.next_turn = "RIGHT"
+                self.queue_turn("RIGHT")
 
             # Camera Start
             if event.key == K_w:
@@ -99,6 +169,11 @@ class CubeGame:
             elif event.key == K_e:
                 self.cam_keys["zoom_out"] = False
 
+    def queue_turn(self, turn, event_time=None):
+        """Queues a turn for the coming ticks, one per tick; extra presses are dropped."""
+        if len(self.turns) < TURN_QUEUE_SIZE:
+            self.turns.append((turn, event_time or time.perf_counter()))
+
     def update_camera(self):
         """Updates camera values based on active key flags."""
         if self.cam_keys["up"]:
@@ -145,56 +220,117 @@ class CubeGame:
             return (0, -1, 0)
         return (0, 1, 0)
 
+    def next_move(self, turn=None):
+        """Returns the cell the head would move to after `turn`, and the new direction.
+
+        Crossing an edge of a face leads onto the next face, with the direction
+        turned to match it.
+        """
+        dir_idx = self.dir_idx
+        if turn == "LEFT":
+            dir_idx = (dir_idx - 1) % 4
+        elif turn == "RIGHT":
+            dir_idx = (dir_idx + 1) % 4
+        return cube_step(self.N, self.snake[0], dir_idx)
+
+    def is_free(self, cell):
+        """Returns whether the head can move into a cell, i.e. it is off the snake."""
+        return cell not in self.snake
+
     def update(self):
         """Updates game logic for one tick: moves snake across faces, checks collisions."""
-        if self.next_turn == "LEFT":
-            self.dir_idx = (self.dir_idx - 1) % 4
-        elif self.next_turn == "RIGHT":
-            self.dir_idx = (self.dir_idx + 1) % 4
-        self.next_turn = None
-
-        f, x, y = self.snake[0]
-        dx, dy = 0, 0
-        if self.dir_idx == 0:
-            dy = -1
-        elif self.dir_idx == 1:
-            dx = 1
-        elif self.dir_idx == 2:
-            dy = 1
-        elif self.dir_idx == 3:
-            dx = -1
-
-        nx, ny = x + dx, y + dy
-        nf, nd = f, self.dir_idx
-
-        if not (0 <= nx < self.N and 0 <= ny < self.N):
-            nf, nd, inv = CUBE_TRANSITIONS[f][self.dir_idx]
-            p = x if self.dir_idx in (0, 2) else y
-            if inv:
-                p = self.N - 1 - p
-            if nd == 0:
-                nx, ny = p, self.N - 1
-            elif nd == 1:
-                nx, ny = 0, p
-            elif nd == 2:
-                nx, ny = p, 0
-            else:
-                nx, ny = self.N - 1, p
-
-        new_head = (nf, nx, ny)
-        if new_head in self.snake:
+        turn, event_time = self.turns.popleft() if self.turns else (None, None)
+        tick_time = time.perf_counter()
+        new_head, nd = self.next_move(turn)
+
+        if not self.is_free(new_head):
+            flags = TURN_FLAGS.get(turn, 0) | TICK_DIED
+            self.record_tick(new_head, flags, 0.0, tick_time)
             return False
 
         self.snake.insert(0, new_head)
+        self.head_seq += 1
         self.dir_idx = nd
+        flags = TURN_FLAGS.get(turn, 0)
+        food_time = 0.0
         if new_head == self.food:
             self.score += 1
+            flags |= TICK_ATE
+            food_start = time.perf_counter()
             self.food = self.get_food()
+            food_time = time.perf_counter() - food_start
         else:
             self.snake.pop()
 
+        self.version = next_state_version()
+        if turn:
+            self.applied_inputs.append((event_time, tick_time, self.version))
+        self.record_tick(new_head, flags, food_time, tick_time)
         return True
 
+    def record_tick(self, head, flags, food_time, tick_time):
+        """Adds the tick that started at `tick_time` to the telemetry."""
+        duration = time.perf_counter() - tick_time
+        self.telemetry.add(head, len(self.snake), self.score, flags, food_time, duration)
+
+    def session_stats(self):
+        """Returns the score, snake length and ticks played, for session_store."""
+        # Reset numbers the 3 starting segments 0 to 2 and every tick that moved
+        # numbered a new head; the tick the snake died in did not
+        return self.score, len(self.snake), self.head_seq - 1
+
+    def cell_count(self):
+        """Returns the number of cells on the cube, the most the snake can occupy."""
+        return 6 * self.N * self.N
+
+    def segment_cube(self, i):
+        """Returns the (x, y, z, scale) cube of the i-th snake segment, 0 being the head."""
+        wx, wy, wz = self.local_to_world(*self.snake[i])
+        scale = 0.98 if i == 0 else 0.9
+        return (wx, wy, wz, self.SCALE * scale)
+
+    def point_lights(self):
+        """Returns the (position, color) point lights hovering over the head and the food."""
+        offset_dist = 0.5
+        lights = []
+        for cell, color in (
+            (self.snake[0], (0.1, 0.6, 0.1, 1.0)),
+            (self.food, (0.6, 0.1, 0.1, 1.0)),
+        ):
+            w = self.local_to_world(*cell)
+            n = self.get_face_normal(cell[0])
+            pos = (
+                w[0] + n[0] * offset_dist,
+                w[1] + n[1] * offset_dist,
+                w[2] + n[2] * offset_dist,
+                1.0,
+            )
+            lights.append((pos, color))
+        return lights
+
+    def shadow_lights(self):
+        """Returns (position, direction) of the shadow-casting lights, matching point_lights."""
+        views = []
+        for (pos, _), cell in zip(self.point_lights(), (self.snake[0], self.food)):
+            n = self.get_face_normal(cell[0])
+            views.append((pos[:3], (-n[0], -n[1], -n[2])))
+        return views
+
+    def shadow_casters(self):
+        """Returns the (x, y, z, scale) cubes that cast shadows besides the body mesh."""
+        fx, fy, fz = self.local_to_world(*self.food)
+        return [(fx, fy, fz, self.SCALE * 0.7), self.segment_cube(0)]
+
+    def draw_shadow_casters(self):
+        """Draws the depth of the food, the head and the body for a shadow pass."""
+        draw_cube_silhouettes(self.shadow_casters())
+        self.snake_mesh.draw_depth()
+
+    def release_resources(self):
+        """Frees this game's GL objects; drawing it again recreates them."""
+        self.scene_cache.release()
+        self.snake_mesh.release()
+
     def render(
         self,
         snake_tex_id=None,
@@ -206,6 +342,9 @@ class CubeGame:
     ):
         """Renders the entire cube game scene including lights, cube faces, and objects."""
 
+        self.snake_mesh.sync(self)
+        shadow_maps.update(self)
+
         # Draw background first
         draw_background(bg_tex_id)
 
@@ -218,35 +357,40 @@ class CubeGame:
         glTranslatef(0.0, 0.0, self.cam_zoom)
         glRotatef(self.cam_pitch, 1, 0, 0)
         glRotatef(self.cam_yaw, 0, 1, 0)
+        shadow_maps.use_camera()
 
-        head_face = self.snake[0][0]
-        food_face = self.food[0]
-
-        hw = self.local_to_world(*self.snake[0])
-        fw = self.local_to_world(*self.food)
-
-        hn = self.get_face_normal(head_face)
-        fn = self.get_face_normal(food_face)
-
-        offset_dist = 0.5
-        l_hw = (
-            hw[0] + hn[0] * offset_dist,
-            hw[1] + hn[1] * offset_dist,
-            hw[2] + hn[2] * offset_dist,
-            1.0,
-        )
-        l_fw = (
-            fw[0] + fn[0] * offset_dist,
-            fw[1] + fn[1] * offset_dist,
-            fw[2] + fn[2] * offset_dist,
-            1.0,
+        setup_lights((0, 0, 30, 1))
+        setup_point_lights(self.point_lights())
+
+        apple_shader = bool(shader_program and apple_tex_id)
+        self.scene_cache.draw(
+            (self.version, snake_tex_id, floor_tex_id, apple_tex_id, apple_shader),
+            lambda: self.draw_world(
+                snake_tex_id, floor_tex_id, apple_tex_id, apple_shader
+            ),
         )
+        self.snake_mesh.draw(snake_tex_id)
 
-        setup_lights((0, 0, 30, 1))
+        if apple_shader:
+            glPushMatrix()
+            glTranslatef(*self.local_to_world(*self.food))
+            # Smaller apple in cube mode
+            draw_pulsating_apple(self.SCALE * 0.7, apple_tex_id, shader_program, time)
+            glPopMatrix()
+
+        # The head is on the cell of the food it just ate
+        if self.score > self.shown_score:
+            particle_pool.food_burst(self.segment_cube(0)[:3], self.CELL_SPAN)
+        self.shown_score = self.score
+        particle_pool.draw()
 
-        setup_point_light(0, l_hw, (0.1, 0.6, 0.1, 1.0))
-        setup_point_light(1, l_fw, (0.6, 0.1, 0.1, 1.0))
+    def draw_world(self, snake_tex_id, floor_tex_id, apple_tex_id, apple_shader):
+        """Draws everything that only changes on a tick: cube faces, head and food.
 
+        The snake body is drawn from the snake mesh, and the animated apple is left to
+        the caller when apple_shader is set.
+        """
+        lines = np.linspace(-1.0, 1.0, self.N + 1)
         for f in range(6):
             glPushMatrix()
             if f == 1:
@@ -263,53 +407,39 @@ class CubeGame:
 
             draw_cube_face_background(floor_tex_id, self.N)
 
-            glDisable(GL_LIGHTING)
+            use_unlit()
             glColor3f(0.2, 0.2, 0.2)
-            glLineWidth(1.0)
-            glBegin(GL_LINES)
-            for i in range(self.N + 1):
-                p = -1 + i * self.CELL_SPAN
-                glVertex3f(p, -1, 0)
-                glVertex3f(p, 1, 0)
-                glVertex3f(-1, p, 0)
-                glVertex3f(1, p, 0)
-            glEnd()
-            glEnable(GL_LIGHTING)
+            gl_state.set_line_width(1.0)
+            draw_arrays(GL_LINES, grid_lines(lines, lines, (-1, 1), (-1, 1), 0))
+            gl_state.enable(GL_LIGHTING)
             glPopMatrix()
 
-        glDisable(GL_LIGHTING)
-        glLineWidth(2.0)
-        glColor3fv(COLOR_BORDER)
-        s = 1.01
-        for a, b in [(-s, -s), (s, -s), (s, s), (-s, s)]:
-            glBegin(GL_LINES)
-            glVertex3f(a, b, s)
-            glVertex3f(a, b, -s)
-            glEnd()
-        for z in [-s, s]:
-            glBegin(GL_LINE_LOOP)
-            glVertex3f(-s, -s, z)
-            glVertex3f(s, -s, z)
-            glVertex3f(s, s, z)
-            glVertex3f(-s, s, z)
-            glEnd()
-        glEnable(GL_LIGHTING)
+        use_unlit()
+        gl_state.set_line_width(2.0)
+        glColor3f(*COLOR_BORDER)
+        # The edges of the unit cube, doubled and pushed out a little
+        draw_arrays(GL_LINES, CUBE_EDGE_POSITIONS * 2.02)
+        gl_state.enable(GL_LIGHTING)
 
-        glPushMatrix()
-        glTranslatef(*fw)
-        if shader_program and apple_tex_id:
-            # Smaller apple in cube mode
-            draw_pulsating_apple(self.SCALE * 0.7, apple_tex_id, shader_program, time)
-        else:
-            draw_cube_common(COLOR_FOOD, self.SCALE * 0.7, 0.5, apple_tex_id)
-        glPopMatrix()
+        per_cube_outline = render_options.outline_mode == "per_cube"
+        outlines = []
 
-        for i, seg in enumerate(self.snake):
-            wx, wy, wz = self.local_to_world(*seg)
+        if not apple_shader:
+            fw = self.local_to_world(*self.food)
             glPushMatrix()
-            glTranslatef(wx, wy, wz)
-            if i == 0:
-                draw_cube_common(COLOR_HEAD, self.SCALE * 0.98, 0.5, snake_tex_id)
-            else:
-                draw_cube_common(COLOR_BODY, self.SCALE * 0.9, 0.2, snake_tex_id)
+            glTranslatef(*fw)
+            draw_cube_common(
+                COLOR_FOOD, self.SCALE * 0.7, 0.5, apple_tex_id, per_cube_outline
+            )
             glPopMatrix()
+            outlines.append((fw[0], fw[1], fw[2], self.SCALE * 0.7))
+
+        head = self.segment_cube(0)
+        glPushMatrix()
+        glTranslatef(*head[:3])
+        draw_cube_common(COLOR_HEAD, head[3], 0.5, snake_tex_id, per_cube_outline)
+        glPopMatrix()
+        outlines.append(head)
+
+        if render_options.outline_mode == "batched":
+            draw_cube_outlines(outlines)
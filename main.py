@@ -1,22 +1,53 @@
 import pygame
 import os
+import settings
+import sys
+import time
+import gl_debug
 from pygame.locals import *
+
+if __name__ == "__main__":
+    # Before config is imported, which applies the settings flags
+    settings.use_command_line(sys.argv[1:])
+
+from config import *  # before OpenGL.GL, which reads the GL_DEBUG flags on import
 from OpenGL.GL import *
 from OpenGL.GLU import *
-from config import *
-from graphics import draw_text_gl, draw_cube_common, draw_background, draw_rect_2d
-from logic_2d import PlanarGame
-from logic_cube import CubeGame
+from graphics import (
+    draw_text_gl,
+    draw_cube_common,
+    draw_background,
+    draw_rect_2d,
+    gl_resources,
+    gl_state,
+    render_options,
+    shader_lighting,
+    upload_texture_image,
+)
+from fonts import font_cache
+from profiler import frame_profiler
+from frame_scheduler import FrameScheduler
+from hud import hud_layer
+from quality import quality_controller
+from render_target import scene_target
+from particles import particle_pool
+from protocol import MODE_NAMES
+from sessions import MODES, session_store
+from shadows import shadow_maps
 from utils import load_shader_program
 
 
 def load_texture_from_file(filename):
     """
-    Loads an image file as an OpenGL texture.
+    Loads an image file as an OpenGL texture, or shares the one already loaded.
     """
+    tex_id = gl_resources.find("texture", filename)
+    if tex_id is not None:
+        return tex_id
+
     if not os.path.exists(filename):
         print(f"Warning: Texture {filename} not found. Using procedural fallback.")
-        return create_checkerboard_texture()
+        return create_checkerboard_texture(filename)
 
     try:
         texture_surface = pygame.image.load(filename)
@@ -25,30 +56,14 @@ def load_texture_from_file(filename):
         height = texture_surface.get_height()
 
         tex_id = glGenTextures(1)
-        glBindTexture(GL_TEXTURE_2D, tex_id)
-        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR)
-        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
-        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_REPEAT)
-        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_REPEAT)
-
-        glTexImage2D(
-            GL_TEXTURE_2D,
-            0,
-            GL_RGBA,
-            width,
-            height,
-            0,
-            GL_RGBA,
-            GL_UNSIGNED_BYTE,
-            texture_data,
-        )
-        return tex_id
+        upload_texture_image(tex_id, texture_data, width, height)
+        return gl_resources.add("texture", tex_id, filename, width * height * 4)
     except Exception as e:
         print(f"Error loading texture {filename}: {e}")
-        return create_checkerboard_texture()
+        return create_checkerboard_texture(filename)
 
 
-def create_checkerboard_texture():
+def create_checkerboard_texture(label="checkerboard"):
     """
     Creates a fallback procedural checkerboard texture.
     """
@@ -62,7 +77,7 @@ def create_checkerboard_texture():
                 checker_data.extend([150, 150, 150, 255])
 
     tex_id = glGenTextures(1)
-    glBindTexture(GL_TEXTURE_2D, tex_id)
+    gl_state.bind_texture(tex_id)
     glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
     glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
     glTexImage2D(
@@ -76,79 +91,364 @@ def create_checkerboard_texture():
         GL_UNSIGNED_BYTE,
         bytes(checker_data),
     )
-    return tex_id
+    return gl_resources.add("texture", tex_id, label, width * height * 4)
+
+
+def release_scene_resources():
+    """Frees the GL objects shared by both game modes, while neither is shown."""
+    shadow_maps.release()
+    scene_target.release()
+    hud_layer.release()
+
+
+def watch_shader(vertex_path, fragment_path, install):
+    """Has the hot reload watcher install a shader again when its sources change."""
+    # The watcher is only imported when HOT_RELOAD is on
+    if HOT_RELOAD:
+        from hot_reload import asset_watcher
+
+        asset_watcher.watch_shader(vertex_path, fragment_path, install)
+
+
+class ModeAssets:
+    """Textures, shaders and games that only the game modes need.
+
+    The first menu frame is shown without them. They are then loaded one step per
+    frame, so no single frame stalls for long, and whatever is still missing is
+    loaded at once when a mode is entered.
+    """
+
+    def __init__(self):
+        """Starts with nothing loaded."""
+        self.floor_tex_id = None
+        self.apple_tex_id = None
+        self.shader_program = None
+        self.games = {}
+        self.spectator = None
+        self.pending = [
+            self._load_lighting_shader,
+            self._load_pulse_shader,
+            self._load_particle_shader,
+            self._load_textures,
+            self._create_games,
+        ]
+
+    def load_next(self):
+        """Runs the next loading step, if any is left."""
+        if self.pending:
+            self.pending.pop(0)()
+
+    def load_all(self):
+        """Runs every loading step that is left."""
+        while self.pending:
+            self.load_next()
+
+    def _load_lighting_shader(self):
+        """Compiles the per-pixel lighting program, and again when its sources change."""
+        try:
+            shader_lighting.set_program(load_shader_program("lit.vert", "lit.frag"))
+        except Exception as e:
+            print(
+                f"Lighting shader compilation failed, using fixed-function lighting: {e}"
+            )
+        watch_shader("lit.vert", "lit.frag", shader_lighting.set_program)
+
+    def _load_pulse_shader(self):
+        """Compiles the apple's program, and again when its sources change."""
+        try:
+            self._install_pulse_shader(load_shader_program("pulse.vert", "pulse.frag"))
+            print("Shader loaded successfully.")
+        except Exception as e:
+            print(f"Shader compilation failed: {e}")
+            self.shader_program = None
+        watch_shader("pulse.vert", "pulse.frag", self._install_pulse_shader)
+
+    def _install_pulse_shader(self, program):
+        """Makes `program` the apple's, releasing the one it replaces."""
+        if self.shader_program:
+            gl_resources.release("program", self.shader_program)
+        self.shader_program = gl_resources.add(
+            "program", program, "pulse.vert/pulse.frag"
+        )
+
+    def _load_particle_shader(self):
+        """Allocates the particles; none are drawn unless their program compiles."""
+        particle_pool.allocate()
+        try:
+            program = load_shader_program("particle.vert", "particle.frag")
+            self._install_particle_shader(program)
+        except Exception as e:
+            print(f"Warning: Particle shader compilation failed: {e}")
+        watch_shader("particle.vert", "particle.frag", self._install_particle_shader)
+
+    def _install_particle_shader(self, program):
+        """Makes `program` the particles', releasing the one it replaces."""
+        if particle_pool.program:
+            gl_resources.release("program", particle_pool.program)
+        particle_pool.set_program(
+            gl_resources.add("program", program, "particle.vert/particle.frag")
+        )
+
+    def _load_textures(self):
+        """Loads the floor and apple textures."""
+        self.floor_tex_id = load_texture_from_file("textures/floor.jpg")
+        self.apple_tex_id = load_texture_from_file("textures/apple.jpg")
+
+    def _create_games(self):
+        """Imports the game modes, unused by the menu, and creates a game of each."""
+        from logic_2d import PlanarGame
+        from logic_cube import CubeGame
+        from arena import ArenaGame
+        from spectator import SpectatorWall
+
+        self.games["PLANAR"] = PlanarGame()
+        self.games["CUBE"] = CubeGame()
+        self.games["ARENA"] = ArenaGame()
+        # Not one of `games`: its bots play themselves and it is never game over
+        self.spectator = SpectatorWall()
+
+    def release(self):
+        """Releases everything that was loaded."""
+        for game in self.games.values():
+            game.release_resources()
+        if self.spectator:
+            self.spectator.release()
+        for tex_id in (self.floor_tex_id, self.apple_tex_id):
+            if tex_id is not None:
+                gl_resources.release("texture", tex_id)
+        if self.shader_program:
+            gl_resources.release("program", self.shader_program)
+        if particle_pool.program:
+            gl_resources.release("program", particle_pool.program)
+        particle_pool.release()
+        shader_lighting.release()
+
+
+def use_screen_camera():
+    """Sets the perspective of the menu and game over screens, whatever was drawn last."""
+    glMatrixMode(GL_PROJECTION)
+    glLoadIdentity()
+    gluPerspective(45, DISPLAY_SIZE[0] / DISPLAY_SIZE[1], 0.1, 100.0)
+    glMatrixMode(GL_MODELVIEW)
+    glLoadIdentity()
+
+
+def draw_menu_screen(
+    bg_tex_id, snake_tex_id, font_large, font_small, paused=None, best=None
+):
+    """Draws the main menu: a rotating cube behind the title and mode choices.
+
+    `paused` names the mode of a game that can be resumed, if there is one, and
+    `best` maps modes to their best scores, listed in the top-left corner.
+    """
+    draw_background(bg_tex_id)
+    use_screen_camera()
+    glTranslatef(0, 0, -5)
+    glRotatef(pygame.time.get_ticks() * 0.05, 1, 1, 0)
+    draw_cube_common(
+        (0.2, 0.2, 0.3), scale=1.5, emission_level=0.1, texture_id=snake_tex_id
+    )
+
+    cx, cy = DISPLAY_SIZE[0] // 2, DISPLAY_SIZE[1] // 2
+    draw_text_gl(cx - 150, cy + 50, "SNAKE 3D", font_large, (0, 255, 255))
+    draw_text_gl(cx - 120, cy - 20, "Press [1] Planar Mode", font_small)
+    draw_text_gl(cx - 120, cy - 60, "Press [2] Cube Mode", font_small)
+    draw_text_gl(cx - 120, cy - 100, "Press [3] Arena Mode", font_small)
+    draw_text_gl(cx - 120, cy - 140, "Press [4] Spectator Wall", font_small)
+    quit_y = cy - 180
+    if paused:
+        draw_text_gl(cx - 120, quit_y, f"Press [R] Resume {paused.title()}", font_small)
+        quit_y -= 40
+    draw_text_gl(cx - 120, quit_y, "Press [ESC] to Quit", font_small, (150, 150, 150))
+
+    lines = [(mode, best[mode]) for mode in MODES if best and best.get(mode)]
+    if lines:
+        y = DISPLAY_SIZE[1] - 50
+        draw_text_gl(20, y, "Best Scores", font_small, (255, 215, 0))
+        for mode, scores in lines:
+            y -= 35
+            text = f"{mode.title()}: {'  '.join(map(str, scores))}"
+            draw_text_gl(20, y, text, font_small, (200, 200, 200))
+
+
+def draw_game_over_screen(
+    bg_tex_id, snake_tex_id, font_large, font_small, score, rank=None
+):
+    """Draws the game over screen with the final score and the next choices.
+
+    `rank` is the percentage of earlier games of the mode that scored less, shown
+    once the session store has written this one.
+    """
+    draw_background(bg_tex_id)
+    use_screen_camera()
+    glTranslatef(0, 0, -5)
+    glRotatef(pygame.time.get_ticks() * 0.02, 0, 1, 0)
+    draw_cube_common(
+        (0.5, 0.0, 0.0), scale=1.5, emission_level=0.2, texture_id=snake_tex_id
+    )
+    particle_pool.draw()
+
+    cx, cy = DISPLAY_SIZE[0] // 2, DISPLAY_SIZE[1] // 2
+
+    # Background panel for Game Over text
+    draw_rect_2d(cx - 200, cy - 120, 400, 220, (0.0, 0.0, 0.0, 0.8))
+
+    draw_text_gl(cx - 160, cy + 60, "GAME OVER", font_large, (255, 50, 50))
+    draw_text_gl(cx - 60, cy + 10, f"Score: {score}", font_small, (255, 255, 255))
+    if rank is not None:
+        text = f"Better than {rank:.0f}% of your games"
+        draw_text_gl(cx - 140, cy - 20, text, font_small, (200, 200, 200))
+    draw_text_gl(cx - 100, cy - 50, "[R] Try Again", font_small, (0, 255, 0))
+    draw_text_gl(cx - 100, cy - 90, "[M] Main Menu", font_small, (200, 200, 200))
 
 
 def main():
     """Main entry point of the application. Initializes Pygame, OpenGL, and runs the game loop."""
+    flags = DOUBLEBUF | OPENGL
+    if HEADLESS:
+        os.environ.setdefault("SDL_VIDEODRIVER", "offscreen")
+        flags |= HIDDEN
+
     pygame.init()
     pygame.display.gl_set_attribute(pygame.GL_DEPTH_SIZE, 24)
-    pygame.display.gl_set_attribute(pygame.GL_MULTISAMPLEBUFFERS, 1)
-    pygame.display.gl_set_attribute(pygame.GL_MULTISAMPLESAMPLES, 4)
-    pygame.display.set_mode(DISPLAY_SIZE, DOUBLEBUF | OPENGL)
+    if MSAA_SAMPLES:
+        pygame.display.gl_set_attribute(pygame.GL_MULTISAMPLEBUFFERS, 1)
+        pygame.display.gl_set_attribute(pygame.GL_MULTISAMPLESAMPLES, MSAA_SAMPLES)
+    try:
+        pygame.display.set_mode(DISPLAY_SIZE, flags, vsync=int(VSYNC))
+    except pygame.error as e:
+        if not VSYNC:
+            raise
+        print(f"Warning: VSync is not available ({e}), running without it.")
+        pygame.display.set_mode(DISPLAY_SIZE, flags)
     pygame.display.set_caption("Ultimate OpenGL Snake")
 
-    glEnable(GL_DEPTH_TEST)
-    glEnable(GL_MULTISAMPLE)
+    gl_state.enable(GL_DEPTH_TEST)
 
+    # Only what the menu draws is loaded before its first frame
     snake_tex_id = load_texture_from_file("textures/snake.jpg")
-    floor_tex_id = load_texture_from_file("textures/floor.jpg")
-    apple_tex_id = load_texture_from_file("textures/apple.jpg")
     bg_tex_id = load_texture_from_file("textures/bg.jpg")
+    font_large = font_cache.load("Arial", 50, bold=True)
+    font_small = font_cache.load("Arial", 25)
 
-    try:
-        shader_program = load_shader_program("pulse.vert", "pulse.frag")
-        print("Shader loaded successfully.")
-    except Exception as e:
-        print(f"Shader compilation failed: {e}")
-        shader_program = None
-
-    font_large = pygame.font.SysFont("Arial", 50, bold=True)
-    font_small = pygame.font.SysFont("Arial", 25)
-
-    game_planar = PlanarGame()
-    game_cube = CubeGame()
+    assets = ModeAssets()
+    games = assets.games
+    game_planar = game_cube = game_arena = None
 
     state = "MENU"
+    shown_state = state
+    flipped_state, last_flip_time = None, 0.0
     last_game_mode = None
     final_score = 0
-
-    clock = pygame.time.Clock()
+    final_session = None
+    # Save of the planar or cube game left with ESC, resumed from the menu
+    paused = paused_name = None
+    if not SERVER:
+        from savegame import read_resume, saved_mode
+
+        paused = read_resume()
+        if paused:
+            modes = {mode: name for name, mode in MODE_NAMES.items()}
+            paused_name = modes[saved_mode(paused)]
+
+    scheduler = FrameScheduler()
     move_timer = 0
     running = True
+    simulation = None
+
+    profiler = frame_profiler
+    profiler.enabled = SHOW_STATS
+    quality = quality_controller
+    quality.set_enabled(ADAPTIVE_QUALITY)
+    asset_watcher = None
+    if HOT_RELOAD:
+        from hot_reload import asset_watcher
+
+        asset_watcher.start()
+    # Reads the best scores for the menu in the background
+    session_store.start()
 
     while running:
-        dt = clock.tick(60)
+        dt = scheduler.tick(state in ["MENU", "GAME_OVER"])
         move_timer += dt
+        profiler.begin_frame()
 
         current_time = pygame.time.get_ticks() / 1000.0
 
-        for event in pygame.event.get():
+        for event in scheduler.get_events():
             if event.type == QUIT:
                 running = False
 
+            if event.type == KEYDOWN and event.key == K_F3:
+                profiler.enabled = not profiler.enabled
+            if event.type == KEYDOWN and event.key == K_F4:
+                print(f"Outline mode: {render_options.cycle_outline_mode()}")
+            if event.type == KEYDOWN and event.key == K_F5:
+                print(f"Lighting: {render_options.cycle_lighting()}")
+            if event.type == KEYDOWN and event.key == K_F6:
+                print(f"Shadow quality: {render_options.cycle_shadow_quality()}")
+            if event.type == KEYDOWN and event.key == K_F7:
+                render_options.scene_cache = not render_options.scene_cache
+                print(f"Scene cache: {'on' if render_options.scene_cache else 'off'}")
+            if event.type == KEYDOWN and event.key == K_F8:
+                quality.set_enabled(not quality.enabled)
+                print(f"Adaptive quality: {'on' if quality.enabled else 'off'}")
+            if event.type == KEYDOWN and event.key == K_F9:
+                print(f"Render scale: {render_options.cycle_render_scale()}")
+            if event.type == KEYDOWN and event.key == K_F10:
+                scheduler.enabled = not scheduler.enabled
+                print(f"Power saving: {'on' if scheduler.enabled else 'off'}")
+            if event.type == KEYDOWN and event.key == K_F11:
+                print(gl_resources.report())
+
             if event.type == KEYDOWN:
                 if state == "MENU":
                     if event.key == K_ESCAPE:
                         running = False
+                    resuming = event.key == K_r and paused
+                    if event.key in (K_1, K_2, K_3, K_4) or resuming:
+                        assets.load_all()
+                        game_planar, game_cube = games["PLANAR"], games["CUBE"]
+                        game_arena = games["ARENA"]
                     if event.key == K_1:
                         state = "PLANAR"
                         game_planar.reset()
                     if event.key == K_2:
                         state = "CUBE"
                         game_cube.reset()
-
-                elif state in ["PLANAR", "CUBE"]:
+                    if event.key == K_3:
+                        state = "ARENA"
+                        game_arena.reset()
+                    if event.key == K_4:
+                        state = "SPECTATE"
+                        assets.spectator.reset()
+                    if resuming:
+                        from savegame import SaveError, load_game
+
+                        try:
+                            load_game(paused, games[paused_name])
+                            state = paused_name
+                        except SaveError as e:
+                            print(f"Warning: Could not resume the paused game: {e}")
+                        paused = paused_name = None
+
+                elif state in ["PLANAR", "CUBE", "ARENA", "SPECTATE"]:
                     if event.key == K_ESCAPE:
+                        if state in MODE_NAMES and not SERVER:
+                            # The simulation thread's copy has the latest tick
+                            if simulation:
+                                simulation.hand_back()
+                                simulation = None
+                            from savegame import save_game
+
+                            paused = save_game(games[state])
+                            paused_name = state
                         state = "MENU"
 
                 elif state == "GAME_OVER":
                     if event.key == K_r:
                         state = last_game_mode
-                        if state == "PLANAR":
-                            game_planar.reset()
-                        else:
-                            game_cube.reset()
+                        games[state].reset()
                     elif event.key == K_m or event.key == K_ESCAPE:
                         state = "MENU"
 
@@ -156,14 +456,43 @@ def main():
                 game_planar.process_event(event)
             elif state == "CUBE":
                 game_cube.process_event(event)
+            elif state == "ARENA":
+                game_arena.process_event(event)
 
         if state == "PLANAR":
             game_planar.update_camera()
         elif state == "CUBE":
             game_cube.update_camera()
-
-        if state in ["PLANAR", "CUBE"]:
-            if move_timer >= MOVE_DELAY:
+        elif state == "ARENA":
+            game_arena.update_camera()
+
+        if SIMULATION_THREAD or SERVER:
+            # The arena's snapshot would be its whole board, so it ticks in the loop
+            game = games.get(state) if state != "ARENA" else None
+            if simulation and (
+                simulation.view is not game or simulation.epoch != game.epoch
+            ):
+                simulation.stop()
+                simulation = None
+            if game and not simulation:
+                if SERVER:
+                    from net_client import NetClient
+
+                    simulation = NetClient(game, SERVER, ROOM, state)
+                else:
+                    from simulation import Simulation
+
+                    simulation = Simulation(game, MOVE_DELAY / 1000.0)
+                simulation.start()
+
+        if state in ["PLANAR", "CUBE", "ARENA"]:
+            if simulation:
+                simulation.send_input()
+                if not simulation.sync_view():
+                    final_score = simulation.view.score
+                    last_game_mode = state
+                    state = "GAME_OVER"
+            elif move_timer >= MOVE_DELAY:
                 move_timer = 0
                 is_alive = True
 
@@ -177,114 +506,196 @@ def main():
                     if not is_alive:
                         final_score = game_cube.score
                         last_game_mode = "CUBE"
+                elif state == "ARENA":
+                    is_alive = game_arena.update()
+                    if not is_alive:
+                        final_score = game_arena.score
+                        last_game_mode = "ARENA"
 
                 if not is_alive:
                     state = "GAME_OVER"
+            if state == "GAME_OVER":
+                final_session = session_store.record(
+                    last_game_mode.lower(), games[last_game_mode]
+                )
+        elif state == "SPECTATE":
+            assets.spectator.update(dt)
+
+        # Turns applied by this frame's tick, or by ticks the snapshot now shows
+        shown_inputs = []
+        for played in games.values():
+            shown_inputs += played.applied_inputs
+            played.applied_inputs = []
+        if simulation:
+            shown_inputs += simulation.take_shown_inputs()
+
+        # Leaving a mode frees what only it draws with
+        if state != shown_state:
+            if shown_state in games:
+                games[shown_state].release_resources()
+            if shown_state == "SPECTATE":
+                assets.spectator.release()
+            if state not in games:
+                release_scene_resources()
+            # Particles belong to the scene they were emitted in
+            particle_pool.clear()
+            if state == "GAME_OVER":
+                particle_pool.death_burst((0, 0, 0), 1.5)
+            shown_state = state
+        particle_pool.step(dt / 1000.0)
+
+        if render_options.multisample:
+            gl_state.enable(GL_MULTISAMPLE)
+        else:
+            gl_state.disable(GL_MULTISAMPLE)
 
         glClearColor(*COLOR_BG)
         glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
         glLoadIdentity()
 
         if state == "MENU":
-            draw_background(bg_tex_id)
-            gluPerspective(45, DISPLAY_SIZE[0] / DISPLAY_SIZE[1], 0.1, 100.0)
-            glTranslatef(0, 0, -5)
-            glRotatef(pygame.time.get_ticks() * 0.05, 1, 1, 0)
-            draw_cube_common(
-                (0.2, 0.2, 0.3), scale=1.5, emission_level=0.1, texture_id=snake_tex_id
-            )
-
-            cx, cy = DISPLAY_SIZE[0] // 2, DISPLAY_SIZE[1] // 2
-            draw_text_gl(cx - 150, cy + 50, "SNAKE 3D", font_large, (0, 255, 255))
-            draw_text_gl(cx - 120, cy - 20, "Press [1] Planar Mode", font_small)
-            draw_text_gl(cx - 120, cy - 60, "Press [2] Cube Mode", font_small)
-            draw_text_gl(
-                cx - 120, cy - 100, "Press [ESC] to Quit", font_small, (150, 150, 150)
+            draw_menu_screen(
+                bg_tex_id,
+                snake_tex_id,
+                font_large,
+                font_small,
+                paused_name,
+                session_store.best,
             )
 
         elif state == "PLANAR":
-            game_planar.render(
-                snake_tex_id=snake_tex_id,
-                floor_tex_id=floor_tex_id,
-                apple_tex_id=apple_tex_id,
-                bg_tex_id=bg_tex_id,
-                shader_program=shader_program,
-                time=current_time,
-            )
-
-            # Improved HUD for Planar Mode
-            # Panel background (Top-Left)
-            draw_rect_2d(10, DISPLAY_SIZE[1] - 80, 250, 70, (0.0, 0.0, 0.0, 0.6))
-
-            # Score
-            draw_text_gl(
-                20,
-                DISPLAY_SIZE[1] - 40,
-                f"Score: {game_planar.score}",
-                font_small,
-                (255, 215, 0),
-            )
-            # Controls info
-            draw_text_gl(
-                20,
-                DISPLAY_SIZE[1] - 70,
-                "WASD: Cam | Arrows: Move",
-                font_small,
-                (200, 200, 200),
-            )
+            with profiler.section("scene"):
+                scene_target.begin(render_options.render_scale)
+                game_planar.render(
+                    snake_tex_id=snake_tex_id,
+                    floor_tex_id=assets.floor_tex_id,
+                    apple_tex_id=assets.apple_tex_id,
+                    bg_tex_id=bg_tex_id,
+                    shader_program=assets.shader_program,
+                    time=current_time,
+                )
+                scene_target.finish()
+
+            with profiler.section("hud"):
+                # Panel in the top-left corner, cached until the score changes
+                hud_layer.draw(
+                    font_small,
+                    [
+                        (f"Score: {game_planar.score}", (255, 215, 0)),
+                        ("WASD: Cam | Arrows: Move", (200, 200, 200)),
+                    ],
+                )
 
         elif state == "CUBE":
-            game_cube.render(
-                snake_tex_id=snake_tex_id,
-                floor_tex_id=floor_tex_id,
-                apple_tex_id=apple_tex_id,
-                bg_tex_id=bg_tex_id,
-                shader_program=shader_program,
-                time=current_time,
-            )
-
-            # Improved HUD for Cube Mode
-            draw_rect_2d(10, DISPLAY_SIZE[1] - 80, 250, 70, (0.0, 0.0, 0.0, 0.6))
-            draw_text_gl(
-                20,
-                DISPLAY_SIZE[1] - 40,
-                f"Score: {game_cube.score}",
-                font_small,
-                (255, 215, 0),
-            )
-            draw_text_gl(
-                20,
-                DISPLAY_SIZE[1] - 70,
-                "WASD: Cam | Q/E: Zoom",
-                font_small,
-                (200, 200, 200),
-            )
+            with profiler.section("scene"):
+                scene_target.begin(render_options.render_scale)
+                game_cube.render(
+                    snake_tex_id=snake_tex_id,
+                    floor_tex_id=assets.floor_tex_id,
+                    apple_tex_id=assets.apple_tex_id,
+                    bg_tex_id=bg_tex_id,
+                    shader_program=assets.shader_program,
+                    time=current_time,
+                )
+                scene_target.finish()
+
+            with profiler.section("hud"):
+                # Panel in the top-left corner, cached until the score changes
+                hud_layer.draw(
+                    font_small,
+                    [
+                        (f"Score: {game_cube.score}", (255, 215, 0)),
+                        ("WASD: Cam | Q/E: Zoom", (200, 200, 200)),
+                    ],
+                )
+
+        elif state == "ARENA":
+            with profiler.section("scene"):
+                scene_target.begin(render_options.render_scale)
+                game_arena.render(
+                    snake_tex_id=snake_tex_id,
+                    floor_tex_id=assets.floor_tex_id,
+                    apple_tex_id=assets.apple_tex_id,
+                    bg_tex_id=bg_tex_id,
+                    shader_program=assets.shader_program,
+                    time=current_time,
+                )
+                scene_target.finish()
+
+            with profiler.section("hud"):
+                # Panel in the top-left corner, cached until the score or count change
+                alive = game_arena.alive_count()
+                hud_layer.draw(
+                    font_small,
+                    [
+                        (f"Score: {game_arena.score}", (255, 215, 0)),
+                        (f"Snakes: {alive}/{game_arena.snake_count}", (200, 200, 200)),
+                    ],
+                )
+
+        elif state == "SPECTATE":
+            with profiler.section("scene"):
+                assets.spectator.render()
+
+            with profiler.section("hud"):
+                hud_layer.draw(font_small, assets.spectator.hud_lines())
 
         elif state == "GAME_OVER":
-            draw_background(bg_tex_id)
-            gluPerspective(45, DISPLAY_SIZE[0] / DISPLAY_SIZE[1], 0.1, 100.0)
-            glTranslatef(0, 0, -5)
-            glRotatef(pygame.time.get_ticks() * 0.02, 0, 1, 0)
-            draw_cube_common(
-                (0.5, 0.0, 0.0), scale=1.5, emission_level=0.2, texture_id=snake_tex_id
+            draw_game_over_screen(
+                bg_tex_id,
+                snake_tex_id,
+                font_large,
+                font_small,
+                final_score,
+                session_store.percentile(final_session),
             )
 
-            cx, cy = DISPLAY_SIZE[0] // 2, DISPLAY_SIZE[1] // 2
-
-            # Background panel for Game Over text
-            draw_rect_2d(cx - 200, cy - 120, 400, 220, (0.0, 0.0, 0.0, 0.8))
-
-            draw_text_gl(cx - 160, cy + 60, "GAME OVER", font_large, (255, 50, 50))
-            draw_text_gl(
-                cx - 60, cy + 10, f"Score: {final_score}", font_small, (255, 255, 255)
-            )
-            draw_text_gl(cx - 100, cy - 50, "[R] Try Again", font_small, (0, 255, 0))
-            draw_text_gl(
-                cx - 100, cy - 90, "[M] Main Menu", font_small, (200, 200, 200)
-            )
+        issued, skipped = gl_state.take_counts()
+        profiler.count("gl_state_calls", issued)
+        profiler.count("gl_state_skipped", skipped)
+        if gl_state.debug:
+            gl_state.verify()
 
+        quality.frame(scheduler.end_work())
         pygame.display.flip()
-
+        flip_time = time.perf_counter()
+        # A game is played for the time between flips that both showed it
+        if shown_state in games and shown_state == flipped_state:
+            games[shown_state].play_time += flip_time - last_flip_time
+        flipped_state, last_flip_time = shown_state, flip_time
+        for event_time, tick_time, _ in shown_inputs:
+            profiler.observe("input_to_tick", (tick_time - event_time) * 1000)
+            profiler.observe("input_to_photon", (flip_time - event_time) * 1000)
+        profiler.end_frame()
+
+        # After the flip, so the frame just shown did not wait for it
+        if asset_watcher:
+            asset_watcher.apply()
+        assets.load_next()
+
+    if simulation:
+        simulation.stop()
+    if assets.games:
+        # Only the games import telemetry, whose writer may still have dumps queued
+        from telemetry import telemetry_writer
+
+        telemetry_writer.close()
+    session_store.close()
+    if asset_watcher:
+        asset_watcher.stop()
+    if not SERVER:
+        from savegame import write_resume
+
+        write_resume(paused)
+
+    assets.release()
+    release_scene_resources()
+    for tex_id in (snake_tex_id, bg_tex_id):
+        gl_resources.release("texture", tex_id)
+    gl_resources.teardown()
+    failures = gl_debug.report()
+    if failures:
+        print(failures)
     pygame.quit()
     quit()
 
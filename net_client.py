@@ -0,0 +1,167 @@
+import asyncio
+import queue
+import threading
+import time
+from collections import deque
+from protocol import (
+    DELTA_TURN,
+    KEYFRAME_RESET,
+    MODE_CUBE,
+    MODE_NAMES,
+    MSG_DELTA,
+    MSG_KEYFRAME,
+    GameStream,
+    ProtocolError,
+    encode_join,
+    encode_turn,
+    read_message,
+    split_address,
+)
+from simulation import GameSnapshot, apply_snapshot
+from utils import next_state_version
+
+# Turns sent and waiting for the server to apply them; older ones are forgotten
+MAX_SENT_TURNS = 16
+
+
+class NetClient:
+    """Plays a game hosted by a game server, in place of a local Simulation.
+
+    It has the same interface, so the main loop renders the view game the same way.
+    A thread runs an asyncio connection that forwards the view's turns and rebuilds
+    the game from the server's keyframes and deltas, publishing an immutable
+    snapshot after every message by replacing `latest`.
+    """
+
+    def __init__(self, view, address, room, mode):
+        """Prepares to join `room` on the server at `address`, playing `mode`."""
+        self.view = view
+        self.epoch = view.epoch
+        self.address = address
+        self.room = room
+        self.mode = MODE_NAMES[mode]
+        if self.mode == MODE_CUBE:
+            self.board = (view.N, view.N)
+        else:
+            self.board = (
+                view.GRID_X[1] - view.GRID_X[0] + 1,
+                view.GRID_Y[1] - view.GRID_Y[0] + 1,
+            )
+        self.stream = GameStream(self.mode)
+        self.latest = None
+        self.writer = None
+        # Input times of the turns sent, until a tick reports one applied
+        self.sent = deque(maxlen=MAX_SENT_TURNS)
+        self.applied = queue.SimpleQueue()
+        self.pending_inputs = []
+        self.loop = asyncio.new_event_loop()
+        self.task = self.loop.create_task(self._play())
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        """Connects and starts following the server's game."""
+        self.thread.start()
+
+    def stop(self):
+        """Disconnects and waits for the thread to finish."""
+        if self.thread.is_alive():
+            self.loop.call_soon_threadsafe(self.task.cancel)
+            self.thread.join()
+
+    def send_input(self):
+        """Sends the turns the view game queued from this frame's events."""
+        while self.view.turns:
+            turn, event_time = self.view.turns.popleft()
+            self.loop.call_soon_threadsafe(self._send_turn, turn, event_time)
+
+    def sync_view(self):
+        """Copies the latest snapshot into the view; returns False once the snake died.
+
+        Until the first keyframe arrives the view keeps its own starting state.
+        """
+        snapshot = self.latest
+        if snapshot is None:
+            return True
+        if snapshot.version != self.view.version:
+            apply_snapshot(self.view, snapshot)
+            # A new game on the server is not a reason to reconnect
+            self.epoch = self.view.epoch
+        return snapshot.alive
+
+    def take_shown_inputs(self):
+        """Returns the applied turns' timings whose tick is now shown by the view."""
+        while not self.applied.empty():
+            self.pending_inputs.append(self.applied.get())
+        shown, waiting = [], []
+        for applied in self.pending_inputs:
+            version = applied[2]
+            (shown if version <= self.view.version else waiting).append(applied)
+        self.pending_inputs = waiting
+        return shown
+
+    def _run(self):
+        """Runs the connection's event loop until it ends or is stopped."""
+        try:
+            self.loop.run_until_complete(self.task)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self.loop.close()
+
+    def _send_turn(self, turn, event_time):
+        """Writes a turn, on the loop's thread; turns before joining are dropped."""
+        if self.writer is not None:
+            self.writer.write(encode_turn(turn))
+            self.sent.append(event_time)
+
+    def _publish(self, epoch, alive):
+        """Replaces the snapshot with the stream's current state."""
+        stream = self.stream
+        version = next_state_version()
+        self.latest = GameSnapshot(
+            tuple(stream.snake),
+            stream.food,
+            stream.score,
+            version,
+            stream.head_seq,
+            epoch or version,
+            alive,
+        )
+        return self.latest
+
+    async def _play(self):
+        """Joins the room and follows its game until the snake dies or the link drops."""
+        host, port = split_address(self.address)
+        try:
+            reader, writer = await asyncio.open_connection(host, port)
+        except OSError as e:
+            print(f"Warning: Could not connect to the server at {self.address}: {e}")
+            self._publish(None, False)
+            return
+
+        writer.write(encode_join(self.mode, self.board, self.room))
+        self.writer = writer
+        epoch = None
+        try:
+            while True:
+                kind, flags = self.stream.apply(await read_message(reader))
+                if kind is None:
+                    continue
+                if kind == MSG_KEYFRAME and (flags & KEYFRAME_RESET or epoch is None):
+                    # Turns sent during the last game will never be applied
+                    self.sent.clear()
+                    epoch = None
+                snapshot = self._publish(epoch, self.stream.alive)
+                epoch = snapshot.epoch
+                if kind == MSG_DELTA and flags & DELTA_TURN and self.sent:
+                    event_time = self.sent.popleft()
+                    tick_time = time.perf_counter()
+                    self.applied.put((event_time, tick_time, snapshot.version))
+                if not snapshot.alive:
+                    return
+        except (asyncio.IncompleteReadError, ConnectionError, ProtocolError) as e:
+            print(f"Warning: Lost the connection to the server: {e!r}")
+            self._publish(epoch, False)
+        finally:
+            self.writer = None
+            writer.close()
@@ -0,0 +1,12 @@
+#version 120
+
+varying vec4 vColor;
+
+void main() {
+    // Round sprite, brightest in the middle
+    vec2 d = gl_PointCoord - vec2(0.5);
+    float r = dot(d, d) * 4.0;
+    if (r > 1.0)
+        discard;
+    gl_FragColor = vec4(vColor.rgb, vColor.a * (1.0 - r));
+}
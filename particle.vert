@@ -0,0 +1,14 @@
+#version 120
+
+uniform float pointScale;
+varying vec4 vColor;
+
+void main() {
+    vec4 eye = gl_ModelViewMatrix * gl_Vertex;
+    vColor = gl_Color;
+    // The size is in world units, in the first texture coordinate; it shrinks
+    // as the particle fades
+    float size = gl_MultiTexCoord0.x * (0.5 + 0.5 * gl_Color.a);
+    gl_PointSize = max(size * pointScale / -eye.z, 1.0);
+    gl_Position = gl_ProjectionMatrix * eye;
+}
@@ -0,0 +1,205 @@
+import ctypes
+import math
+import numpy as np
+from OpenGL.GL import *
+from config import *
+from graphics import gl_resources, gl_state
+from render_target import scene_target
+
+# Floats per particle vertex: position, color, opacity and size
+VERTEX_FLOATS = 8
+VERTEX_STRIDE = VERTEX_FLOATS * 4
+# Vertical field of view of the game cameras, for sizing the point sprites
+FIELD_OF_VIEW = 45.0
+# Fraction of its speed a particle loses per second
+DRAG = 2.0
+
+EAT_PARTICLES = 150
+DEATH_PARTICLES = 3000
+COLOR_DEATH = (1.0, 0.3, 0.1)
+
+
+class ParticlePool:
+    """A fixed number of particles whose state lives in preallocated NumPy arrays.
+
+    Emitting takes slots from a free list and expired particles return theirs, so
+    nothing is allocated per particle. Every step integrates all slots with a few
+    whole-array operations, and drawing packs the live ones into a staging array
+    and renders them as point sprites in a single call. The arrays are allocated by
+    allocate() or the first emit, so creating the pool costs nothing at startup.
+    """
+
+    def __init__(self, capacity=PARTICLE_CAPACITY, seed=None):
+        """Creates an empty pool; the GL buffer is created on the first draw."""
+        self.capacity = capacity
+        self.seed = seed
+        self.free_count = capacity
+        self.vertices = None
+        self.enabled = PARTICLES
+        self.program = None
+        self.point_scale_loc = -1
+        self.vbo = None
+
+    def allocate(self):
+        """Allocates the particle arrays and random number generator, once."""
+        if self.vertices is not None:
+            return
+        capacity = self.capacity
+        # The drawn vertex data; position, color, opacity and size are views of it
+        self.vertices = np.zeros((capacity, VERTEX_FLOATS), np.float32)
+        self.position = self.vertices[:, 0:3]
+        self.color = self.vertices[:, 3:6]
+        self.opacity = self.vertices[:, 6]
+        self.size = self.vertices[:, 7]
+        self.velocity = np.zeros((capacity, 3), np.float32)
+        self.life = np.zeros(capacity, np.float32)
+        self.lifetime = np.ones(capacity, np.float32)
+        self.alive = np.zeros(capacity, bool)
+        # Scratch arrays, so steps and draws allocate nothing per particle
+        self.offset = np.zeros((capacity, 3), np.float32)
+        self.expired = np.zeros(capacity, bool)
+        self.staging = np.zeros((capacity, VERTEX_FLOATS), np.float32)
+        self.free = np.arange(capacity - 1, -1, -1, dtype=np.int32)
+        # Also imports numpy.random, which nothing before the first game needs
+        self.rng = np.random.default_rng(self.seed)
+
+    def live_count(self):
+        """Returns the number of live particles."""
+        return self.capacity - self.free_count
+
+    def set_program(self, program):
+        """Uses `program`, compiled from particle.vert/particle.frag, to draw."""
+        self.program = program
+        self.point_scale_loc = glGetUniformLocation(program, "pointScale")
+
+    def emit(self, origin, count, color, speed, size, lifetime):
+        """Launches up to `count` particles from `origin` in random directions.
+
+        Speeds, sizes and lifetimes are in world units and seconds; each particle
+        gets a random part of `speed` and between half and all of `lifetime`.
+        Returns how many were launched, fewer when the pool is full.
+        """
+        count = min(count, self.free_count) if self.enabled else 0
+        if not count:
+            return 0
+        self.allocate()
+        slots = self.free[self.free_count - count : self.free_count]
+        self.free_count -= count
+
+        directions = self.rng.normal(size=(count, 3)).astype(np.float32)
+        directions /= np.linalg.norm(directions, axis=1, keepdims=True) + 1e-6
+        speeds = self.rng.uniform(0.3, 1.0, count).astype(np.float32) * speed
+        lives = self.rng.uniform(0.5, 1.0, count).astype(np.float32) * lifetime
+        self.position[slots] = origin
+        self.velocity[slots] = directions * speeds[:, None]
+        self.color[slots] = color[:3]
+        self.size[slots] = size
+        self.opacity[slots] = 1.0
+        self.life[slots] = lives
+        self.lifetime[slots] = lives
+        self.alive[slots] = True
+        return count
+
+    def food_burst(self, position, scale=1.0):
+        """Bursts from food that was just eaten, on cells of `scale` world units."""
+        return self.emit(
+            position, EAT_PARTICLES, COLOR_FOOD, 8 * scale, 0.4 * scale, 1.0
+        )
+
+    def death_burst(self, position, scale=1.0):
+        """Bursts from something `scale` world units across that was destroyed."""
+        return self.emit(
+            position, DEATH_PARTICLES, COLOR_DEATH, 6 * scale, 0.1 * scale, 1.5
+        )
+
+    def step(self, dt):
+        """Moves every particle by `dt` seconds and frees the slots of expired ones."""
+        if self.free_count == self.capacity:
+            return
+        np.multiply(self.velocity, dt, out=self.offset)
+        self.position += self.offset
+        self.velocity *= max(0.0, 1.0 - DRAG * dt)
+        self.life -= dt
+        np.divide(self.life, self.lifetime, out=self.opacity)
+
+        np.less_equal(self.life, 0.0, out=self.expired)
+        self.expired &= self.alive
+        slots = np.flatnonzero(self.expired)
+        if len(slots):
+            self.alive[slots] = False
+            self.free[self.free_count : self.free_count + len(slots)] = slots
+            self.free_count += len(slots)
+
+    def clear(self):
+        """Removes every particle."""
+        if self.vertices is None:
+            return
+        self.alive[:] = False
+        self.free[:] = np.arange(self.capacity - 1, -1, -1, dtype=np.int32)
+        self.free_count = self.capacity
+
+    def pack(self):
+        """Copies the live particles' vertices to the front of the staging array."""
+        staging = self.staging[: self.live_count()]
+        np.compress(self.alive, self.vertices, axis=0, out=staging)
+        return staging
+
+    def draw(self):
+        """Draws the live particles as additive point sprites with one draw call."""
+        count = self.live_count()
+        if not count or self.program is None:
+            return
+
+        staging = self.pack()
+        if self.vbo is None:
+            self.vbo = gl_resources.add(
+                "buffer", glGenBuffers(1), "particles", self.capacity * VERTEX_STRIDE
+            )
+        glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
+        # Orphaning the old storage lets the driver keep drawing last frame's
+        glBufferData(
+            GL_ARRAY_BUFFER, self.capacity * VERTEX_STRIDE, None, GL_STREAM_DRAW
+        )
+        glBufferSubData(GL_ARRAY_BUFFER, 0, count * VERTEX_STRIDE, staging)
+
+        # Pixels per world unit at a distance of one, for the sprite sizes
+        height = scene_target.size[1] if scene_target.active else DISPLAY_SIZE[1]
+        point_scale = height / (2 * math.tan(math.radians(FIELD_OF_VIEW) / 2))
+        gl_state.use_program(self.program)
+        glUniform1f(self.point_scale_loc, point_scale)
+        gl_state.disable(GL_LIGHTING)
+        gl_state.disable(GL_TEXTURE_2D)
+        gl_state.enable(GL_BLEND)
+        gl_state.set_blend_func(GL_SRC_ALPHA, GL_ONE)
+        gl_state.enable(GL_VERTEX_PROGRAM_POINT_SIZE)
+        gl_state.enable(GL_POINT_SPRITE)
+        # Particles are tested against the scene but do not hide each other
+        glDepthMask(GL_FALSE)
+
+        glEnableClientState(GL_VERTEX_ARRAY)
+        glEnableClientState(GL_COLOR_ARRAY)
+        glEnableClientState(GL_TEXTURE_COORD_ARRAY)
+        glVertexPointer(3, GL_FLOAT, VERTEX_STRIDE, ctypes.c_void_p(0))
+        glColorPointer(4, GL_FLOAT, VERTEX_STRIDE, ctypes.c_void_p(12))
+        glTexCoordPointer(1, GL_FLOAT, VERTEX_STRIDE, ctypes.c_void_p(28))
+        glDrawArrays(GL_POINTS, 0, count)
+        glDisableClientState(GL_TEXTURE_COORD_ARRAY)
+        glDisableClientState(GL_COLOR_ARRAY)
+        glDisableClientState(GL_VERTEX_ARRAY)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+        glDepthMask(GL_TRUE)
+        gl_state.disable(GL_POINT_SPRITE)
+        gl_state.disable(GL_VERTEX_PROGRAM_POINT_SIZE)
+        gl_state.disable(GL_BLEND)
+        gl_state.enable(GL_LIGHTING)
+        gl_state.use_program(0)
+
+    def release(self):
+        """Deletes the GL buffer; the program belongs to whoever compiled it."""
+        if self.vbo is not None:
+            gl_resources.release("buffer", self.vbo)
+        self.vbo = None
+
+
+particle_pool = ParticlePool()
@@ -0,0 +1,101 @@
+import time
+from collections import deque
+from contextlib import contextmanager
+
+
+def percentile(ordered, p):
+    """Returns the p-th percentile of a sorted, non-empty list (nearest rank)."""
+    rank = max(1, -(-len(ordered) * p // 100))
+    return ordered[rank - 1]
+
+
+class FrameProfiler:
+    """Collects per-frame counters and pass timings and prints a summary every interval."""
+
+    def __init__(self, interval=1.0):
+        """Creates a disabled profiler reporting averages over `interval` seconds."""
+        self.enabled = False
+        self.interval = interval
+        self.frame_start = time.perf_counter()
+        # Rare events such as key presses, kept across windows for percentiles
+        self.distributions = {}
+        self._reset_window()
+
+    def _reset_window(self):
+        """Starts a new averaging window."""
+        self.frames = 0
+        self.frame_time = 0.0
+        self.counters = {}
+        self.timings = {}
+        self.ratios = {}
+        self.window_start = time.perf_counter()
+        self.window_cpu = time.process_time()
+
+    def begin_frame(self):
+        """Marks the start of a frame."""
+        self.frame_start = time.perf_counter()
+
+    def count(self, name, amount=1):
+        """Adds to a named per-frame counter."""
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def add_time(self, name, seconds):
+        """Adds a duration measured elsewhere to the named pass timing."""
+        self.timings[name] = self.timings.get(name, 0.0) + seconds
+
+    def sample(self, name, success):
+        """Records one outcome of a named rate, e.g. a cache hit or miss."""
+        hits, total = self.ratios.get(name, (0, 0))
+        self.ratios[name] = (hits + bool(success), total + 1)
+
+    def observe(self, name, milliseconds, history=256):
+        """Records one measurement of a named distribution, reported as percentiles."""
+        values = self.distributions.setdefault(name, deque(maxlen=history))
+        values.append(milliseconds)
+
+    @contextmanager
+    def section(self, name):
+        """Times the enclosed block and adds it to the named pass timing."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.timings[name] = self.timings.get(name, 0.0) + elapsed
+
+    def end_frame(self):
+        """Marks the end of a frame and prints the summary when the window is over."""
+        now = time.perf_counter()
+        self.frames += 1
+        self.frame_time += now - self.frame_start
+
+        if now - self.window_start >= self.interval:
+            if self.enabled:
+                print(self.report(now - self.window_start))
+            self._reset_window()
+
+    def report(self, elapsed):
+        """Formats the averages of the current window as a single line."""
+        frames = max(self.frames, 1)
+        parts = [
+            f"{self.frames / elapsed:.1f} fps",
+            f"frame {self.frame_time * 1000 / frames:.2f} ms",
+            f"cpu {100.0 * (time.process_time() - self.window_cpu) / elapsed:.0f}%",
+        ]
+        for name, total in sorted(self.timings.items()):
+            parts.append(f"{name} {total * 1000 / frames:.2f} ms")
+        for name, total in sorted(self.counters.items()):
+            parts.append(f"{name} {total / frames:.1f}/frame")
+        for name, (hits, total) in sorted(self.ratios.items()):
+            parts.append(f"{name} {100.0 * hits / total:.0f}%")
+        for name, values in sorted(self.distributions.items()):
+            ordered = sorted(values)
+            p50, p95, p99 = (percentile(ordered, p) for p in (50, 95, 99))
+            parts.append(
+                f"{name} p50 {p50:.1f} p95 {p95:.1f} p99 {p99:.1f} ms"
+                f" (n={len(ordered)})"
+            )
+        return "[stats] " + " | ".join(parts)
+
+
+frame_profiler = FrameProfiler()
@@ -0,0 +1,219 @@
+import struct
+
+DEFAULT_PORT = 7777
+
+# Game modes a room can play
+MODE_PLANAR = 0
+MODE_CUBE = 1
+MODE_NAMES = {"PLANAR": MODE_PLANAR, "CUBE": MODE_CUBE}
+# Smallest and largest board a room can be opened, or a save loaded, with, per mode
+BOARD_LIMITS = {MODE_PLANAR: (5, 201), MODE_CUBE: (4, 64)}
+
+# Message types. Every message is sent as a 4-byte length and the payload, whose
+# first byte is the type.
+MSG_JOIN = 1
+MSG_TURN = 2
+MSG_KEYFRAME = 3
+MSG_DELTA = 4
+
+# Keyframe flags
+KEYFRAME_RESET = 1
+# Sent instead of a death's delta to a client that needs a keyframe that tick
+KEYFRAME_DEAD = 2
+# Delta flags
+DELTA_ATE = 1
+DELTA_FOOD = 2
+DELTA_DEAD = 4
+DELTA_TURN = 8
+
+TURNS = ("LEFT", "RIGHT")
+# Ticks are numbered modulo 2^16
+TICK_MASK = 0xFFFF
+
+LENGTH = struct.Struct("!I")
+# Longest payload read_message() accepts. A keyframe of a full 201x201 planar board
+# is about 80 KB, and of a full n = 64 cube about 74 KB.
+MAX_MESSAGE = 256 * 1024
+JOIN = struct.Struct("!BBBB")
+TURN = struct.Struct("!BB")
+KEYFRAME = struct.Struct("!BHBHI")
+DELTA = struct.Struct("!BHB")
+COUNT = struct.Struct("!H")
+# Planar cells are (x, y) around the board's center, cube cells (face, x, y)
+CELLS = {MODE_PLANAR: struct.Struct("!bb"), MODE_CUBE: struct.Struct("!BBB")}
+
+
+class ProtocolError(ValueError):
+    """Raised for a message that cannot be decoded."""
+
+
+def board_allowed(mode, board):
+    """Tells whether `board` is within BOARD_LIMITS, and square for the cube."""
+    low, high = BOARD_LIMITS[mode]
+    if mode == MODE_CUBE and board[0] != board[1]:
+        return False
+    return all(low <= side <= high for side in board)
+
+
+def create_game(mode, board):
+    """Creates a game of `mode` on `board`; its GL objects are only created to draw."""
+    # Imported here, so that messages and saves can be read without the game modes
+    from logic_2d import PlanarGame
+    from logic_cube import CubeGame
+
+    if mode == MODE_CUBE:
+        return CubeGame(board[0])
+    return PlanarGame(board)
+
+
+def frame(payload):
+    """Returns a payload with its length in front, ready to write to a stream."""
+    return LENGTH.pack(len(payload)) + payload
+
+
+def split_address(address, default_port=DEFAULT_PORT):
+    """Returns (host, port) of a "host:port" or "host" address."""
+    host, _, port = address.rpartition(":")
+    if not host:
+        return port, default_port
+    return host, int(port)
+
+
+async def read_message(reader):
+    """Reads one message's payload; raises asyncio.IncompleteReadError at the end."""
+    (length,) = LENGTH.unpack(await reader.readexactly(LENGTH.size))
+    if length > MAX_MESSAGE:
+        raise ProtocolError(f"message of {length} bytes is too long")
+    return await reader.readexactly(length)
+
+
+def encode_join(mode, board, room):
+    """Encodes a request to join `room`, playing `mode` on a board of `board` cells.
+
+    `board` is (width, height) for the planar mode and (n, n) for the cube.
+    """
+    return frame(JOIN.pack(MSG_JOIN, mode, *board) + room.encode("utf-8"))
+
+
+def decode_join(payload):
+    """Returns (mode, board, room) of a join request."""
+    if len(payload) < JOIN.size:
+        raise ProtocolError("join message too short")
+    _, mode, width, height = JOIN.unpack_from(payload)
+    if mode not in CELLS:
+        raise ProtocolError(f"unknown mode {mode}")
+    try:
+        room = payload[JOIN.size:].decode("utf-8")
+    except UnicodeDecodeError:
+        raise ProtocolError("room name is not UTF-8")
+    return mode, (width, height), room
+
+
+def encode_turn(turn):
+    """Encodes a LEFT or RIGHT turn of the player's snake."""
+    return frame(TURN.pack(MSG_TURN, TURNS.index(turn)))
+
+
+def decode_turn(payload):
+    """Returns the turn in a turn message."""
+    if len(payload) != TURN.size or payload[1] >= len(TURNS):
+        raise ProtocolError("bad turn message")
+    return TURNS[payload[1]]
+
+
+def encode_keyframe(mode, tick, game, flags=0):
+    """Encodes the whole snake, food and score of a game."""
+    cell = CELLS[mode]
+    return frame(
+        b"".join(
+            [
+                KEYFRAME.pack(MSG_KEYFRAME, tick, flags, game.score, game.head_seq),
+                cell.pack(*game.food),
+                COUNT.pack(len(game.snake)),
+                *[cell.pack(*segment) for segment in game.snake],
+            ]
+        )
+    )
+
+
+def encode_delta(mode, tick, flags, head=None, food=None):
+    """Encodes one tick: the new head unless the snake died, and the food if it moved.
+
+    The tail is not sent: the client drops it itself unless DELTA_ATE is set.
+    """
+    cell = CELLS[mode]
+    parts = [DELTA.pack(MSG_DELTA, tick, flags)]
+    if not flags & DELTA_DEAD:
+        parts.append(cell.pack(*head))
+    if flags & DELTA_FOOD:
+        parts.append(cell.pack(*food))
+    return frame(b"".join(parts))
+
+
+class GameStream:
+    """A game's state rebuilt on the receiving end from keyframes and deltas.
+
+    Deltas apply only on top of the tick before them; after a gap the stream
+    waits for the next keyframe.
+    """
+
+    def __init__(self, mode):
+        """Starts without state; the first keyframe provides it."""
+        self.cell = CELLS[mode]
+        self.tick = None
+        self.snake = []
+        self.food = None
+        self.score = 0
+        self.head_seq = 0
+        self.alive = True
+        self.bytes = 0
+
+    def apply(self, payload):
+        """Applies a keyframe or delta payload and returns its type and flags.
+
+        Returns (None, 0) for a delta that does not follow the current tick.
+        """
+        if not payload:
+            raise ProtocolError("empty message")
+        self.bytes += LENGTH.size + len(payload)
+        cell = self.cell
+        kind = payload[0]
+        try:
+            if kind == MSG_KEYFRAME:
+                _, tick, flags, score, head_seq = KEYFRAME.unpack_from(payload)
+                offset = KEYFRAME.size
+                food = cell.unpack_from(payload, offset)
+                offset += cell.size
+                (count,) = COUNT.unpack_from(payload, offset)
+                offset += COUNT.size
+                snake = [
+                    cell.unpack_from(payload, offset + i * cell.size)
+                    for i in range(count)
+                ]
+                self.tick, self.score, self.head_seq = tick, score, head_seq
+                self.food, self.snake = food, snake
+                self.alive = not flags & KEYFRAME_DEAD
+                return kind, flags
+
+            if kind == MSG_DELTA:
+                _, tick, flags = DELTA.unpack_from(payload)
+                if self.tick is None or tick != (self.tick + 1) & TICK_MASK:
+                    return None, 0
+                offset = DELTA.size
+                self.tick = tick
+                if flags & DELTA_DEAD:
+                    self.alive = False
+                else:
+                    self.snake.insert(0, cell.unpack_from(payload, offset))
+                    offset += cell.size
+                    self.head_seq += 1
+                    if flags & DELTA_ATE:
+                        self.score += 1
+                    else:
+                        self.snake.pop()
+                if flags & DELTA_FOOD:
+                    self.food = cell.unpack_from(payload, offset)
+                return kind, flags
+        except struct.error as e:
+            raise ProtocolError(f"truncated message: {e}")
+        raise ProtocolError(f"unexpected message type {kind}")
@@ -0,0 +1,123 @@
+from config import *
+from graphics import SHADOW_RESOLUTIONS, render_options
+
+# Quality reductions in the order they are applied, cheapest-looking first. Level n
+# is the player's settings with the first n steps applied.
+QUALITY_STEPS = (
+    ("multisample", False),
+    ("render_scale", 0.75),
+    ("shadow_quality", "low"),
+    # Per-vertex lighting, without shadows, is far cheaper on software rasterizers
+    ("lighting", "fixed"),
+    ("tessellation", 2),
+    ("render_scale", 0.5),
+    ("tessellation", 4),
+    ("outline_mode", "off"),
+    ("max_lights", 1),
+)
+
+# For each option, picks the lower quality of the current value and a step's value,
+# so a step never raises an option the player already turned down
+LOWER_QUALITY = {
+    "multisample": lambda current, value: current and value,
+    "render_scale": min,
+    "tessellation": max,
+    "shadow_quality": lambda current, value: min(
+        current, value, key=SHADOW_RESOLUTIONS.get
+    ),
+    "lighting": lambda current, value: value,
+    "outline_mode": lambda current, value: value,
+    "max_lights": min,
+}
+
+
+class QualityController:
+    """Lowers render quality while frames miss the budget and raises it with headroom.
+
+    Frame times are averaged over windows of `window` frames. One window over budget
+    steps down a level; stepping back up takes `recover_windows` windows in a row
+    under `headroom` times the budget, and every change is followed by a window
+    that is ignored while the new level settles. The gap between the two thresholds
+    keeps a level that just fits from flipping back and forth.
+    """
+
+    def __init__(self, budget_ms, window=30, headroom=0.6, recover_windows=4):
+        """Creates a disabled controller for a frame budget in milliseconds."""
+        self.enabled = False
+        self.budget_ms = budget_ms
+        self.window = window
+        self.headroom = headroom
+        self.recover_windows = recover_windows
+        self.level = 0
+        self.baseline = None
+        # The options as the last level change left them
+        self.applied = {}
+        self.samples = []
+        self.good_windows = 0
+        self.settling = False
+
+    def set_enabled(self, enabled):
+        """Turns the controller on or off; turning it off restores full quality."""
+        self.enabled = enabled
+        self.samples = []
+        if not enabled and self.level:
+            self.set_level(0, "adaptive quality off")
+
+    def frame(self, frame_ms):
+        """Takes the work time of one frame and changes the level after each window."""
+        if not self.enabled:
+            return
+        self.samples.append(frame_ms)
+        if len(self.samples) < self.window:
+            return
+
+        average = sum(self.samples) / len(self.samples)
+        self.samples = []
+        if self.settling:
+            self.settling = False
+            return
+
+        reason = f"{average:.1f} ms/frame, budget {self.budget_ms:.1f} ms"
+        if average > self.budget_ms:
+            if self.level < len(QUALITY_STEPS):
+                self.set_level(self.level + 1, reason)
+        elif average < self.budget_ms * self.headroom and self.level > 0:
+            self.good_windows += 1
+            if self.good_windows >= self.recover_windows:
+                self.set_level(self.level - 1, reason)
+        else:
+            self.good_windows = 0
+
+    def set_level(self, level, reason):
+        """Applies the first `level` quality steps to the player's settings."""
+        names = {name for name, _ in QUALITY_STEPS}
+        live = {name: getattr(render_options, name) for name in names}
+        if self.baseline is None:
+            self.baseline = live
+        else:
+            # An option changed since the last level change was set by the player
+            for name, value in live.items():
+                if value != self.applied[name]:
+                    self.baseline[name] = value
+
+        for name, value in self.baseline.items():
+            setattr(render_options, name, value)
+        for name, value in QUALITY_STEPS[:level]:
+            current = getattr(render_options, name)
+            setattr(render_options, name, LOWER_QUALITY[name](current, value))
+
+        changes = ", ".join(
+            f"{name} {getattr(render_options, name)}" for name in sorted(self.baseline)
+        )
+        print(f"Quality level {level}/{len(QUALITY_STEPS)} ({reason}): {changes}")
+        self.applied = {name: getattr(render_options, name) for name in names}
+
+        # Back at full quality the player's own changes become the new baseline
+        if level == 0:
+            self.baseline = None
+        self.level = level
+        self.good_windows = 0
+        self.settling = True
+
+
+quality_controller = QualityController(FRAME_BUDGET_MS)
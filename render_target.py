@@ -0,0 +1,147 @@
+from OpenGL.GL import *
+from OpenGL.GLU import *
+from config import *
+from graphics import gl_resources, gl_state, use_unlit
+
+
+class SceneTarget:
+    """Offscreen framebuffer the 3D scene is rendered into at a fraction of the window.
+
+    The color texture is then stretched over the window with linear filtering, so a
+    render scale of 0.5 shades a quarter of the pixels. Whatever is drawn after
+    finish(), such as the HUD, stays at native resolution.
+    """
+
+    def __init__(self):
+        """Starts without any GL objects; they are created on the first begin."""
+        self.fbo = None
+        self.texture_id = None
+        self.depth_buffer = None
+        self.size = (0, 0)
+        self.active = False
+
+    def _allocate(self, size):
+        """Creates the color texture, depth buffer and framebuffer of the given size."""
+        self.release()
+        self.texture_id = glGenTextures(1)
+        gl_state.bind_texture(self.texture_id)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_EDGE)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_CLAMP_TO_EDGE)
+        glTexImage2D(
+            GL_TEXTURE_2D,
+            0,
+            GL_RGBA8,
+            size[0],
+            size[1],
+            0,
+            GL_RGBA,
+            GL_UNSIGNED_BYTE,
+            None,
+        )
+        pixels = size[0] * size[1]
+        gl_resources.add("texture", self.texture_id, "scene target", pixels * 4)
+
+        self.depth_buffer = glGenRenderbuffers(1)
+        glBindRenderbuffer(GL_RENDERBUFFER, self.depth_buffer)
+        glRenderbufferStorage(GL_RENDERBUFFER, GL_DEPTH_COMPONENT24, *size)
+        glBindRenderbuffer(GL_RENDERBUFFER, 0)
+        gl_resources.add("renderbuffer", self.depth_buffer, "scene target", pixels * 4)
+
+        self.fbo = gl_resources.add("framebuffer", glGenFramebuffers(1), "scene target")
+        glBindFramebuffer(GL_FRAMEBUFFER, self.fbo)
+        glFramebufferTexture2D(
+            GL_FRAMEBUFFER, GL_COLOR_ATTACHMENT0, GL_TEXTURE_2D, self.texture_id, 0
+        )
+        glFramebufferRenderbuffer(
+            GL_FRAMEBUFFER, GL_DEPTH_ATTACHMENT, GL_RENDERBUFFER, self.depth_buffer
+        )
+        if glCheckFramebufferStatus(GL_FRAMEBUFFER) != GL_FRAMEBUFFER_COMPLETE:
+            print("Warning: Render scale framebuffer is incomplete.")
+        glBindFramebuffer(GL_FRAMEBUFFER, 0)
+        self.size = size
+
+    def release(self):
+        """Deletes the framebuffer and its attachments."""
+        if self.fbo is not None:
+            gl_resources.release("framebuffer", self.fbo)
+            gl_resources.release("renderbuffer", self.depth_buffer)
+            gl_resources.release("texture", self.texture_id)
+        self.fbo = None
+        self.texture_id = None
+        self.depth_buffer = None
+        self.size = (0, 0)
+
+    def bind(self, size):
+        """Redirects drawing to the offscreen target without clearing what it holds.
+
+        Returns True if the target was just (re)created at `size`, and so is blank.
+        """
+        allocated = size != self.size
+        if allocated:
+            self._allocate(size)
+
+        glBindFramebuffer(GL_FRAMEBUFFER, self.fbo)
+        glViewport(0, 0, *size)
+        self.active = True
+        return allocated
+
+    def begin(self, scale):
+        """Redirects drawing to the offscreen target and clears it, unless scale is 1."""
+        if scale >= 1.0:
+            self.active = False
+            return
+
+        size = (
+            max(1, int(DISPLAY_SIZE[0] * scale)),
+            max(1, int(DISPLAY_SIZE[1] * scale)),
+        )
+        self.bind(size)
+        glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
+
+    def finish(self):
+        """Switches back to the window and stretches the rendered scene over it."""
+        if not self.active:
+            return
+        self.active = False
+
+        glBindFramebuffer(GL_FRAMEBUFFER, 0)
+        glViewport(0, 0, *DISPLAY_SIZE)
+
+        use_unlit()
+        gl_state.disable(GL_DEPTH_TEST)
+        gl_state.enable(GL_TEXTURE_2D)
+        gl_state.bind_texture(self.texture_id)
+        glColor3f(1.0, 1.0, 1.0)
+
+        glMatrixMode(GL_PROJECTION)
+        glPushMatrix()
+        glLoadIdentity()
+        gluOrtho2D(0, 1, 0, 1)
+
+        glMatrixMode(GL_MODELVIEW)
+        glPushMatrix()
+        glLoadIdentity()
+
+        glBegin(GL_QUADS)
+        glTexCoord2f(0, 0)
+        glVertex2f(0, 0)
+        glTexCoord2f(1, 0)
+        glVertex2f(1, 0)
+        glTexCoord2f(1, 1)
+        glVertex2f(1, 1)
+        glTexCoord2f(0, 1)
+        glVertex2f(0, 1)
+        glEnd()
+
+        glPopMatrix()
+        glMatrixMode(GL_PROJECTION)
+        glPopMatrix()
+        glMatrixMode(GL_MODELVIEW)
+
+        gl_state.disable(GL_TEXTURE_2D)
+        gl_state.enable(GL_DEPTH_TEST)
+
+
+scene_target = SceneTarget()
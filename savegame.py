@@ -0,0 +1,324 @@
+import functools
+import itertools
+import math
+import os
+import random
+import struct
+import weakref
+from array import array
+import numpy as np
+from config import *
+from protocol import MODE_CUBE, MODE_PLANAR, board_allowed, create_game
+from utils import next_state_version
+
+# A save is the header, the state, the RNG state and then the snake's cells, head
+# first, each packed into one small unsigned int. SAVE_VERSION goes up whenever
+# the layout changes, and saves of other versions are refused.
+SAVE_MAGIC = b"S3DG"
+SAVE_VERSION = 2
+HEADER = struct.Struct("<4sBBHH")
+# Direction, food, score, head sequence number, camera pitch, yaw and zoom, seconds
+# played, length
+STATE = struct.Struct("<BIIIddddI")
+# The game's Mersenne Twister: its version, 625 words and the cached Gaussian, if any
+RNG = struct.Struct("<B?d")
+RNG_WORDS = 625
+
+# Planar directions in the order they are numbered in saves
+DIRECTIONS = ((1, 0), (0, 1), (-1, 0), (0, -1))
+
+# The last resumable game is kept here between runs
+RESUME_PATH = os.path.join(
+    os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache")),
+    "snake3d",
+    "resume.sav",
+)
+
+
+class SaveError(ValueError):
+    """Raised for a save that cannot be read, or does not fit the game."""
+
+
+class BoardCells:
+    """Numbers the cells of a board, so a cell is saved as its number."""
+
+    def __init__(self, mode, board, cells):
+        """Numbers `cells` of a board in the order given."""
+        self.mode = mode
+        self.board = board
+        # Numbers fit in 16 bits up to a 256x256 board or a cube with n = 104
+        self.dtype = np.uint16 if len(cells) <= 0x10000 else np.uint32
+        self.number = {cell: i for i, cell in enumerate(cells)}
+        # Turning numbers back into cells takes the same tuples from this array
+        self.cells = np.empty(len(cells), object)
+        self.cells[:] = cells
+
+    @functools.cached_property
+    def neighbours(self):
+        """The numbers of the 4 cells next to each cell, -1 past a planar edge."""
+        if self.mode == MODE_CUBE:
+            from logic_cube import cube_step
+
+            n = self.board[0]
+            near = [[cube_step(n, cell, d)[0] for d in range(4)] for cell in self.cells]
+        else:
+            near = [[(x + dx, y + dy) for dx, dy in DIRECTIONS] for x, y in self.cells]
+        number = self.number
+        return np.array([[number.get(cell, -1) for cell in row] for row in near])
+
+
+@functools.lru_cache(maxsize=8)
+def board_cells(mode, board):
+    """Returns the BoardCells of a planar (width, height) board or an n-cube (n, n)."""
+    width, height = board
+    if mode == MODE_CUBE:
+        cells = list(itertools.product(range(6), range(width), range(width)))
+    else:
+        xs = range(-(width // 2), width - width // 2)
+        ys = range(-(height // 2), height - height // 2)
+        cells = list(itertools.product(xs, ys))
+    return BoardCells(mode, board, cells)
+
+
+def game_board(game):
+    """Returns the mode and board of a game, as the server names them."""
+    # Only cube games have N cells along each edge; the game modules load lazily
+    if hasattr(game, "N"):
+        return MODE_CUBE, (game.N, game.N)
+    width = game.GRID_X[1] - game.GRID_X[0] + 1
+    height = game.GRID_Y[1] - game.GRID_Y[0] + 1
+    return MODE_PLANAR, (width, height)
+
+
+class SnakeCells:
+    """The numbers of a game's snake cells, kept up to date between saves.
+
+    Like the snake mesh, it relies on segments being numbered by head_seq as they
+    are created, and on a new epoch whenever the snake is replaced. The numbers are
+    kept in a ring, newest at the lowest index, so the snake is one or two slices of
+    it and a save only numbers the heads added since the last one.
+    """
+
+    def __init__(self, board):
+        """Starts empty for a game on `board`."""
+        self.board = board
+        self.ring = np.zeros(len(board.cells), board.dtype)
+        self.epoch = None
+        self.head_seq = 0
+
+    def slot(self, seq):
+        """Returns the ring index of the segment numbered `seq`."""
+        return -seq % len(self.ring)
+
+    def update(self, game):
+        """Numbers the segments created since the last update."""
+        snake, seq = game.snake, game.head_seq
+        added = seq - self.head_seq
+        number = self.board.number
+        if (
+            game.epoch != self.epoch
+            or not 0 <= added <= len(snake)
+            or self.ring[self.slot(seq - len(snake) + 1)] != number[snake[-1]]
+        ):
+            added = len(snake)
+        numbers = np.fromiter(
+            map(number.__getitem__, itertools.islice(snake, added)),
+            self.ring.dtype,
+            added,
+        )
+        self.store(seq, numbers)
+        self.epoch = game.epoch
+
+    def store(self, head_seq, numbers):
+        """Writes the numbers of the segments from `head_seq` down, head first."""
+        start = self.slot(head_seq)
+        split = min(start + len(numbers), len(self.ring)) - start
+        self.ring[start : start + split] = numbers[:split]
+        self.ring[: len(numbers) - split] = numbers[split:]
+        self.head_seq = head_seq
+
+    def packed(self, length):
+        """Returns the bytes of the `length` newest numbers, newest first."""
+        start = self.slot(self.head_seq)
+        end = start + length
+        if end <= len(self.ring):
+            return self.ring[start:end].tobytes()
+        return (
+            self.ring[start:].tobytes() + self.ring[: end - len(self.ring)].tobytes()
+        )
+
+
+# Per game, the numbers of its snake as of its last save
+_snake_cells = weakref.WeakKeyDictionary()
+
+
+def snake_cells(game, board):
+    """Returns the SnakeCells kept for a game."""
+    cells = _snake_cells.get(game)
+    if cells is None or cells.board is not board:
+        cells = _snake_cells[game] = SnakeCells(board)
+    return cells
+
+
+def saved_mode(data):
+    """Returns the mode of a save, MODE_PLANAR or MODE_CUBE, from its header."""
+    try:
+        magic, _, mode, _, _ = HEADER.unpack_from(data)
+    except struct.error:
+        raise SaveError("not a saved game")
+    if magic != SAVE_MAGIC:
+        raise SaveError("not a saved game")
+    if mode not in (MODE_PLANAR, MODE_CUBE):
+        raise SaveError(f"unknown mode {mode}")
+    return mode
+
+
+def save_game(game):
+    """Returns the state of a planar or cube game as bytes, for load_game().
+
+    Saves the snake, direction, food, score, camera, time played and the game's
+    random number generator, which decides where food appears. Queued turns are not
+    saved.
+    """
+    mode, board = game_board(game)
+    cells = board_cells(mode, board)
+    snake = snake_cells(game, cells)
+    snake.update(game)
+    if mode == MODE_CUBE:
+        direction = game.dir_idx
+    else:
+        direction = DIRECTIONS.index(game.direction)
+    rng_version, words, gauss = game.random.getstate()
+    return b"".join(
+        [
+            HEADER.pack(SAVE_MAGIC, SAVE_VERSION, mode, *board),
+            STATE.pack(
+                direction,
+                cells.number[game.food],
+                game.score,
+                game.head_seq,
+                game.cam_pitch,
+                game.cam_yaw,
+                game.cam_zoom,
+                game.play_time,
+                len(game.snake),
+            ),
+            RNG.pack(rng_version, gauss is not None, gauss or 0.0),
+            array("I", words).tobytes(),
+            snake.packed(len(game.snake)),
+        ]
+    )
+
+
+def load_game(data, game=None):
+    """Restores a save from save_game() into `game`, or a new game, and returns it.
+
+    The game must be of the saved mode and board size. Its camera keys and queued
+    turns are cleared and its random number generator is restored, so food appears
+    where it would have. Other games and the random module are left alone.
+    """
+    mode = saved_mode(data)
+    try:
+        _, version, _, width, height = HEADER.unpack_from(data)
+        if version != SAVE_VERSION:
+            raise SaveError(f"unsupported save version {version}")
+        offset = HEADER.size
+        state = STATE.unpack_from(data, offset)
+        offset += STATE.size
+        rng_version, has_gauss, gauss = RNG.unpack_from(data, offset)
+        offset += RNG.size
+    except struct.error as e:
+        raise SaveError(f"truncated save: {e}")
+    words = array("I")
+    end = offset + RNG_WORDS * words.itemsize
+    if len(data) < end:
+        raise SaveError("truncated save")
+    words.frombytes(data[offset:end])
+    offset = end
+
+    # Checked before numbering the board's cells, which takes memory in proportion
+    board = (width, height)
+    if game is not None:
+        if game_board(game) != (mode, board):
+            raise SaveError(f"the save is of another mode or board size, {board}")
+    elif not board_allowed(mode, board):
+        raise SaveError(f"board {board} is out of bounds")
+
+    cells = board_cells(mode, board)
+    count = len(cells.cells)
+    direction, food, score, head_seq, pitch, yaw, zoom, play_time, length = state
+    if not 0 < length <= count:
+        raise SaveError("corrupt save")
+    if offset + length * np.dtype(cells.dtype).itemsize != len(data):
+        raise SaveError("truncated save")
+    numbers = np.frombuffer(data, cells.dtype, length, offset)
+    if food >= count or numbers.max() >= count or direction >= len(DIRECTIONS):
+        raise SaveError("corrupt save")
+    if not all(map(math.isfinite, (pitch, yaw, zoom, play_time))):
+        raise SaveError("corrupt save")
+    # The snake must be a path of distinct cells, with the food off it
+    if len(np.unique(numbers)) != length or food in numbers:
+        raise SaveError("corrupt save: the snake overlaps itself or the food")
+    neighbours = cells.neighbours[numbers[:-1]]
+    if not (neighbours == numbers[1:, None]).any(axis=1).all():
+        raise SaveError("corrupt save: the snake is not a path")
+    rng = random.Random()
+    try:
+        rng.setstate((rng_version, tuple(words), gauss if has_gauss else None))
+    except (TypeError, ValueError) as e:
+        raise SaveError(f"corrupt random number generator state: {e}")
+
+    if game is None:
+        game = create_game(mode, board)
+
+    game.random = rng
+
+    game.snake = cells.cells[numbers].tolist()
+    game.food = cells.cells[food]
+    if mode == MODE_CUBE:
+        game.dir_idx = direction
+    else:
+        game.direction = DIRECTIONS[direction]
+    game.turns.clear()
+    game.applied_inputs = []
+    game.score = game.shown_score = score
+    game.head_seq = head_seq
+    game.cam_pitch, game.cam_yaw, game.cam_zoom = pitch, yaw, zoom
+    game.play_time = play_time
+    for key in game.cam_keys:
+        game.cam_keys[key] = False
+    game.version = next_state_version()
+    game.epoch = game.version
+    game.telemetry.reset()
+    snake = snake_cells(game, cells)
+    snake.store(game.head_seq, numbers)
+    snake.epoch = game.epoch
+    return game
+
+
+def read_resume(path=RESUME_PATH):
+    """Returns the save left by write_resume(), or None if there is none."""
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+        saved_mode(data)
+    except OSError:
+        return None
+    except SaveError as e:
+        print(f"Warning: Ignoring the paused game in {path}: {e}")
+        return None
+    return data
+
+
+def write_resume(data, path=RESUME_PATH):
+    """Keeps a save to resume after the next start, or removes the last one if None."""
+    try:
+        if data is None:
+            if os.path.exists(path):
+                os.remove(path)
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+    except OSError as e:
+        print(f"Warning: Could not keep the paused game in {path}: {e}")
@@ -0,0 +1,70 @@
+import time
+from OpenGL.GL import *
+from graphics import (
+    gl_resources,
+    gl_state,
+    prepare_lit_program,
+    render_options,
+    shader_lighting,
+)
+from profiler import frame_profiler
+
+
+class SceneCache:
+    """Display list holding a game's world geometry for one simulation tick.
+
+    The game state only changes when the simulation ticks, but the scene is drawn
+    every frame. The first frame after a change records the draw calls into a
+    display list; the frames in between replay it under their own camera. Lights,
+    shadow matrices and the animated apple stay outside the list.
+    """
+
+    def __init__(self):
+        """Starts empty; the list is created on the first draw."""
+        self.list_id = None
+        self.key = None
+        self.build_time = 0.0
+
+    def draw(self, key, build):
+        """Replays the list recorded for `key`, or records it by calling `build`."""
+        if not render_options.scene_cache:
+            build()
+            return
+
+        key = (
+            key,
+            render_options.outline_mode,
+            render_options.tessellation,
+            shader_lighting.active(),
+        )
+        prepare_lit_program()
+
+        start = time.perf_counter()
+        if key == self.key:
+            glCallList(self.list_id)
+            # The list changed state behind the cache's back
+            gl_state.invalidate()
+            replay_time = time.perf_counter() - start
+            frame_profiler.add_time("scene_cache_saved", self.build_time - replay_time)
+            frame_profiler.sample("scene_cache_hit_rate", True)
+            return
+
+        if self.list_id is None:
+            self.list_id = gl_resources.add("display_list", glGenLists(1), "scene")
+        gl_state.recording = True
+        glNewList(self.list_id, GL_COMPILE_AND_EXECUTE)
+        try:
+            build()
+        finally:
+            glEndList()
+            gl_state.recording = False
+        self.key = key
+        self.build_time = time.perf_counter() - start
+        frame_profiler.sample("scene_cache_hit_rate", False)
+
+    def release(self):
+        """Deletes the display list."""
+        if self.list_id is not None:
+            gl_resources.release("display_list", self.list_id)
+        self.list_id = None
+        self.key = None
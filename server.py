@@ -0,0 +1,256 @@
+import asyncio
+import settings
+import sys
+import time
+
+if __name__ == "__main__":
+    # Before config is imported, which applies the settings flags
+    settings.use_command_line(sys.argv[1:])
+
+from config import *
+from telemetry import telemetry_writer
+from protocol import (
+    DEFAULT_PORT,
+    DELTA_ATE,
+    DELTA_DEAD,
+    DELTA_FOOD,
+    DELTA_TURN,
+    KEYFRAME_DEAD,
+    KEYFRAME_RESET,
+    MODE_CUBE,
+    MSG_TURN,
+    TICK_MASK,
+    ProtocolError,
+    board_allowed,
+    create_game,
+    decode_join,
+    decode_turn,
+    encode_delta,
+    encode_keyframe,
+    read_message,
+    split_address,
+)
+
+# Seconds a new connection has to send its join request
+JOIN_TIMEOUT = 5.0
+# Bytes a client may have waiting to be sent before it is skipped until a keyframe
+MAX_BACKLOG = 64 * 1024
+
+
+class RoomClient:
+    """A connection to a room and what it was sent."""
+
+    def __init__(self, writer):
+        """Starts waiting for a keyframe, as the client has no state yet."""
+        self.writer = writer
+        self.needs_keyframe = True
+        self.bytes_sent = 0
+
+    def send(self, data):
+        """Writes a message, unless the client is too far behind to take it."""
+        if self.writer.transport.get_write_buffer_size() > MAX_BACKLOG:
+            # Once it catches up, a keyframe replaces everything it missed
+            self.needs_keyframe = True
+            return
+        self.writer.write(data)
+        self.bytes_sent += len(data)
+
+
+class Room:
+    """One game hosted by the server and the clients watching it.
+
+    The first client to join steers the snake and the others watch; when it leaves
+    the next one takes over. Each tick the clients are sent only the new head and
+    whether the snake ate, died or the food moved. Every `keyframe_interval` ticks,
+    after a reset and whenever a client joins or falls behind, that client gets the
+    whole state instead.
+    """
+
+    def __init__(self, name, mode, board, interval, keyframe_interval):
+        """Creates the room's game; ticking starts with start()."""
+        self.name = name
+        self.mode = mode
+        self.board = board
+        self.interval = interval
+        self.keyframe_interval = keyframe_interval
+        self.game = create_game(mode, board)
+        self.clients = []
+        self.alive = True
+        self.tick = 0
+        self.since_keyframe = 0
+        self.ticks = 0
+        self.cpu_time = 0.0
+        self.task = None
+
+    def start(self):
+        """Starts ticking on the running event loop."""
+        self.task = asyncio.get_running_loop().create_task(self._run())
+
+    def stop(self):
+        """Stops ticking."""
+        if self.task:
+            self.task.cancel()
+
+    async def _run(self):
+        """Ticks the game every interval; a tick that fails closes the room."""
+        loop = asyncio.get_running_loop()
+        next_tick = loop.time() + self.interval
+        try:
+            while True:
+                await asyncio.sleep(max(0.0, next_tick - loop.time()))
+                self.step()
+                next_tick += self.interval
+                # After a long stall, carry on from now instead of catching up
+                if loop.time() - next_tick > self.interval:
+                    next_tick = loop.time() + self.interval
+        except Exception as e:
+            print(f"Warning: Room {self.describe()} stopped ticking: {e!r}")
+            # Each client's handler sees its connection end and removes it
+            for client in self.clients:
+                client.writer.close()
+
+    def step(self):
+        """Advances the game one tick and sends every client what changed."""
+        start = time.thread_time()
+        game = self.game
+        self.tick = (self.tick + 1) & TICK_MASK
+        delta = None
+        keyframe_flags = 0
+
+        if not self.alive:
+            # The tick after a death starts a new game
+            game.reset()
+            self.alive = True
+            keyframe_flags = KEYFRAME_RESET
+            for client in self.clients:
+                client.needs_keyframe = True
+        else:
+            food, score = game.food, game.score
+            self.alive = game.update()
+            flags = 0
+            if not self.alive:
+                flags |= DELTA_DEAD
+                keyframe_flags = KEYFRAME_DEAD
+            elif game.score != score:
+                flags |= DELTA_ATE
+            if game.food != food:
+                flags |= DELTA_FOOD
+            if game.applied_inputs:
+                flags |= DELTA_TURN
+                game.applied_inputs = []
+            delta = encode_delta(self.mode, self.tick, flags, game.snake[0], game.food)
+
+        self.since_keyframe += 1
+        if self.since_keyframe >= self.keyframe_interval:
+            self.since_keyframe = 0
+            for client in self.clients:
+                client.needs_keyframe = True
+
+        keyframe = None
+        for client in self.clients:
+            if client.needs_keyframe:
+                if keyframe is None:
+                    keyframe = encode_keyframe(
+                        self.mode, self.tick, game, keyframe_flags
+                    )
+                client.needs_keyframe = False
+                client.send(keyframe)
+            elif delta is not None:
+                client.send(delta)
+
+        self.ticks += 1
+        self.cpu_time += time.thread_time() - start
+
+    def describe(self):
+        """Returns the room's name, mode and board for log messages."""
+        if self.mode == MODE_CUBE:
+            return f"{self.name!r} (cube {self.board[0]})"
+        return f"{self.name!r} (planar {self.board[0]}x{self.board[1]})"
+
+
+class GameServer:
+    """Hosts any number of rooms on one asyncio event loop.
+
+    A room is identified by its name, mode and board size, is opened by the first
+    client asking for it and closed when its last client leaves.
+    """
+
+    def __init__(
+        self, interval=MOVE_DELAY / 1000.0, keyframe_interval=KEYFRAME_INTERVAL
+    ):
+        """Starts without rooms."""
+        self.interval = interval
+        self.keyframe_interval = keyframe_interval
+        self.rooms = {}
+        self.log = True
+
+    async def listen(self, host, port):
+        """Starts accepting clients and returns the asyncio server."""
+        return await asyncio.start_server(self._handle, host, port)
+
+    async def _handle(self, reader, writer):
+        """Serves one client: its join request, then its turns until it leaves."""
+        try:
+            payload = await asyncio.wait_for(read_message(reader), JOIN_TIMEOUT)
+            mode, board, name = decode_join(payload)
+            if not board_allowed(mode, board):
+                raise ProtocolError(f"board {board} is out of bounds")
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, ProtocolError) as e:
+            if self.log:
+                print(f"Warning: Rejected a client: {e!r}")
+            writer.close()
+            return
+
+        key = (name, mode, board)
+        room = self.rooms.get(key)
+        if room is None:
+            room = Room(name, mode, board, self.interval, self.keyframe_interval)
+            self.rooms[key] = room
+            room.start()
+            if self.log:
+                print(f"Room {room.describe()} opened")
+        client = RoomClient(writer)
+        room.clients.append(client)
+
+        try:
+            while True:
+                payload = await read_message(reader)
+                if payload[:1] == bytes([MSG_TURN]) and room.clients[0] is client:
+                    room.game.queue_turn(decode_turn(payload))
+        except (asyncio.IncompleteReadError, ConnectionError, ProtocolError):
+            pass
+        except asyncio.CancelledError:
+            # The server is shutting down; the connection is closed below
+            pass
+        finally:
+            room.clients.remove(client)
+            writer.close()
+            if not room.clients:
+                room.stop()
+                del self.rooms[key]
+                if self.log:
+                    print(f"Room {room.describe()} closed after {room.ticks} ticks")
+
+
+async def serve(address):
+    """Runs a game server on `address` until it is interrupted."""
+    host, port = split_address(address)
+    server = await GameServer().listen(host, port)
+    print(f"Serving on {host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+
+def main(argv):
+    """Runs the server on the address given on the command line, or on every interface."""
+    address = argv[0] if argv else f"0.0.0.0:{DEFAULT_PORT}"
+    try:
+        asyncio.run(serve(address))
+    except KeyboardInterrupt:
+        pass
+    telemetry_writer.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(settings.remaining_args))
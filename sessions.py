@@ -0,0 +1,207 @@
+import os
+import queue
+import threading
+import time
+from config import *
+
+# Where finished games are kept, unless SESSIONS_DB is set
+DB_PATH = SESSIONS_DB or os.path.join(
+    os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache")),
+    "snake3d",
+    "sessions.db",
+)
+# Modes in the order the menu lists them
+MODES = ("planar", "cube", "arena")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY,
+    mode TEXT NOT NULL,
+    score INTEGER NOT NULL,
+    length INTEGER NOT NULL,
+    duration REAL NOT NULL,
+    ticks INTEGER NOT NULL,
+    ended REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sessions_by_score ON sessions (mode, score);
+"""
+INSERT_SQL = (
+    "INSERT INTO sessions (mode, score, length, duration, ticks, ended)"
+    " VALUES (?, ?, ?, ?, ?, ?)"
+)
+# Each query reads a range of sessions_by_score; only the leaderboard visits rows,
+# and only the ones it returns
+LEADERBOARD_SQL = (
+    "SELECT score, length, duration, ticks, ended FROM sessions"
+    " WHERE mode = ? ORDER BY score DESC LIMIT ?"
+)
+COUNT_SQL = "SELECT COUNT(*) FROM sessions WHERE mode = ?"
+COUNT_BELOW_SQL = "SELECT COUNT(*) FROM sessions WHERE mode = ? AND score < ?"
+SCORE_AT_SQL = (
+    "SELECT score FROM sessions WHERE mode = ? ORDER BY score LIMIT 1 OFFSET ?"
+)
+
+
+def open_db(path):
+    """Opens the session database at `path`, creating it if needed."""
+    # Imported here rather than with the game, whose menu never needs it
+    import sqlite3
+
+    if path != ":memory:":
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    db = sqlite3.connect(path)
+    # A commit appends to the write-ahead log without waiting for the disk to sync
+    db.execute("PRAGMA journal_mode = WAL")
+    db.execute("PRAGMA synchronous = NORMAL")
+    db.executescript(SCHEMA)
+    return db
+
+
+def leaderboard(db, mode, limit):
+    """Returns (score, length, duration, ticks, ended) of a mode's best sessions."""
+    return db.execute(LEADERBOARD_SQL, (mode, limit)).fetchall()
+
+
+def percentile_of(db, mode, score):
+    """Returns the percentage of a mode's sessions that scored less than `score`."""
+    total = db.execute(COUNT_SQL, (mode,)).fetchone()[0]
+    if not total:
+        return None
+    below = db.execute(COUNT_BELOW_SQL, (mode, score)).fetchone()[0]
+    return 100.0 * below / total
+
+
+def score_at_percentile(db, mode, percentile):
+    """Returns the score that `percentile` percent of a mode's sessions are below."""
+    total = db.execute(COUNT_SQL, (mode,)).fetchone()[0]
+    if not total:
+        return None
+    offset = min(int(total * percentile / 100), total - 1)
+    return db.execute(SCORE_AT_SQL, (mode, offset)).fetchone()[0]
+
+
+class SessionStore:
+    """Finished games, written to SQLite on a background thread.
+
+    record() only queues a session, so the frame loop never waits for the disk. The
+    writer inserts whatever has queued up in one transaction, then reads the best
+    scores of the modes written into `best`, which the menu draws from without a
+    query, and the percentile of the newest session for the game over screen.
+    """
+
+    def __init__(self, path=DB_PATH, top_count=MENU_TOP_SCORES):
+        """Prepares the store; start() opens the database."""
+        self.path = path
+        self.enabled = SESSIONS
+        self.top_count = top_count
+        self.jobs = queue.SimpleQueue()
+        self.thread = None
+        self.lock = threading.Lock()
+        # mode -> the best scores, replaced whole by the writer
+        self.best = {}
+        # The session last written and its percentile
+        self.ranked = (None, None)
+        self.written = 0
+        self.batches = 0
+        self.failed = False
+
+    def start(self):
+        """Starts the writer thread, which first reads the best scores of every mode."""
+        with self.lock:
+            if self.enabled and self.thread is None:
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+
+    def record(self, mode, game):
+        """Queues the session of a game that just ended, and returns it.
+
+        `mode` is the lower-case name of its mode. The game provides session_stats()
+        and `play_time`, the seconds it was played for. Returns None when disabled.
+        """
+        if not self.enabled:
+            return None
+        score, length, ticks = game.session_stats()
+        session = (mode, score, length, game.play_time, ticks, time.time())
+        self.jobs.put(session)
+        return session
+
+    def percentile(self, session):
+        """Returns the percentile of a recorded session once written, else None."""
+        written, percentile = self.ranked
+        return percentile if written is session else None
+
+    def flush(self):
+        """Waits until everything queued so far is written."""
+        if self.thread is not None:
+            done = threading.Event()
+            self.jobs.put(done)
+            done.wait()
+
+    def close(self):
+        """Writes everything queued and stops the thread."""
+        with self.lock:
+            thread, self.thread = self.thread, None
+        if thread:
+            self.jobs.put(None)
+            thread.join()
+
+    def _run(self):
+        """Writes queued sessions in batches until close()."""
+        import sqlite3
+
+        try:
+            db = open_db(self.path)
+            for mode in MODES:
+                self._read_best(db, mode)
+        except (OSError, sqlite3.Error) as e:
+            self._warn(e)
+            db = None
+        while True:
+            batch = [self.jobs.get()]
+            while True:
+                try:
+                    batch.append(self.jobs.get_nowait())
+                except queue.Empty:
+                    break
+            sessions = [job for job in batch if isinstance(job, tuple)]
+            if sessions and db:
+                try:
+                    self._write(db, sessions)
+                except (OSError, sqlite3.Error) as e:
+                    self._warn(e)
+            for job in batch:
+                if isinstance(job, threading.Event):
+                    job.set()
+            if None in batch:
+                if db:
+                    db.close()
+                return
+
+    def _write(self, db, sessions):
+        """Inserts sessions in one transaction and refreshes what is read from them."""
+        with db:
+            db.executemany(INSERT_SQL, sessions)
+        self.written += len(sessions)
+        self.batches += 1
+        for mode in {session[0] for session in sessions}:
+            self._read_best(db, mode)
+        # The newest session is ranked among the others; a mode's first has no rank
+        newest = sessions[-1]
+        mode, score = newest[:2]
+        others = db.execute(COUNT_SQL, (mode,)).fetchone()[0] - 1
+        below = db.execute(COUNT_BELOW_SQL, (mode, score)).fetchone()[0]
+        self.ranked = (newest, 100.0 * below / others if others else None)
+
+    def _read_best(self, db, mode):
+        """Replaces the cached best scores of a mode."""
+        rows = leaderboard(db, mode, self.top_count)
+        self.best = {**self.best, mode: tuple(row[0] for row in rows)}
+
+    def _warn(self, error):
+        """Prints the first failure only; the game plays on without the store."""
+        if not self.failed:
+            self.failed = True
+            print(f"Warning: Could not keep game sessions in {self.path}: {error}")
+
+
+session_store = SessionStore()
@@ -0,0 +1,325 @@
+import json
+import os
+import sys
+
+CONFIG_FILE = "snake3d.json"
+ENV_PREFIX = "SNAKE3D_"
+
+
+class SettingsError(ValueError):
+    """Raised with every problem found when the runtime settings do not validate."""
+
+    def __init__(self, problems):
+        """Keeps the list of problems, one message each."""
+        super().__init__("; ".join(problems))
+        self.problems = problems
+
+
+def parse_bool(value):
+    """Accepts a bool, or 1/0, true/false, yes/no and on/off in any case."""
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in ("1", "true", "yes", "on"):
+        return True
+    if text in ("0", "false", "no", "off"):
+        return False
+    raise ValueError(f"expected true or false, got {value!r}")
+
+
+def parse_int(low, high):
+    """Returns a parser for whole numbers between `low` and `high`."""
+
+    def parse(value):
+        if isinstance(value, bool) or isinstance(value, float):
+            raise ValueError(f"expected a whole number, got {value!r}")
+        try:
+            number = int(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"expected a whole number, got {value!r}")
+        if not low <= number <= high:
+            raise ValueError(f"must be between {low} and {high}, got {number}")
+        return number
+
+    return parse
+
+
+def parse_float(low, high):
+    """Returns a parser for numbers between `low` and `high`."""
+
+    def parse(value):
+        try:
+            number = float(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"expected a number, got {value!r}")
+        if not low <= number <= high:
+            raise ValueError(f"must be between {low} and {high}, got {number}")
+        return number
+
+    return parse
+
+
+def parse_size(low, high):
+    """Returns a parser for WIDTHxHEIGHT, or a [width, height] pair, within bounds."""
+    parse_side = parse_int(low, high)
+
+    def parse(value):
+        if isinstance(value, str):
+            parts = value.lower().split("x")
+        else:
+            parts = list(value) if isinstance(value, (list, tuple)) else [value]
+        if len(parts) != 2:
+            raise ValueError(f"expected WIDTHxHEIGHT, got {value!r}")
+        return tuple(parse_side(part) for part in parts)
+
+    return parse
+
+
+def parse_choice(*choices):
+    """Returns a parser that accepts one of `choices`, compared as text."""
+
+    def parse(value):
+        for choice in choices:
+            if str(value).lower() == str(choice):
+                return choice
+        expected = ", ".join(map(str, choices))
+        raise ValueError(f"expected one of {expected}, got {value!r}")
+
+    return parse
+
+
+def parse_address(value):
+    """Accepts host:port or host, or an empty text for none."""
+    text = str(value).strip()
+    host, colon, port = text.rpartition(":")
+    if colon and (not host or not port.isdigit() or not 0 < int(port) < 65536):
+        raise ValueError(f"expected HOST:PORT, got {value!r}")
+    return text
+
+
+def parse_path(value):
+    """Accepts a file path, or an empty text for none."""
+    return str(value).strip()
+
+
+def parse_name(value):
+    """Accepts a name of 1 to 32 printable characters."""
+    text = str(value)
+    if not 0 < len(text) <= 32 or not text.isprintable():
+        raise ValueError(f"expected 1 to 32 printable characters, got {value!r}")
+    return text
+
+
+# Settings that can be changed without editing config.py: name, parser and help.
+# Each one overrides the config constant of the same name in upper case.
+SETTINGS = {
+    "display_size": (parse_size(320, 7680), "window size as WIDTHxHEIGHT"),
+    "move_delay": (parse_int(20, 2000), "milliseconds per simulation tick"),
+    "frame_rate": (parse_int(10, 1000), "frame rate cap while playing"),
+    "vsync": (parse_bool, "wait for the display's refresh on every flip"),
+    "msaa_samples": (parse_choice(0, 2, 4, 8), "multisampling samples, 0 for none"),
+    "grid_size": (parse_size(5, 201), "planar board size in cells, WIDTHxHEIGHT"),
+    "cube_n": (parse_int(4, 64), "cells along each edge of a cube face"),
+    "arena_size": (parse_size(16, 2048), "arena board size in cells, WIDTHxHEIGHT"),
+    "arena_snakes": (parse_int(1, 10000), "snakes in the arena, counting yours"),
+    "arena_food": (parse_int(1, 10000), "food kept on the arena board"),
+    "spectator_games": (parse_int(1, 256), "games shown on the spectator wall"),
+    "server": (parse_address, "game server to play on as HOST:PORT"),
+    "room": (parse_name, "room to join on the game server"),
+    "keyframe_interval": (parse_int(1, 1000), "server ticks between full snapshots"),
+    "headless": (parse_bool, "render to a hidden offscreen window"),
+    "lighting": (parse_choice("shader", "fixed"), "lighting path"),
+    "max_lights": (parse_int(1, 16), "point lights used by the shader"),
+    "shadow_quality": (
+        parse_choice("off", "low", "medium", "high"),
+        "shadow map resolution",
+    ),
+    "outline_mode": (parse_choice("batched", "per_cube", "off"), "cube outlines"),
+    "render_scale": (parse_float(0.25, 1.0), "3D scene resolution scale"),
+    "scene_cache": (parse_bool, "replay the world from a display list between ticks"),
+    "adaptive_quality": (parse_bool, "lower quality while frames miss the budget"),
+    "power_saving": (parse_bool, "lower the frame rate on menus and when unfocused"),
+    "simulation_thread": (parse_bool, "tick the game on its own thread"),
+    "show_stats": (parse_bool, "show the profiler overlay from the start"),
+    "gl_debug": (parse_bool, "check every GL call and log failing draw calls"),
+    "hot_reload": (parse_bool, "reload changed shaders and textures while running"),
+    "hot_reload_interval": (
+        parse_float(0.05, 60.0),
+        "seconds between checks for changed shaders and textures",
+    ),
+    "particles": (parse_bool, "burst particles when eating and on game over"),
+    "telemetry": (parse_bool, "keep the last ticks and save them when the snake dies"),
+    "telemetry_dir": (parse_path, "where to save the ticks before each death"),
+    "telemetry_stream": (parse_path, "append every tick here, e.g. ticks.jsonl"),
+    "sessions": (parse_bool, "keep finished games and show the best on the menu"),
+    "sessions_db": (parse_path, "SQLite database to keep finished games in"),
+    "menu_top_scores": (parse_int(0, 10), "best scores of each mode on the menu"),
+    "benchmark_output": (parse_path, "benchmark.py: write the results to this JSON"),
+    "benchmark_baseline": (parse_path, "benchmark.py: compare with this JSON"),
+    "benchmark_tolerance": (
+        parse_float(0.0, 10.0),
+        "benchmark.py: how much worse than the baseline is a regression, e.g. 0.15",
+    ),
+}
+
+# Named performance presets, applied over the config.py defaults and under any
+# setting given explicitly. "high" is what config.py ships with.
+PRESETS = {
+    "low": {
+        "msaa_samples": 0,
+        "lighting": "fixed",
+        "max_lights": 2,
+        "shadow_quality": "off",
+        "outline_mode": "off",
+        "render_scale": 0.5,
+    },
+    "medium": {
+        "msaa_samples": 0,
+        "lighting": "shader",
+        "max_lights": 4,
+        "shadow_quality": "low",
+        "render_scale": 0.75,
+    },
+    "high": {},
+    "ultra": {
+        "msaa_samples": 8,
+        "max_lights": 16,
+        "shadow_quality": "high",
+        "render_scale": 1.0,
+    },
+}
+
+# Command line arguments read for settings flags when config is imported. Only the
+# entry points set them, so importing config from anywhere else reads no flags.
+command_line = []
+# Positional command line arguments left over after the settings flags
+remaining_args = []
+
+
+def use_command_line(argv):
+    """Has config read settings flags from `argv`; call it before importing config."""
+    global command_line
+    if "config" in sys.modules:
+        print("Warning: config was imported before the command line was given.")
+    command_line = list(argv)
+
+
+def command_line_parser():
+    """Builds the parser for the settings flags, e.g. --display-size 1280x720."""
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Snake 3D. Settings are read from config.py, then the preset, "
+        f"then {CONFIG_FILE}, {ENV_PREFIX}* environment variables and these flags."
+    )
+    parser.add_argument("--config", help=f"settings file, default {CONFIG_FILE}")
+    parser.add_argument("--preset", help=f"one of {', '.join(PRESETS)}")
+    for name, (parse, help_text) in SETTINGS.items():
+        flag = "--" + name.replace("_", "-")
+        if parse is parse_bool:
+            parser.add_argument(
+                flag, action=argparse.BooleanOptionalAction, help=help_text
+            )
+        else:
+            parser.add_argument(flag, help=help_text)
+    return parser
+
+
+def read_file(path, required):
+    """Returns the settings in a JSON file, or {} if it is optional and missing."""
+    if not os.path.exists(path):
+        if required:
+            raise SettingsError([f"settings file {path} not found"])
+        return {}
+    try:
+        with open(path, "r") as f:
+            values = json.load(f)
+    except (OSError, ValueError) as e:
+        raise SettingsError([f"cannot read settings file {path}: {e}"])
+    if not isinstance(values, dict):
+        raise SettingsError([f"settings file {path} must hold a JSON object"])
+    return values
+
+
+def read_settings(defaults, argv=(), environ=None):
+    """Merges the defaults with the preset, file, environment and flags, and validates.
+
+    `defaults` maps config constant names to values. Returns the constants to
+    override, plus the arguments that were not settings flags, or raises
+    SettingsError listing everything that is wrong.
+    """
+    environ = os.environ if environ is None else environ
+    # Building the parser takes longer than the rest of startup's settings work, so
+    # it is skipped when there are no flags to parse
+    cli = {}
+    config_path = None
+    extra = list(argv)
+    if any(arg.startswith("-") for arg in argv):
+        flags, extra = command_line_parser().parse_known_args(extra)
+        config_path = flags.config
+        cli = {
+            name: value
+            for name, value in vars(flags).items()
+            if value is not None and name != "config"
+        }
+
+    env = {}
+    for name in ["preset", *SETTINGS]:
+        value = environ.get(ENV_PREFIX + name.upper())
+        if value is not None:
+            env[name] = value
+
+    path = config_path or environ.get(ENV_PREFIX + "CONFIG")
+    layers = [
+        ("config file", read_file(path or CONFIG_FILE, required=bool(path))),
+        ("environment", env),
+        ("command line", cli),
+    ]
+
+    problems = []
+    preset = None
+    for source, values in layers:
+        if "preset" in values:
+            preset = values["preset"]
+    if preset is not None and preset not in PRESETS:
+        expected = ", ".join(PRESETS)
+        problems.append(f"unknown preset {preset!r}, expected one of {expected}")
+        preset = None
+    layers.insert(0, (f"preset {preset}", PRESETS.get(preset, {})))
+
+    chosen = {}
+    for source, values in layers:
+        for name, value in values.items():
+            if name == "preset":
+                continue
+            if name not in SETTINGS:
+                problems.append(f"{source}: unknown setting {name!r}")
+                continue
+            try:
+                chosen[name] = SETTINGS[name][0](value)
+            except ValueError as e:
+                problems.append(f"{source}: {name} {e}")
+
+    for option in extra:
+        if option.startswith("-"):
+            problems.append(f"command line: unknown option {option}")
+    if problems:
+        raise SettingsError(problems)
+
+    overrides = {name.upper(): value for name, value in chosen.items()}
+    missing = [name for name in overrides if name not in defaults]
+    if missing:
+        raise SettingsError([f"config.py has no {name}" for name in missing])
+    return overrides, extra
+
+
+def load_settings(defaults):
+    """Reads the runtime settings for config.py, or exits listing what is invalid."""
+    global remaining_args
+    try:
+        overrides, remaining_args = read_settings(defaults, command_line)
+    except SettingsError as e:
+        for problem in e.problems:
+            print(f"Error: {problem}")
+        sys.exit(2)
+    return overrides
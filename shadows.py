@@ -0,0 +1,187 @@
+from OpenGL.GL import *
+from OpenGL.GLU import *
+from config import *
+from graphics import (
+    SHADOW_RESOLUTIONS,
+    gl_resources,
+    gl_state,
+    render_options,
+    shader_lighting,
+)
+from profiler import frame_profiler
+from utils import gl_mat_mul, gl_mat_rigid_inverse
+
+# Maps clip space [-1, 1] to shadow map texture and depth space [0, 1]
+BIAS_MATRIX = [
+    [0.5, 0.0, 0.0, 0.0],
+    [0.0, 0.5, 0.0, 0.0],
+    [0.0, 0.0, 0.5, 0.0],
+    [0.5, 0.5, 0.5, 1.0],
+]
+
+# lit.frag has samplers for this many shadow maps
+MAX_SHADOWS = 2
+
+SHADOW_FOV = 140.0
+SHADOW_NEAR = 0.05
+SHADOW_FAR = 40.0
+
+
+class ShadowMaps:
+    """Depth maps seen from the shadow-casting point lights, re-rendered once per tick.
+
+    The lights follow the head and the food, which only move when the simulation
+    ticks, so the maps are kept until the game's state version changes. Only the
+    camera part of the shadow matrices is updated every frame.
+    """
+
+    def __init__(self):
+        """Starts without any GL objects; they are created on the first update."""
+        self.resolution = 0
+        self.maps = []
+        self.light_matrices = []
+        self.key = None
+
+    def _allocate(self, resolution, count):
+        """Creates `count` depth textures with framebuffers of the given resolution."""
+        self.release()
+        previous_fbo = glGetIntegerv(GL_FRAMEBUFFER_BINDING)
+        self.maps = [self._create_map(resolution) for _ in range(count)]
+        glBindFramebuffer(GL_FRAMEBUFFER, previous_fbo)
+        self.resolution = resolution
+
+    def _create_map(self, resolution):
+        """Creates a depth texture of the given resolution attached to a framebuffer."""
+        texture_id = glGenTextures(1)
+        gl_state.bind_texture(texture_id)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_EDGE)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_CLAMP_TO_EDGE)
+        glTexImage2D(
+            GL_TEXTURE_2D,
+            0,
+            GL_DEPTH_COMPONENT24,
+            resolution,
+            resolution,
+            0,
+            GL_DEPTH_COMPONENT,
+            GL_UNSIGNED_INT,
+            None,
+        )
+        gl_resources.add("texture", texture_id, "shadow map", resolution**2 * 4)
+
+        fbo = gl_resources.add("framebuffer", glGenFramebuffers(1), "shadow map")
+        glBindFramebuffer(GL_FRAMEBUFFER, fbo)
+        glFramebufferTexture2D(
+            GL_FRAMEBUFFER, GL_DEPTH_ATTACHMENT, GL_TEXTURE_2D, texture_id, 0
+        )
+        glDrawBuffer(GL_NONE)
+        glReadBuffer(GL_NONE)
+        if glCheckFramebufferStatus(GL_FRAMEBUFFER) != GL_FRAMEBUFFER_COMPLETE:
+            print("Warning: Shadow map framebuffer is incomplete.")
+        return fbo, texture_id
+
+    def release(self):
+        """Deletes the shadow map textures and framebuffers."""
+        for fbo, texture_id in self.maps:
+            gl_resources.release("framebuffer", fbo)
+            gl_resources.release("texture", texture_id)
+        self.maps = []
+        self.light_matrices = []
+        self.resolution = 0
+        self.key = None
+
+    def update(self, game):
+        """Re-renders the shadow maps if the game state changed since the last update."""
+        resolution = SHADOW_RESOLUTIONS[render_options.shadow_quality]
+        if not resolution or not shader_lighting.active():
+            self.light_matrices = []
+            self.key = None
+            return
+
+        key = (game.version, resolution)
+        if key == self.key:
+            return
+
+        with frame_profiler.section("shadow"):
+            views = game.shadow_lights()[:MAX_SHADOWS]
+            if resolution != self.resolution or len(self.maps) < len(views):
+                self._allocate(resolution, len(views))
+            self._render(game.draw_shadow_casters, views)
+        frame_profiler.count("shadow_updates")
+        self.key = key
+
+    def _render(self, draw_casters, views):
+        """Renders the depth drawn by `draw_casters` from each (position, direction) view."""
+        previous_fbo = glGetIntegerv(GL_FRAMEBUFFER_BINDING)
+        viewport = glGetIntegerv(GL_VIEWPORT)
+        glViewport(0, 0, self.resolution, self.resolution)
+
+        gl_state.use_program(0)
+        gl_state.disable(GL_LIGHTING)
+        gl_state.disable(GL_TEXTURE_2D)
+        gl_state.enable(GL_DEPTH_TEST)
+        gl_state.enable(GL_POLYGON_OFFSET_FILL)
+        gl_state.set_polygon_offset(2.0, 4.0)
+
+        glMatrixMode(GL_PROJECTION)
+        glPushMatrix()
+        glMatrixMode(GL_MODELVIEW)
+        glPushMatrix()
+
+        self.light_matrices = []
+        for (fbo, _), (pos, direction) in zip(self.maps, views):
+            glBindFramebuffer(GL_FRAMEBUFFER, fbo)
+            glClear(GL_DEPTH_BUFFER_BIT)
+
+            glMatrixMode(GL_PROJECTION)
+            glLoadIdentity()
+            gluPerspective(SHADOW_FOV, 1.0, SHADOW_NEAR, SHADOW_FAR)
+            glMatrixMode(GL_MODELVIEW)
+            glLoadIdentity()
+            up = (0, 1, 0) if abs(direction[2]) > 0.9 else (0, 0, 1)
+            gluLookAt(
+                pos[0],
+                pos[1],
+                pos[2],
+                pos[0] + direction[0],
+                pos[1] + direction[1],
+                pos[2] + direction[2],
+                *up,
+            )
+
+            projection = glGetFloatv(GL_PROJECTION_MATRIX)
+            view = glGetFloatv(GL_MODELVIEW_MATRIX)
+            self.light_matrices.append(
+                gl_mat_mul(BIAS_MATRIX, gl_mat_mul(projection, view))
+            )
+
+            draw_casters()
+
+        glMatrixMode(GL_PROJECTION)
+        glPopMatrix()
+        glMatrixMode(GL_MODELVIEW)
+        glPopMatrix()
+
+        gl_state.disable(GL_POLYGON_OFFSET_FILL)
+        glBindFramebuffer(GL_FRAMEBUFFER, previous_fbo)
+        glViewport(*viewport)
+
+    def use_camera(self):
+        """Hands the maps to the lit shader for the camera view now on the modelview stack."""
+        shader_lighting.dirty = True
+        if not self.light_matrices:
+            shader_lighting.shadows = []
+            return
+
+        inverse_view = gl_mat_rigid_inverse(glGetFloatv(GL_MODELVIEW_MATRIX))
+        shadows = []
+        for (_, texture_id), light_matrix in zip(self.maps, self.light_matrices):
+            matrix = gl_mat_mul(light_matrix, inverse_view)
+            shadows.append((texture_id, [v for column in matrix for v in column]))
+        shader_lighting.shadows = shadows
+        shader_lighting.shadow_texel = 1.0 / self.resolution
+
+
+shadow_maps = ShadowMaps()
@@ -0,0 +1,140 @@
+import copy
+import queue
+import statistics
+import threading
+import time
+from collections import deque, namedtuple
+
+# Immutable copy of the game state the renderer needs, published once per tick
+GameSnapshot = namedtuple(
+    "GameSnapshot", "snake food score version head_seq epoch alive"
+)
+
+
+def take_snapshot(game, alive=True):
+    """Returns an immutable snapshot of the game's current state."""
+    return GameSnapshot(
+        tuple(game.snake),
+        game.food,
+        game.score,
+        game.version,
+        game.head_seq,
+        game.epoch,
+        alive,
+    )
+
+
+def apply_snapshot(game, snapshot):
+    """Copies a snapshot's state into a game, which can then be rendered as usual."""
+    game.snake = list(snapshot.snake)
+    game.food = snapshot.food
+    game.score = snapshot.score
+    game.version = snapshot.version
+    game.head_seq = snapshot.head_seq
+    game.epoch = snapshot.epoch
+
+
+def jitter_stats(times, interval):
+    """Returns the mean interval and the mean and worst deviation from `interval`, in ms."""
+    intervals = [b - a for a, b in zip(times, times[1:])]
+    if not intervals:
+        return 0.0, 0.0, 0.0
+    deviations = [abs(i - interval) for i in intervals]
+    return (
+        statistics.mean(intervals) * 1000,
+        statistics.mean(deviations) * 1000,
+        max(deviations) * 1000,
+    )
+
+
+class Simulation:
+    """Runs a game's update() on its own thread at a fixed rate.
+
+    The thread works on a private copy of the game. After every tick it publishes an
+    immutable snapshot by replacing `latest`, a single reference assignment, so the
+    render thread reads the newest state without locks and never sees a tick half
+    done. Turns travel the other way through a queue, and the timings of the turns
+    that were applied come back through another.
+    """
+
+    def __init__(self, view, interval):
+        """Prepares a simulation of `view`, the game the main thread renders."""
+        self.view = view
+        self.epoch = view.epoch
+        self.interval = interval
+        self.game = copy.copy(view)
+        self.game.snake = list(view.snake)
+        self.game.turns = deque()
+        self.game.applied_inputs = []
+        self.inputs = queue.SimpleQueue()
+        self.applied = queue.SimpleQueue()
+        self.pending_inputs = []
+        self.latest = take_snapshot(self.game)
+        self.tick_times = deque(maxlen=1000)
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        """Starts ticking."""
+        self.thread.start()
+
+    def stop(self):
+        """Stops ticking and waits for the thread to finish."""
+        self.stopping.set()
+        self.thread.join()
+
+    def hand_back(self):
+        """Stops ticking and leaves the view with the whole state of the last tick.
+
+        Besides what snapshots carry, that is the direction the snake is heading.
+        """
+        self.stop()
+        apply_snapshot(self.view, take_snapshot(self.game))
+        for name in ("direction", "dir_idx"):
+            if hasattr(self.game, name):
+                setattr(self.view, name, getattr(self.game, name))
+
+    def send_input(self):
+        """Forwards the turns the view game queued from this frame's events."""
+        while self.view.turns:
+            self.inputs.put(self.view.turns.popleft())
+
+    def sync_view(self):
+        """Copies the latest snapshot into the view; returns False once the snake died."""
+        snapshot = self.latest
+        if snapshot.version != self.view.version:
+            apply_snapshot(self.view, snapshot)
+        return snapshot.alive
+
+    def take_shown_inputs(self):
+        """Returns the applied turns' timings whose tick is now shown by the view."""
+        while not self.applied.empty():
+            self.pending_inputs.append(self.applied.get())
+        shown, waiting = [], []
+        for applied in self.pending_inputs:
+            version = applied[2]
+            (shown if version <= self.view.version else waiting).append(applied)
+        self.pending_inputs = waiting
+        return shown
+
+    def _run(self):
+        """Ticks the game until it ends or the simulation is stopped."""
+        next_tick = time.perf_counter() + self.interval
+        while not self.stopping.wait(max(0.0, next_tick - time.perf_counter())):
+            now = time.perf_counter()
+            self.tick_times.append(now)
+
+            while not self.inputs.empty():
+                self.game.queue_turn(*self.inputs.get())
+            alive = self.game.update()
+            for applied in self.game.applied_inputs:
+                self.applied.put(applied)
+            self.game.applied_inputs = []
+            self.latest = take_snapshot(self.game, alive)
+            if not alive:
+                return
+
+            next_tick += self.interval
+            # After a long stall, carry on from now instead of catching up in a burst
+            if now - next_tick > self.interval:
+                next_tick = now + self.interval
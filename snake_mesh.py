@@ -0,0 +1,227 @@
+import ctypes
+from array import array
+from OpenGL.GL import *
+from config import *
+from graphics import (
+    end_cube_material,
+    gl_resources,
+    gl_state,
+    render_options,
+    use_cube_material,
+    use_unlit,
+)
+from profiler import frame_profiler
+
+FACE_TEX_COORDS = ((0.0, 0.0), (1.0, 0.0), (1.0, 1.0), (0.0, 1.0))
+
+# Unit cube as 24 quad vertices of (position, normal, texture coordinate)
+CUBE_VERTEX_DATA = tuple(
+    (VERTICES[vertex], NORMALS[i], FACE_TEX_COORDS[corner])
+    for i, face in enumerate(FACES_QUADS)
+    for corner, vertex in enumerate(face)
+)
+# Unit cube edges as 24 line vertices
+CUBE_EDGE_DATA = tuple(VERTICES[vertex] for edge in EDGES for vertex in edge)
+
+SLOT_VERTICES = len(CUBE_VERTEX_DATA)
+VERTEX_STRIDE = 8 * 4
+SLOT_BYTES = SLOT_VERTICES * VERTEX_STRIDE
+OUTLINE_VERTICES = len(CUBE_EDGE_DATA)
+OUTLINE_BYTES = OUTLINE_VERTICES * 3 * 4
+
+
+def cube_vertex_data(cubes):
+    """Packs the quad vertices of (x, y, z, scale) cubes as interleaved floats."""
+    data = array("f")
+    for x, y, z, scale in cubes:
+        for v, n, t in CUBE_VERTEX_DATA:
+            data.extend(
+                (
+                    x + v[0] * scale,
+                    y + v[1] * scale,
+                    z + v[2] * scale,
+                    n[0],
+                    n[1],
+                    n[2],
+                    t[0],
+                    t[1],
+                )
+            )
+    return data
+
+
+def cube_edge_data(cubes):
+    """Packs the edge line vertices of (x, y, z, scale) cubes as floats."""
+    data = array("f")
+    for x, y, z, scale in cubes:
+        for v in CUBE_EDGE_DATA:
+            data.extend((x + v[0] * scale, y + v[1] * scale, z + v[2] * scale))
+    return data
+
+
+class SnakeMesh:
+    """GPU ring buffer holding one cube per snake body segment.
+
+    A game numbers its segments as they are created (`head_seq` is the number of the
+    head) and segment `seq` lives in slot seq % capacity. When the snake moves, the
+    old head becomes the newest body segment and is written to its slot; the tail
+    slot that is freed is simply left out of the drawn range. A tick therefore
+    uploads one slot whatever the length, and only a reset rewrites the whole body.
+    The head is not part of the mesh, as it is drawn with its own material.
+    """
+
+    def __init__(self, color, emission_level):
+        """Starts without any GL buffers; they are created on the first sync."""
+        self.color = color
+        self.emission_level = emission_level
+        self.vbo = None
+        self.outline_vbo = None
+        self.capacity = 0
+        self.epoch = None
+        self.synced_seq = 0
+        self.first_seq = 0
+        self.count = 0
+        self.uploaded_bytes = 0
+
+    def _allocate(self, capacity):
+        """Creates the vertex and outline buffers with room for `capacity` segments."""
+        self.release()
+        self.vbo, self.outline_vbo = glGenBuffers(2)
+        glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
+        glBufferData(GL_ARRAY_BUFFER, capacity * SLOT_BYTES, None, GL_DYNAMIC_DRAW)
+        gl_resources.add("buffer", self.vbo, "snake mesh", capacity * SLOT_BYTES)
+        glBindBuffer(GL_ARRAY_BUFFER, self.outline_vbo)
+        glBufferData(
+            GL_ARRAY_BUFFER, capacity * OUTLINE_BYTES, None, GL_DYNAMIC_DRAW
+        )
+        gl_resources.add(
+            "buffer", self.outline_vbo, "snake outline", capacity * OUTLINE_BYTES
+        )
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+        self.capacity = capacity
+
+    def release(self):
+        """Deletes the GL buffers."""
+        if self.vbo is not None:
+            gl_resources.release("buffer", self.vbo)
+            gl_resources.release("buffer", self.outline_vbo)
+        self.vbo = None
+        self.outline_vbo = None
+        self.capacity = 0
+        self.epoch = None
+        self.count = 0
+
+    def sync(self, game):
+        """Uploads the body segments created since the last sync.
+
+        After a reset, or when the board size changed, the whole body is written.
+        """
+        capacity = game.cell_count()
+        if capacity != self.capacity:
+            self._allocate(capacity)
+
+        body = len(game.snake) - 1
+        newest = game.head_seq - 1
+        oldest = newest - body + 1
+        if game.epoch != self.epoch:
+            self.epoch = game.epoch
+            self.synced_seq = oldest - 1
+
+        first = max(self.synced_seq + 1, oldest)
+        if first <= newest:
+            self._write(game, first, newest)
+        self.synced_seq = newest
+        self.first_seq = oldest
+        self.count = body
+
+    def rebuild(self, game):
+        """Rewrites every body segment, as if the game had just been reset."""
+        self.epoch = None
+        self.sync(game)
+
+    def _write(self, game, first, last):
+        """Writes segments `first` to `last` into their slots, one upload per run."""
+        glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
+        runs = []
+        seq = first
+        while seq <= last:
+            slot = seq % self.capacity
+            run = min(last - seq + 1, self.capacity - slot)
+            cubes = [
+                game.segment_cube(game.head_seq - s) for s in range(seq, seq + run)
+            ]
+            data = cube_vertex_data(cubes).tobytes()
+            glBufferSubData(GL_ARRAY_BUFFER, slot * SLOT_BYTES, len(data), data)
+            runs.append((slot, cubes))
+            self.uploaded_bytes += len(data)
+            frame_profiler.count("snake_mesh_bytes", len(data))
+            seq += run
+
+        glBindBuffer(GL_ARRAY_BUFFER, self.outline_vbo)
+        for slot, cubes in runs:
+            data = cube_edge_data(cubes).tobytes()
+            glBufferSubData(GL_ARRAY_BUFFER, slot * OUTLINE_BYTES, len(data), data)
+            self.uploaded_bytes += len(data)
+            frame_profiler.count("snake_mesh_bytes", len(data))
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+    def _ranges(self):
+        """Returns the (first slot, slot count) ranges holding the body, at most two."""
+        if not self.count:
+            return []
+        slot = self.first_seq % self.capacity
+        head_part = min(self.count, self.capacity - slot)
+        ranges = [(slot, head_part)]
+        if head_part < self.count:
+            ranges.append((0, self.count - head_part))
+        return ranges
+
+    def draw(self, texture_id=None):
+        """Draws the body with the snake material and, unless outlines are off, its edges."""
+        if not self.count:
+            return
+
+        gl_state.enable(GL_LIGHTING)
+        use_cube_material(self.color, self.emission_level, texture_id)
+
+        glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
+        glEnableClientState(GL_VERTEX_ARRAY)
+        glEnableClientState(GL_NORMAL_ARRAY)
+        glEnableClientState(GL_TEXTURE_COORD_ARRAY)
+        glVertexPointer(3, GL_FLOAT, VERTEX_STRIDE, ctypes.c_void_p(0))
+        glNormalPointer(GL_FLOAT, VERTEX_STRIDE, ctypes.c_void_p(12))
+        glTexCoordPointer(2, GL_FLOAT, VERTEX_STRIDE, ctypes.c_void_p(24))
+        for slot, count in self._ranges():
+            glDrawArrays(GL_QUADS, slot * SLOT_VERTICES, count * SLOT_VERTICES)
+        glDisableClientState(GL_TEXTURE_COORD_ARRAY)
+        glDisableClientState(GL_NORMAL_ARRAY)
+
+        end_cube_material()
+
+        if render_options.outline_mode != "off":
+            use_unlit()
+            glColor3f(0.0, 0.0, 0.0)
+            gl_state.set_line_width(1.5)
+            glBindBuffer(GL_ARRAY_BUFFER, self.outline_vbo)
+            glVertexPointer(3, GL_FLOAT, 0, ctypes.c_void_p(0))
+            for slot, count in self._ranges():
+                glDrawArrays(
+                    GL_LINES, slot * OUTLINE_VERTICES, count * OUTLINE_VERTICES
+                )
+            gl_state.enable(GL_LIGHTING)
+
+        glDisableClientState(GL_VERTEX_ARRAY)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+    def draw_depth(self):
+        """Draws only the body's positions, for depth passes."""
+        if not self.count:
+            return
+
+        glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
+        glEnableClientState(GL_VERTEX_ARRAY)
+        glVertexPointer(3, GL_FLOAT, VERTEX_STRIDE, ctypes.c_void_p(0))
+        for slot, count in self._ranges():
+            glDrawArrays(GL_QUADS, slot * SLOT_VERTICES, count * SLOT_VERTICES)
+        glDisableClientState(GL_VERTEX_ARRAY)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
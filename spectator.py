@@ -0,0 +1,518 @@
+import ctypes
+import math
+from array import array
+from OpenGL.GL import *
+from config import *
+from graphics import (
+    CUBE_EDGE_POSITIONS,
+    CUBE_NORMALS,
+    CUBE_POSITIONS,
+    NO_EMISSION,
+    NO_LIGHT,
+    NO_SPECULAR,
+    draw_arrays,
+    emission_of,
+    float_array,
+    gl_resources,
+    gl_state,
+    rect_loop,
+    setup_lights,
+    setup_point_lights,
+    use_unlit,
+)
+from hud import HUD_PANEL
+from logic_2d import PlanarGame
+from logic_cube import CubeGame
+from profiler import frame_profiler
+from render_target import SceneTarget
+from snake_mesh import CUBE_VERTEX_DATA, SLOT_BYTES, SLOT_VERTICES, VERTEX_STRIDE
+from utils import mat_mul, rot_x, rot_y
+
+# Pixels between tiles and around the wall
+TILE_GAP = 4
+# Cube tiles are turned so the face holding the head looks at the viewer, then
+# tilted by this pitch and yaw in degrees so two neighbouring faces show as well
+CUBE_TILT = (25, -35)
+# Rotations undoing local_to_world's, so that each face ends up at the front
+FACE_VIEWS = {
+    0: [[1, 0, 0], [0, 1, 0], [0, 0, 1]],
+    1: rot_y(-90),
+    2: rot_y(180),
+    3: rot_y(90),
+    4: rot_x(90),
+    5: rot_x(-90),
+}
+IDENTITY = FACE_VIEWS[0]
+# A light from the viewer's upper left, as tiles have no point lights of their own
+WALL_LIGHT = ((-0.3, 0.5, 1.0, 0.0), (0.7, 0.7, 0.7, 1.0))
+
+
+def compose(*matrices):
+    """Returns the product of 3x3 matrices, the rightmost applied first as in mat_mul."""
+    columns = []
+    for axis in ((1, 0, 0), (0, 1, 0), (0, 0, 1)):
+        for m in reversed(matrices):
+            axis = mat_mul(m, axis)
+        columns.append(axis)
+    return [[columns[c][r] for c in range(3)] for r in range(3)]
+
+
+def bot_turn(game):
+    """Returns the turn, or None, that keeps the snake alive and gets closest to the food.
+
+    Distances are counted in cells on a planar board and in world units on the cube,
+    which follows the food around the edges.
+    """
+    if isinstance(game, CubeGame):
+        fx, fy, fz = game.local_to_world(*game.food)
+
+        def distance(cell):
+            x, y, z = game.local_to_world(*cell)
+            return (x - fx) ** 2 + (y - fy) ** 2 + (z - fz) ** 2
+
+    else:
+
+        def distance(cell):
+            return abs(cell[0] - game.food[0]) + abs(cell[1] - game.food[1])
+
+    best, best_distance = None, None
+    for turn in (None, "LEFT", "RIGHT"):
+        cell, _ = game.next_move(turn)
+        if game.is_free(cell):
+            d = distance(cell)
+            if best_distance is None or d < best_distance:
+                best, best_distance = turn, d
+    return best
+
+
+def use_wall_material(color, emission_level=0.0):
+    """Sets a flat lit material; the wall keeps to the fixed pipeline and no textures."""
+    gl_state.use_program(0)
+    gl_state.disable(GL_TEXTURE_2D)
+    gl_state.enable(GL_LIGHTING)
+    gl_state.set_material(GL_FRONT, GL_EMISSION, emission_of(color, emission_level))
+    gl_state.set_material(GL_FRONT, GL_SPECULAR, NO_SPECULAR)
+    gl_state.set_material(GL_FRONT, GL_SHININESS, 0.0)
+    glColor3f(*color)
+
+
+class SpectatorTile:
+    """One game on the wall: the rectangle it is drawn in and what of it is on the GPU.
+
+    The tile's transform from game to window coordinates is baked into the vertices
+    of its cubes, so every tile shares one projection and can be drawn in a batch
+    with the others. Its body lives in its own region of the wall's body buffer,
+    kept up to date like a SnakeMesh ring.
+    """
+
+    def __init__(self, game, index, base):
+        """Creates a tile for `game` whose body slots start at `base`."""
+        self.game = game
+        self.index = index
+        self.base = base
+        self.capacity = game.cell_count()
+        self.rect = (0, 0, 1, 1)
+        self.origin = (0.0, 0.0, 0.0)
+        self.scale = 1.0
+        self.face = None
+        self.view = IDENTITY
+        self.unit_cube = []
+        self.matrix = []
+        # Milliseconds until the game's next tick
+        self.timer = 0.0
+        self.version = None
+        self.epoch = None
+        self.synced_seq = 0
+        self.first_seq = 0
+        self.count = 0
+
+    def place(self, rect):
+        """Moves the tile to `rect`, (x, y, width, height) in pixels from bottom left."""
+        self.rect = rect
+        x, y, width, height = rect
+        game = self.game
+        if isinstance(game, CubeGame):
+            # Room for the cube's diagonal whichever way it is turned
+            self.scale = min(width, height) / 3.6
+            center = (0.0, 0.0, 0.0)
+        else:
+            board_w = game.GRID_X[1] - game.GRID_X[0] + 1
+            board_h = game.GRID_Y[1] - game.GRID_Y[0] + 1
+            self.scale = 0.95 * min(width / board_w, height / board_h)
+            center = (
+                (game.GRID_X[0] + game.GRID_X[1]) / 2.0,
+                (game.GRID_Y[0] + game.GRID_Y[1]) / 2.0,
+                0.0,
+            )
+        self.origin = (
+            x + width / 2.0 - center[0] * self.scale,
+            y + height / 2.0 - center[1] * self.scale,
+            0.0,
+        )
+        self.face = None
+        self.forget()
+
+    def forget(self):
+        """Marks everything of the tile as stale, so it is all written and drawn again."""
+        self.version = None
+        self.epoch = None
+
+    def orient(self):
+        """Turns a cube tile toward the face holding the head; returns True if it turned."""
+        if not isinstance(self.game, CubeGame):
+            face = None
+        else:
+            face = self.game.snake[0][0]
+        if face == self.face and self.unit_cube:
+            return False
+        self.face = face
+        if face is None:
+            self.view = IDENTITY
+        else:
+            pitch, yaw = CUBE_TILT
+            self.view = compose(rot_x(pitch), rot_y(yaw), FACE_VIEWS[face])
+        self.unit_cube = [
+            (mat_mul(self.view, v), mat_mul(self.view, n), t)
+            for v, n, t in CUBE_VERTEX_DATA
+        ]
+        # Column-major game-to-window matrix, for the shared board display lists
+        s, m = self.scale, self.view
+        self.matrix = (
+            [m[0][0] * s, m[1][0] * s, m[2][0] * s, 0.0]
+            + [m[0][1] * s, m[1][1] * s, m[2][1] * s, 0.0]
+            + [m[0][2] * s, m[1][2] * s, m[2][2] * s, 0.0]
+            + [self.origin[0], self.origin[1], self.origin[2], 1.0]
+        )
+        return True
+
+    def cube_data(self, cubes):
+        """Packs (x, y, z, scale) cubes of the game as vertices in window coordinates."""
+        data = array("f")
+        ox, oy, oz = self.origin
+        s = self.scale
+        for x, y, z, scale in cubes:
+            cx, cy, cz = mat_mul(self.view, (x, y, z))
+            cx, cy, cz = ox + cx * s, oy + cy * s, oz + cz * s
+            size = scale * s
+            for v, n, t in self.unit_cube:
+                data.extend(
+                    (
+                        cx + v[0] * size,
+                        cy + v[1] * size,
+                        cz + v[2] * size,
+                        n[0],
+                        n[1],
+                        n[2],
+                        t[0],
+                        t[1],
+                    )
+                )
+        return data
+
+    def ranges(self):
+        """Returns the (first slot, slot count) ranges of the body in the wall's buffer."""
+        if not self.count:
+            return []
+        slot = self.first_seq % self.capacity
+        head_part = min(self.count, self.capacity - slot)
+        ranges = [(self.base + slot, head_part)]
+        if head_part < self.count:
+            ranges.append((self.base, self.count - head_part))
+        return ranges
+
+
+class SpectatorWall:
+    """Many bot-played games at once, each in a tile of a grid filling the window.
+
+    The wall is kept in an offscreen target that is not cleared between frames, and
+    only the tiles whose game ticked since the last frame are cleared and redrawn;
+    the games tick at staggered times, so a frame redraws a few tiles and shows the
+    rest as they were. Boards are display lists shared by every tile of the same
+    mode and size. The bodies of all games are slots of one vertex buffer, each tick
+    uploading one segment per game, and are drawn with a single call for all the
+    tiles redrawn, as are the heads and the food.
+    """
+
+    def __init__(self, count=SPECTATOR_GAMES):
+        """Creates `count` games, planar and cube in turn; GL objects come on the first render."""
+        self.tiles = []
+        base = 0
+        for i in range(count):
+            game = PlanarGame() if i % 2 == 0 else CubeGame()
+            # Bots die all the time; their deaths are not worth a telemetry dump
+            game.telemetry.enabled = False
+            tile = SpectatorTile(game, i, base)
+            tile.timer = MOVE_DELAY * i / count
+            self.tiles.append(tile)
+            base += tile.capacity
+        self.slots = base
+        self.target = SceneTarget()
+        self.body_vbo = None
+        self.marks_vbo = None
+        self.boards = {}
+        self.deaths = 0
+        self.redrawn = 0
+
+    def reset(self):
+        """Starts every game over."""
+        for tile in self.tiles:
+            tile.game.reset()
+        self.deaths = 0
+
+    def update(self, dt):
+        """Advances the games whose tick is due after `dt` milliseconds.
+
+        A game whose snake died starts over on its next tick.
+        """
+        for tile in self.tiles:
+            tile.timer -= dt
+            if tile.timer > 0:
+                continue
+            # After a long frame, tick once and carry on from now
+            tile.timer = max(tile.timer + MOVE_DELAY, 0.0)
+            game = tile.game
+            turn = bot_turn(game)
+            if turn:
+                game.queue_turn(turn)
+            if not game.update():
+                self.deaths += 1
+                game.reset()
+            game.applied_inputs = []
+
+    def best_score(self):
+        """Returns the highest score among the games being played."""
+        return max(tile.game.score for tile in self.tiles)
+
+    def hud_lines(self):
+        """Returns the HUD panel's text lines, which only change on a point or a death."""
+        return [
+            (f"Games: {len(self.tiles)}  Best: {self.best_score()}", (255, 215, 0)),
+            (f"Deaths: {self.deaths}", (200, 200, 200)),
+        ]
+
+    def layout(self, size):
+        """Arranges the tiles in the grid below the HUD panel that makes them largest."""
+        width, height = size
+        height -= HUD_PANEL[1] + HUD_PANEL[3]
+        count = len(self.tiles)
+
+        def cell_size(cols):
+            rows = math.ceil(count / cols)
+            return (
+                max(1, (width - TILE_GAP) // cols - TILE_GAP),
+                max(1, (height - TILE_GAP) // rows - TILE_GAP),
+            )
+
+        cols = max(range(1, count + 1), key=lambda cols: min(cell_size(cols)))
+        tile_w, tile_h = cell_size(cols)
+        for tile in self.tiles:
+            row, col = divmod(tile.index, cols)
+            x = TILE_GAP + col * (tile_w + TILE_GAP)
+            y = height - (row + 1) * (tile_h + TILE_GAP)
+            tile.place((x, y, tile_w, tile_h))
+
+    def _allocate(self):
+        """Creates the body buffer with every game's slots, and the head and food buffer."""
+        self.body_vbo, self.marks_vbo = glGenBuffers(2)
+        glBindBuffer(GL_ARRAY_BUFFER, self.body_vbo)
+        bodies = self.slots * SLOT_BYTES
+        glBufferData(GL_ARRAY_BUFFER, bodies, None, GL_DYNAMIC_DRAW)
+        gl_resources.add("buffer", self.body_vbo, "spectator bodies", bodies)
+        # A head slot per tile, then a food slot per tile
+        marks = 2 * len(self.tiles) * SLOT_BYTES
+        glBindBuffer(GL_ARRAY_BUFFER, self.marks_vbo)
+        glBufferData(GL_ARRAY_BUFFER, marks, None, GL_DYNAMIC_DRAW)
+        gl_resources.add("buffer", self.marks_vbo, "spectator marks", marks)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+    def release(self):
+        """Deletes the wall's GL objects; the next render recreates and redraws them all."""
+        self.target.release()
+        if self.body_vbo is not None:
+            gl_resources.release("buffer", self.body_vbo)
+            gl_resources.release("buffer", self.marks_vbo)
+        self.body_vbo = None
+        self.marks_vbo = None
+        for fill_list, line_list in self.boards.values():
+            gl_resources.release("display_list", fill_list)
+            gl_resources.release("display_list", line_list)
+        self.boards = {}
+        for tile in self.tiles:
+            tile.forget()
+
+    def _sync(self, tile):
+        """Uploads the tile's new body segments, head and food."""
+        game = tile.game
+        turned = tile.orient()
+        body = len(game.snake) - 1
+        newest = game.head_seq - 1
+        oldest = newest - body + 1
+        if game.epoch != tile.epoch or turned:
+            tile.epoch = game.epoch
+            tile.synced_seq = oldest - 1
+
+        first = max(tile.synced_seq + 1, oldest)
+        glBindBuffer(GL_ARRAY_BUFFER, self.body_vbo)
+        seq = first
+        while seq <= newest:
+            slot = seq % tile.capacity
+            run = min(newest - seq + 1, tile.capacity - slot)
+            cubes = [
+                game.segment_cube(game.head_seq - s) for s in range(seq, seq + run)
+            ]
+            data = tile.cube_data(cubes).tobytes()
+            offset = (tile.base + slot) * SLOT_BYTES
+            glBufferSubData(GL_ARRAY_BUFFER, offset, len(data), data)
+            frame_profiler.count("spectator_bytes", len(data))
+            seq += run
+        tile.synced_seq = newest
+        tile.first_seq = oldest
+        tile.count = body
+
+        if isinstance(game, CubeGame):
+            food = game.local_to_world(*game.food) + (game.SCALE * 0.7,)
+        else:
+            food = (game.food[0], game.food[1], 0, 0.6 * CELL_SCALE_FACTOR)
+        glBindBuffer(GL_ARRAY_BUFFER, self.marks_vbo)
+        for slot, cube in (
+            (tile.index, game.segment_cube(0)),
+            (len(self.tiles) + tile.index, food),
+        ):
+            data = tile.cube_data([cube]).tobytes()
+            glBufferSubData(GL_ARRAY_BUFFER, slot * SLOT_BYTES, len(data), data)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+        tile.version = game.version
+
+    def _board_lists(self, game):
+        """Returns the fill and line display lists of a game's board, shared by its tiles."""
+        if isinstance(game, CubeGame):
+            key = ("cube",)
+        else:
+            key = ("planar", game.GRID_X, game.GRID_Y)
+        lists = self.boards.get(key)
+        if lists is not None:
+            return lists
+
+        fill_list = gl_resources.add("display_list", glGenLists(1), "spectator board")
+        line_list = gl_resources.add("display_list", glGenLists(1), "spectator board")
+        s = 1.01
+        if key[0] == "cube":
+            glNewList(fill_list, GL_COMPILE)
+            glColor3f(0.25, 0.25, 0.3)
+            draw_arrays(GL_QUADS, CUBE_POSITIONS * 2.0, CUBE_NORMALS)
+            glEndList()
+            lines = CUBE_EDGE_POSITIONS * (2.0 * s)
+        else:
+            x0, x1 = game.GRID_X[0] - 0.5, game.GRID_X[1] + 0.5
+            y0, y1 = game.GRID_Y[0] - 0.5, game.GRID_Y[1] + 0.5
+            glNewList(fill_list, GL_COMPILE)
+            glColor3f(0.2, 0.2, 0.2)
+            glNormal3f(0, 0, 1)
+            draw_arrays(GL_QUADS, rect_loop(x0, y0, x1, y1, -0.55))
+            glEndList()
+            # Each side of the border as a line of its own
+            lines = rect_loop(x0, y0, x1, y1, -0.5)[[0, 1, 1, 2, 2, 3, 3, 0]]
+        glNewList(line_list, GL_COMPILE)
+        glColor3f(*COLOR_BORDER)
+        draw_arrays(GL_LINES, lines)
+        glEndList()
+        self.boards[key] = (fill_list, line_list)
+        return self.boards[key]
+
+    def _draw_boards(self, tiles):
+        """Draws the boards of `tiles` from the shared lists, all fills before all lines."""
+        gl_state.use_program(0)
+        gl_state.disable(GL_TEXTURE_2D)
+        gl_state.enable(GL_LIGHTING)
+        # The lists are scaled to the tile, so their normals need renormalizing
+        gl_state.enable(GL_NORMALIZE)
+        gl_state.set_material(GL_FRONT, GL_EMISSION, NO_EMISSION)
+        gl_state.enable(GL_POLYGON_OFFSET_FILL)
+        gl_state.set_polygon_offset(2.0, 2.0)
+        for part in (0, 1):
+            if part:
+                gl_state.disable(GL_POLYGON_OFFSET_FILL)
+                use_unlit()
+                gl_state.set_line_width(1.5)
+            for tile in tiles:
+                glPushMatrix()
+                glMultMatrixf(tile.matrix)
+                glCallList(self._board_lists(tile.game)[part])
+                glPopMatrix()
+        gl_state.disable(GL_NORMALIZE)
+
+    def _draw_cubes(self, vbo, groups):
+        """Draws (color, emission, firsts, counts) groups of cube slots of `vbo`."""
+        glBindBuffer(GL_ARRAY_BUFFER, vbo)
+        glEnableClientState(GL_VERTEX_ARRAY)
+        glEnableClientState(GL_NORMAL_ARRAY)
+        glVertexPointer(3, GL_FLOAT, VERTEX_STRIDE, ctypes.c_void_p(0))
+        glNormalPointer(GL_FLOAT, VERTEX_STRIDE, ctypes.c_void_p(12))
+        for color, emission_level, firsts, counts in groups:
+            if firsts:
+                use_wall_material(color, emission_level)
+                glMultiDrawArrays(GL_QUADS, firsts, counts, len(firsts))
+        glDisableClientState(GL_NORMAL_ARRAY)
+        glDisableClientState(GL_VERTEX_ARRAY)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+        gl_state.set_material(GL_FRONT, GL_EMISSION, NO_EMISSION)
+
+    def render(self):
+        """Redraws the tiles whose game changed since they were drawn, then shows the wall."""
+        if self.body_vbo is None:
+            self._allocate()
+        if self.target.bind(DISPLAY_SIZE):
+            glClearColor(*COLOR_BG)
+            glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
+            self.layout(DISPLAY_SIZE)
+
+        tiles = [tile for tile in self.tiles if tile.version != tile.game.version]
+        self.redrawn = len(tiles)
+        frame_profiler.count("spectator_tiles", len(tiles))
+        if tiles:
+            self._redraw(tiles)
+        self.target.finish()
+
+    def _redraw(self, tiles):
+        """Clears and draws `tiles` in the offscreen target."""
+        glMatrixMode(GL_PROJECTION)
+        glLoadIdentity()
+        depth = max(DISPLAY_SIZE)
+        glOrtho(0, DISPLAY_SIZE[0], 0, DISPLAY_SIZE[1], -depth, depth)
+        glMatrixMode(GL_MODELVIEW)
+        glLoadIdentity()
+
+        glClearColor(*COLOR_BG)
+        gl_state.enable(GL_SCISSOR_TEST)
+        for tile in tiles:
+            glScissor(*tile.rect)
+            glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
+        gl_state.disable(GL_SCISSOR_TEST)
+
+        for tile in tiles:
+            self._sync(tile)
+
+        setup_lights(WALL_LIGHT[0])
+        glLightfv(GL_LIGHT0, GL_DIFFUSE, float_array(WALL_LIGHT[1]))
+        setup_point_lights([])
+        self._draw_boards(tiles)
+
+        bodies = ([], [])
+        for tile in tiles:
+            for slot, count in tile.ranges():
+                bodies[0].append(slot * SLOT_VERTICES)
+                bodies[1].append(count * SLOT_VERTICES)
+        heads = [tile.index * SLOT_VERTICES for tile in tiles]
+        food = [(len(self.tiles) + tile.index) * SLOT_VERTICES for tile in tiles]
+        marks = [SLOT_VERTICES] * len(tiles)
+
+        gl_state.enable(GL_POLYGON_OFFSET_FILL)
+        gl_state.set_polygon_offset(1.0, 1.0)
+        self._draw_cubes(self.body_vbo, [(COLOR_BODY, 0.2, *bodies)])
+        self._draw_cubes(
+            self.marks_vbo,
+            [(COLOR_HEAD, 0.5, heads, marks), (COLOR_FOOD, 0.5, food, marks)],
+        )
+        gl_state.disable(GL_POLYGON_OFFSET_FILL)
+        # The default directional light is dark again for the games
+        glLightfv(GL_LIGHT0, GL_DIFFUSE, NO_LIGHT)
@@ -0,0 +1,249 @@
+import json
+import os
+import queue
+import struct
+import threading
+import time
+from config import *
+
+# Flags of a tick record
+TICK_LEFT = 1
+TICK_RIGHT = 2
+TICK_ATE = 4
+TICK_DIED = 8
+TURN_FLAGS = {"LEFT": TICK_LEFT, "RIGHT": TICK_RIGHT}
+
+# Where the last ticks before each death are saved, unless TELEMETRY_DIR is set
+DUMP_DIR = TELEMETRY_DIR or os.path.join(
+    os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache")),
+    "snake3d",
+    "telemetry",
+)
+# Records handed to the writer at once when streaming every tick to TELEMETRY_STREAM
+STREAM_BATCH = 64
+
+# A binary stream is a sequence of chunks: this header, then `count` packed records
+CHUNK = struct.Struct("<4sBH")
+CHUNK_MAGIC = b"S3DT"
+
+_records = {}
+
+
+def tick_record(head_size):
+    """Returns the struct of one tick record for heads of `head_size` coordinates.
+
+    Fields: tick, head, snake length, score, flags, food spawn time and tick time
+    in microseconds.
+    """
+    if head_size not in _records:
+        _records[head_size] = struct.Struct(f"<I{head_size}hHHBff")
+    return _records[head_size]
+
+
+def decode_ticks(head_size, data):
+    """Returns the packed tick records in `data` as dictionaries, oldest first."""
+    ticks = []
+    for values in tick_record(head_size).iter_unpack(data):
+        tick, head = values[0], values[1 : 1 + head_size]
+        length, score, flags, food_us, tick_us = values[1 + head_size :]
+        turn = "LEFT" if flags & TICK_LEFT else "RIGHT" if flags & TICK_RIGHT else None
+        ticks.append(
+            {
+                "tick": tick,
+                "head": list(head),
+                "length": length,
+                "score": score,
+                "turn": turn,
+                "ate": bool(flags & TICK_ATE),
+                "died": bool(flags & TICK_DIED),
+                "food_us": round(food_us, 1),
+                "tick_us": round(tick_us, 1),
+            }
+        )
+    return ticks
+
+
+def read_stream(path):
+    """Returns the ticks of a TELEMETRY_STREAM file, JSON lines or binary."""
+    if path.endswith(".jsonl"):
+        with open(path, "r") as f:
+            return [json.loads(line) for line in f if line.strip()]
+    with open(path, "rb") as f:
+        data = f.read()
+    ticks = []
+    offset = 0
+    while offset < len(data):
+        magic, head_size, count = CHUNK.unpack_from(data, offset)
+        if magic != CHUNK_MAGIC:
+            raise ValueError(f"{path} is not a telemetry stream")
+        offset += CHUNK.size
+        end = offset + count * tick_record(head_size).size
+        ticks.extend(decode_ticks(head_size, data[offset:end]))
+        offset = end
+    return ticks
+
+
+class TickLog:
+    """The last ticks of one game, kept in a preallocated ring of packed records.
+
+    Recording a tick packs it into the ring in place, so keeping the history costs
+    no allocation and no I/O. When the snake dies the last TELEMETRY_DUMP_TICKS
+    records go to the telemetry writer, and with TELEMETRY_STREAM set every record
+    does, in batches.
+    """
+
+    def __init__(self, mode, head_size, capacity=TELEMETRY_TICKS):
+        """Creates an empty ring of `capacity` records for heads of `head_size` cells."""
+        self.mode = mode
+        self.head_size = head_size
+        self.record = tick_record(head_size)
+        self.capacity = capacity
+        self.data = bytearray(self.record.size * capacity)
+        self.enabled = TELEMETRY
+        # Records written since the start, and how many of them were streamed
+        self.count = 0
+        self.streamed = 0
+        self.tick = 0
+
+    def reset(self):
+        """Numbers the ticks of a new game from 1; earlier records stay in the ring."""
+        self.tick = 0
+
+    def add(self, head, length, score, flags, food_time, tick_time):
+        """Records a tick, times in seconds; a tick with TICK_DIED dumps the ring."""
+        if not self.enabled:
+            return
+        self.tick += 1
+        self.record.pack_into(
+            self.data,
+            self.count % self.capacity * self.record.size,
+            self.tick,
+            *head,
+            length,
+            score,
+            flags,
+            food_time * 1e6,
+            tick_time * 1e6,
+        )
+        self.count += 1
+        if TELEMETRY_STREAM and self.count - self.streamed >= STREAM_BATCH:
+            self.stream()
+        if flags & TICK_DIED:
+            self.dump()
+
+    def last(self, n):
+        """Returns the packed bytes of the last `n` records, oldest first."""
+        n = min(n, self.count, self.capacity)
+        size = self.record.size
+        end = self.count % self.capacity * size
+        start = end - n * size
+        if start >= 0:
+            return bytes(self.data[start:end])
+        return bytes(self.data[start + len(self.data) :]) + bytes(self.data[:end])
+
+    def stream(self):
+        """Hands the records not yet streamed to the writer."""
+        data = self.last(self.count - self.streamed)
+        self.streamed = self.count
+        telemetry_writer.stream(self.head_size, data)
+
+    def dump(self):
+        """Hands the last TELEMETRY_DUMP_TICKS records to the writer to save."""
+        if TELEMETRY_STREAM:
+            self.stream()
+        data = self.last(TELEMETRY_DUMP_TICKS)
+        telemetry_writer.dump(self.mode, self.head_size, data)
+
+
+class TelemetryWriter:
+    """Writes tick records on a background thread, so a tick never waits for the disk.
+
+    Streamed records are appended to TELEMETRY_STREAM, as JSON lines if its name ends
+    in .jsonl and as binary chunks otherwise. Each dump becomes a JSON lines file in
+    DUMP_DIR, of which the newest TELEMETRY_DUMPS_KEPT are kept.
+    """
+
+    def __init__(self, stream_path=TELEMETRY_STREAM, dump_dir=DUMP_DIR):
+        """Prepares the writer; its thread starts with the first records."""
+        self.stream_path = stream_path
+        self.dump_dir = dump_dir
+        self.jobs = queue.SimpleQueue()
+        self.thread = None
+        self.lock = threading.Lock()
+        self.dumps = 0
+        self.last_dump = None
+        self.failed = False
+
+    def stream(self, head_size, data):
+        """Queues packed records to append to the stream file."""
+        self._submit((self._write_stream, head_size, data))
+
+    def dump(self, mode, head_size, data):
+        """Queues packed records to save as a dump of their own."""
+        self._submit((self._write_dump, mode, head_size, data))
+
+    def close(self):
+        """Writes everything queued and stops the thread."""
+        with self.lock:
+            thread, self.thread = self.thread, None
+        if thread:
+            self.jobs.put(None)
+            thread.join()
+
+    def _submit(self, job):
+        """Queues a job, starting the thread if it is not running."""
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+        self.jobs.put(job)
+
+    def _run(self):
+        """Runs the queued jobs until close()."""
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            write, *args = job
+            # A job that fails is dropped; the thread keeps running the next ones
+            try:
+                write(*args)
+            except Exception as e:
+                if not self.failed:
+                    self.failed = True
+                    print(f"Warning: Could not write telemetry: {e}")
+
+    def _write_stream(self, head_size, data):
+        """Appends packed records to the stream file."""
+        if self.stream_path.endswith(".jsonl"):
+            with open(self.stream_path, "a") as f:
+                for tick in decode_ticks(head_size, data):
+                    f.write(json.dumps(tick) + "\n")
+        else:
+            count = len(data) // tick_record(head_size).size
+            with open(self.stream_path, "ab") as f:
+                f.write(CHUNK.pack(CHUNK_MAGIC, head_size, count) + data)
+
+    def _write_dump(self, mode, head_size, data):
+        """Saves packed records as a new dump and deletes the oldest dumps."""
+        os.makedirs(self.dump_dir, exist_ok=True)
+        self.dumps += 1
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        name = f"death-{stamp}-{os.getpid()}-{self.dumps}-{mode}.jsonl"
+        path = os.path.join(self.dump_dir, name)
+        with open(path, "w") as f:
+            for tick in decode_ticks(head_size, data):
+                f.write(json.dumps(tick) + "\n")
+        self.last_dump = path
+
+        dumps = [
+            os.path.join(self.dump_dir, name)
+            for name in os.listdir(self.dump_dir)
+            if name.startswith("death-") and name.endswith(".jsonl")
+        ]
+        dumps.sort(key=os.path.getmtime)
+        for old in dumps[:-TELEMETRY_DUMPS_KEPT]:
+            os.remove(old)
+
+
+telemetry_writer = TelemetryWriter()
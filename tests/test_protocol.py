@@ -0,0 +1,157 @@
+import asyncio
+import random
+import unittest
+from protocol import (
+    DELTA_ATE,
+    KEYFRAME_DEAD,
+    LENGTH,
+    MAX_MESSAGE,
+    MODE_CUBE,
+    MODE_PLANAR,
+    TURNS,
+    GameStream,
+    ProtocolError,
+    board_allowed,
+    encode_delta,
+    encode_keyframe,
+    read_message,
+)
+from server import Room, RoomClient
+
+
+class Writer:
+    """Stands in for a client's stream writer, keeping what a room writes to it."""
+
+    def __init__(self):
+        """Starts with nothing written and an empty send buffer."""
+        self.data = bytearray()
+        self.transport = self
+
+    def get_write_buffer_size(self):
+        """Returns 0: the client takes everything at once."""
+        return 0
+
+    def write(self, data):
+        """Keeps `data` as sent."""
+        self.data += data
+
+
+def play(mode, board, ticks, seed):
+    """Plays a room with random turns and one client.
+
+    Returns the bytes the client was sent and, after each tick, the room's tick and
+    its game's snake, food, score, head sequence number and whether it is alive.
+    """
+    rng = random.Random(seed)
+    room = Room("test", mode, board, 0.05, 50)
+    room.game.random.seed(seed)
+    room.game.reset()
+    writer = Writer()
+    room.clients.append(RoomClient(writer))
+    states = []
+    for _ in range(ticks):
+        if rng.random() < 0.3:
+            room.game.queue_turn(rng.choice(TURNS))
+        room.step()
+        game = room.game
+        state = (room.tick, list(game.snake), game.food, game.score, game.head_seq)
+        states.append((*state, room.alive))
+    return bytes(writer.data), states
+
+
+def read_all(data, count):
+    """Returns the payloads of the first `count` messages in `data`, and the rest."""
+
+    async def read():
+        reader = asyncio.StreamReader()
+        reader.feed_data(data)
+        reader.feed_eof()
+        payloads = [await read_message(reader) for _ in range(count)]
+        return payloads, await reader.read()
+
+    return asyncio.run(read())
+
+
+class GameStreamTest(unittest.TestCase):
+    """Clients rebuild a room's game exactly from its keyframes and deltas."""
+
+    def test_rooms_round_trip(self):
+        for mode, board in (
+            (MODE_PLANAR, (21, 17)),
+            (MODE_PLANAR, (201, 201)),
+            (MODE_CUBE, (8, 8)),
+        ):
+            data, states = play(mode, board, 3000, seed=board[0])
+            # A caught-up client gets one message per tick
+            payloads, rest = read_all(data, len(states))
+            self.assertEqual(rest, b"")
+            stream = GameStream(mode)
+            for i, (payload, state) in enumerate(zip(payloads, states)):
+                tick, snake, food, score, head_seq, alive = state
+                with self.subTest(mode=mode, board=board, tick=i):
+                    kind, _ = stream.apply(payload)
+                    self.assertIsNotNone(kind)
+                    received = (stream.tick, stream.food, stream.score, stream.head_seq)
+                    self.assertEqual(received, (tick, food, score, head_seq))
+                    self.assertEqual(stream.alive, alive)
+                    if alive:
+                        self.assertEqual(stream.snake, snake)
+
+    def test_delta_after_a_gap_waits_for_a_keyframe(self):
+        stream = GameStream(MODE_PLANAR)
+        delta = encode_delta(MODE_PLANAR, 5, 0, (1, 0))[LENGTH.size :]
+        self.assertEqual(stream.apply(delta), (None, 0))
+
+
+class MessageTest(unittest.TestCase):
+    """Messages that are cut short, too long or unknown are refused."""
+
+    def setUp(self):
+        """Encodes the keyframe of a new planar game at tick 7."""
+        game = Room("test", MODE_PLANAR, (21, 17), 0.05, 50).game
+        self.game = game
+        self.keyframe = encode_keyframe(MODE_PLANAR, 7, game)[LENGTH.size :]
+
+    def test_truncated_messages_are_refused(self):
+        delta = encode_delta(MODE_PLANAR, 8, DELTA_ATE, (1, 0))[LENGTH.size :]
+        for payload in (self.keyframe, delta):
+            for end in range(len(payload)):
+                # Each on a stream at tick 7, so a delta is read to its end
+                stream = GameStream(MODE_PLANAR)
+                stream.apply(self.keyframe)
+                with self.subTest(kind=payload[0], end=end):
+                    with self.assertRaises(ProtocolError):
+                        stream.apply(payload[:end])
+
+    def test_keyframe_can_carry_a_death(self):
+        stream = GameStream(MODE_PLANAR)
+        stream.apply(self.keyframe)
+        self.assertTrue(stream.alive)
+        dead = encode_keyframe(MODE_PLANAR, 8, self.game, KEYFRAME_DEAD)
+        stream.apply(dead[LENGTH.size :])
+        self.assertFalse(stream.alive)
+
+    def test_unknown_message_is_refused(self):
+        with self.assertRaises(ProtocolError):
+            GameStream(MODE_PLANAR).apply(b"\xff")
+
+    def test_oversized_length_is_refused(self):
+        data = LENGTH.pack(MAX_MESSAGE + 1) + b"\0" * 16
+        with self.assertRaises(ProtocolError):
+            read_all(data, 1)
+
+    def test_stream_cut_inside_a_message(self):
+        data = LENGTH.pack(len(self.keyframe)) + self.keyframe[:-1]
+        with self.assertRaises(asyncio.IncompleteReadError):
+            read_all(data, 1)
+
+    def test_board_limits(self):
+        self.assertTrue(board_allowed(MODE_PLANAR, (201, 5)))
+        self.assertFalse(board_allowed(MODE_PLANAR, (202, 17)))
+        self.assertTrue(board_allowed(MODE_CUBE, (64, 64)))
+        self.assertFalse(board_allowed(MODE_CUBE, (8, 9)))
+        self.assertFalse(board_allowed(MODE_CUBE, (3, 3)))
+
+
+if __name__ == "__main__":
+    unittest.main()
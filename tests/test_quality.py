@@ -0,0 +1,43 @@
+import unittest
+from contextlib import redirect_stdout
+from io import StringIO
+from graphics import render_options
+from quality import QUALITY_STEPS, QualityController
+
+
+class QualityLevelTest(unittest.TestCase):
+    """Quality levels lower the player's settings and give them back."""
+
+    def setUp(self):
+        """Leaves the render options as they were after each test."""
+        for name in {name for name, _ in QUALITY_STEPS}:
+            value = getattr(render_options, name)
+            self.addCleanup(setattr, render_options, name, value)
+        render_options.render_scale = 1.0
+        render_options.outline_mode = "batched"
+        self.controller = QualityController(16.0)
+
+    def set_level(self, level):
+        """Changes the level without printing the change."""
+        with redirect_stdout(StringIO()):
+            self.controller.set_level(level, "test")
+
+    def test_level_zero_restores_the_settings(self):
+        self.set_level(2)
+        self.assertEqual(render_options.render_scale, 0.75)
+        self.set_level(0)
+        self.assertEqual(render_options.render_scale, 1.0)
+
+    def test_player_change_at_a_level_is_kept(self):
+        self.set_level(2)
+        # As F4 would, while the level is lowered
+        render_options.outline_mode = "off"
+        self.set_level(3)
+        self.assertEqual(render_options.outline_mode, "off")
+        self.set_level(0)
+        self.assertEqual(render_options.outline_mode, "off")
+        self.assertEqual(render_options.render_scale, 1.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,189 @@
+import os
+import random
+import struct
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from io import StringIO
+import savegame
+from logic_2d import PlanarGame
+from logic_cube import CubeGame, cube_step
+from savegame import SaveError, load_game, read_resume, save_game, write_resume
+
+
+def saved_state(game):
+    """Returns what a save keeps of a game, for comparing a game with its reload."""
+    direction = game.dir_idx if isinstance(game, CubeGame) else game.direction
+    camera = (game.cam_pitch, game.cam_yaw, game.cam_zoom)
+    played = (game.score, game.head_seq, game.play_time)
+    return list(game.snake), game.food, direction, played, camera
+
+
+def random_game(rng):
+    """Returns a planar or cube game of random size, played for a random while."""
+    seed = rng.getrandbits(32)
+    if rng.random() < 0.5:
+        game = PlanarGame((rng.randint(5, 60), rng.randint(5, 60)), seed)
+    else:
+        game = CubeGame(rng.randint(4, 20), seed)
+    for _ in range(rng.randint(0, 200)):
+        if rng.random() < 0.3:
+            game.queue_turn(rng.choice(["LEFT", "RIGHT"]))
+        if not game.update():
+            game.reset()
+        # Saves along the way leave the incremental numbering to check
+        if rng.random() < 0.1:
+            save_game(game)
+    game.cam_pitch = rng.uniform(-90, 90)
+    game.cam_zoom = rng.uniform(-50, -3)
+    game.play_time = rng.uniform(0, 3600)
+    return game
+
+
+def is_valid(game):
+    """Tells whether a snake is a path of distinct cells on the board, off the food."""
+    snake = game.snake
+    if len(set(snake)) != len(snake) or game.food in snake:
+        return False
+    if isinstance(game, CubeGame):
+        n = game.N
+        cells = snake + [game.food]
+        if not all(0 <= f < 6 and 0 <= x < n and 0 <= y < n for f, x, y in cells):
+            return False
+        return all(
+            any(cube_step(n, a, d)[0] == b for d in range(4))
+            for a, b in zip(snake, snake[1:])
+        )
+    (x0, x1), (y0, y1) = game.GRID_X, game.GRID_Y
+    cells = snake + [game.food]
+    if not all(x0 <= x <= x1 and y0 <= y <= y1 for x, y in cells):
+        return False
+    return all(
+        abs(ax - bx) + abs(ay - by) == 1 for (ax, ay), (bx, by) in zip(snake, snake[1:])
+    )
+
+
+class RoundTripTest(unittest.TestCase):
+    """Saves of random games load back into the same game."""
+
+    def test_random_games_round_trip(self):
+        rng = random.Random(1)
+        for i in range(150):
+            game = random_game(rng)
+            data = save_game(game)
+            copy = load_game(data)
+            with self.subTest(game=i, mode=type(game).__name__):
+                self.assertEqual(saved_state(copy), saved_state(game))
+                self.assertEqual(copy.random.getstate(), game.random.getstate())
+                self.assertEqual(save_game(copy), data)
+
+                # Food appears in the same places, so both play on alike
+                plays = []
+                for played in (game, copy):
+                    ticks = [(played.update(), saved_state(played)) for _ in range(20)]
+                    plays.append(ticks)
+                self.assertEqual(plays[0], plays[1])
+
+    def test_load_into_existing_game(self):
+        game = PlanarGame((21, 17), seed=1)
+        for _ in range(5):
+            game.update()
+        data = save_game(game)
+        target = PlanarGame((21, 17), seed=2)
+        self.assertIs(load_game(data, target), target)
+        self.assertEqual(saved_state(target), saved_state(game))
+        self.assertEqual(target.random.getstate(), game.random.getstate())
+
+    def test_load_leaves_other_generators_alone(self):
+        other = CubeGame(8, seed=3)
+        state, other_state = random.getstate(), other.random.getstate()
+        load_game(save_game(PlanarGame((21, 17), seed=4)))
+        self.assertEqual(random.getstate(), state)
+        self.assertEqual(other.random.getstate(), other_state)
+
+    def test_other_board_is_refused(self):
+        data = save_game(PlanarGame((21, 17)))
+        with self.assertRaises(SaveError):
+            load_game(data, PlanarGame((21, 19)))
+        with self.assertRaises(SaveError):
+            load_game(data, CubeGame(8))
+
+
+class DamagedSaveTest(unittest.TestCase):
+    """Damaged saves are refused with SaveError or load as a valid game."""
+
+    def test_flipped_bits_and_truncation(self):
+        rng = random.Random(2)
+        for i in range(60):
+            data = save_game(random_game(rng))
+            for j in range(10):
+                damaged = bytearray(data)
+                if rng.random() < 0.3:
+                    del damaged[rng.randrange(len(damaged)) :]
+                else:
+                    damaged[rng.randrange(len(damaged))] ^= 1 << rng.randrange(8)
+                with self.subTest(game=i, damage=j):
+                    try:
+                        game = load_game(bytes(damaged))
+                    except SaveError:
+                        continue
+                    self.assertTrue(is_valid(game))
+                    # Not always the same bytes: unused fields are saved as zeros
+                    copy = load_game(save_game(game))
+                    self.assertEqual(saved_state(copy), saved_state(game))
+
+    def test_damaged_snake_is_refused(self):
+        game = PlanarGame((21, 17))
+        data = save_game(game)
+        number = savegame.board_cells(*savegame.game_board(game)).number
+        body = len(data) - 2 * len(game.snake)
+
+        def with_snake(cells):
+            """Returns the save with the snake's cells replaced, length unchanged."""
+            return data[:body] + struct.pack(f"<{len(cells)}H", *map(number.get, cells))
+
+        head, neck, tail = game.snake
+        for cells in (
+            (head, tail, neck),  # not a path
+            (head, neck, neck),  # a cell twice
+            (head, neck, game.food),  # on the food
+        ):
+            with self.subTest(snake=cells):
+                with self.assertRaises(SaveError):
+                    load_game(with_snake(cells))
+
+    def test_huge_board_is_refused_without_numbering_it(self):
+        data = bytearray(save_game(CubeGame(8)))
+        # Both board sizes, 8 -> 32776, as a flipped top bit would make them
+        struct.pack_into("<HH", data, 6, 32776, 32776)
+        cached = savegame.board_cells.cache_info().currsize
+        with self.assertRaises(SaveError):
+            load_game(bytes(data))
+        self.assertEqual(savegame.board_cells.cache_info().currsize, cached)
+
+
+class ResumeFileTest(unittest.TestCase):
+    """The paused game is kept in a file between runs."""
+
+    def test_write_read_and_remove(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "snake3d", "resume.sav")
+            self.assertIsNone(read_resume(path))
+            data = save_game(PlanarGame((21, 17)))
+            write_resume(data, path)
+            self.assertEqual(read_resume(path), data)
+            write_resume(None, path)
+            self.assertFalse(os.path.exists(path))
+
+    def test_foreign_file_is_ignored(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "resume.sav")
+            with open(path, "wb") as f:
+                f.write(b"not a save")
+            with redirect_stdout(StringIO()) as output:
+                self.assertIsNone(read_resume(path))
+            self.assertIn("Warning", output.getvalue())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,3 +1,4 @@
+import itertools
 import math
 from OpenGL.GL import *
 from OpenGL.GL.shaders import compileProgram, compileShader
@@ -31,15 +32,58 @@ def mat_mul(m, v):
     )
 
 
-def load_shader_program(vertex_path, fragment_path):
-    """Reads shader source files and compiles them into a shader program."""
+_state_versions = itertools.count(1)
+
+
+def next_state_version():
+    """Returns a new unique version number for a changed simulation state."""
+    return next(_state_versions)
+
+
+def read_shader_sources(vertex_path, fragment_path):
+    """Returns the text of a vertex and a fragment shader source file."""
     with open(vertex_path, "r") as f:
         vertex_src = f.read()
     with open(fragment_path, "r") as f:
         fragment_src = f.read()
+    return vertex_src, fragment_src
+
 
-    shader = compileProgram(
+def compile_shader_program(vertex_src, fragment_src):
+    """Compiles vertex and fragment shader sources into a shader program."""
+    return compileProgram(
         compileShader(vertex_src, GL_VERTEX_SHADER),
         compileShader(fragment_src, GL_FRAGMENT_SHADER),
     )
-    return shader
+
+
+def load_shader_program(vertex_path, fragment_path):
+    """Reads shader source files and compiles them into a shader program."""
+    return compile_shader_program(*read_shader_sources(vertex_path, fragment_path))
+
+
+def gl_mat_transform(m, p):
+    """Transforms a homogeneous point by a 4x4 column-major matrix read with glGetFloatv."""
+    return tuple(
+        m[0][i] * p[0] + m[1][i] * p[1] + m[2][i] * p[2] + m[3][i] * p[3]
+        for i in range(4)
+    )
+
+
+def gl_mat_mul(a, b):
+    """Multiplies two 4x4 column-major matrices (a * b), as read with glGetFloatv."""
+    return [
+        [sum(a[k][r] * b[c][k] for k in range(4)) for r in range(4)]
+        for c in range(4)
+    ]
+
+
+def gl_mat_rigid_inverse(m):
+    """Inverts a column-major rotation + translation matrix such as a camera view."""
+    inv = [[m[r][c] for r in range(3)] + [0.0] for c in range(3)]
+    t = m[3]
+    inv.append(
+        [-(m[r][0] * t[0] + m[r][1] * t[1] + m[r][2] * t[2]) for r in range(3)]
+        + [1.0]
+    )
+    return inv